@@ -1,19 +1,35 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_file
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_file, send_from_directory
 from flask_socketio import SocketIO, emit
-import json
 import psutil
 import threading
 import time
 import subprocess
 import os
 from datetime import datetime
-import re
-from src.instance import Instance, YoutubeInstance, CameraInstance
-from twilio.rest import Client
+import io
+from concurrent.futures import ThreadPoolExecutor
+from src.scheduler import CaptureScheduler
+from src import http_pool
+from src.frame_writer import frame_writer
+from src.batch_dispatcher import batch_dispatcher
+from src.detector_gate import detector_gate
+from src.push import EventPusher
+from src.settings import SettingsStore, build_instance as create_instance
+from src.frame_catalog import FrameCatalog
+from src.frame_cache import FrameCache, thumbnail_width
+from src.stream_resolver import stream_resolver
+from src.alerts import AlertEngine
+from src.detection_history import DetectionHistory
+from src.frame_archive import FrameArchive, ARCHIVE_RING_FRAMES
+from src.metrics import metrics
+from src.log import get_logger
+from src.notifiers import NotifierHub, NotificationError, create_notifier, alert_recipients, alert_message
 from dotenv import load_dotenv
 
 load_dotenv()
 
+log = get_logger('system')
+
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.urandom(24)
 socketio = SocketIO(app, cors_allowed_origins="*", logger=False, engineio_logger=False)
@@ -21,44 +37,163 @@ socketio = SocketIO(app, cors_allowed_origins="*", logger=False, engineio_logger
 # Serve static files from frames and images folders
 @app.route('/frames/<path:filename>')
 def serve_frame(filename):
-    return send_file(f'./frames/{filename}', mimetype='image/jpeg')
+    """
+    Serve a frame from the in-memory cache with its content hash as ETag, so unchanged
+    frames are answered with 304. ?w=<width> returns a cached thumbnail instead.
+    """
+    entry = frame_catalog.get(filename)
+    if entry is None:
+        return jsonify({'error': 'Frame not found'}), 404
+    width = thumbnail_width(request.args.get('w', type=int))
+    etag = f"{entry.content_hash}-{width}" if width else entry.content_hash
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    try:
+        data, content_hash = frame_cache.frame(entry, width)
+    except OSError:
+        return jsonify({'error': 'Frame not found'}), 404
+    if content_hash != entry.content_hash:
+        # A newer frame replaced this one after it was looked up; label the bytes actually sent
+        entry = frame_catalog.get(filename) or entry
+        if entry.content_hash != content_hash:
+            response = send_file(io.BytesIO(data), mimetype='image/jpeg', etag=False, conditional=False)
+            response.cache_control.no_cache = True
+            return response
+        etag = f"{entry.content_hash}-{width}" if width else entry.content_hash
+    response = send_file(io.BytesIO(data), mimetype='image/jpeg', etag=etag,
+                         last_modified=entry.mtime, conditional=True)
+    # The same URL gets new content every capture, so always revalidate
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/images/<path:filename>')
 def serve_image(filename):
-    return send_file(f'./images/{filename}', mimetype='image/jpeg')
+    return send_from_directory('./images', filename, mimetype='image/jpeg')
 
 SETTINGS_FILE = 'settings.json'
 
 instances_status = {}
 instance_objects = {}
+# Held while checking that an instance isn't running and launching it, so a restore and a
+# start request can't both launch the same instance
+launch_lock = threading.Lock()
 system_stats = {'cpu': 0, 'network_sent': 0, 'network_recv': 0}
-alerted_detections = {}  # Track last alert times per detection key
-ALERT_COOLDOWN_SECONDS = int(os.getenv('ALERT_COOLDOWN_SECONDS', '7200'))  # default 2 hours
-
-def load_settings():
+# 'scheduler' drives all instances from a shared worker pool, 'thread' keeps one thread per instance,
+# 'asyncio' runs camera instances on a single event loop (YouTube instances stay on the scheduler),
+# 'process' spreads instances over a pool of worker processes (see src/sharding.py)
+EXECUTION_MODE = os.getenv('EXECUTION_MODE', 'scheduler')
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', '32'))
+ASYNC_CAMERA_HOST_LIMIT = int(os.getenv('ASYNC_CAMERA_HOST_LIMIT', '4'))
+ASYNC_DETECTOR_HOST_LIMIT = int(os.getenv('ASYNC_DETECTOR_HOST_LIMIT', '64'))
+# Instances rebuilt at once when restoring the ones that were running at shutdown
+RESTORE_WORKERS = int(os.getenv('RESTORE_WORKERS', '16'))
+
+capture_scheduler = CaptureScheduler(max_workers=SCHEDULER_WORKERS) if EXECUTION_MODE in ('scheduler', 'asyncio') else None
+async_engine = None
+if EXECUTION_MODE == 'asyncio':
+    # aiohttp is only needed for this mode
+    from src.async_engine import AsyncCameraEngine
+    async_engine = AsyncCameraEngine(camera_host_limit=ASYNC_CAMERA_HOST_LIMIT, detector_host_limit=ASYNC_DETECTOR_HOST_LIMIT)
+shard_pool = None
+if EXECUTION_MODE == 'process':
+    from src.sharding import ShardPool
+    shard_pool = ShardPool()
+
+event_pusher = EventPusher(socketio)
+
+settings_store = SettingsStore(SETTINGS_FILE)
+frame_catalog = FrameCatalog()
+frame_cache = FrameCache()
+
+notifier_hub = NotifierHub(create_notifier())
+
+def send_alert(alert):
+    """Send an alert to everyone registered for its instance who has not received it yet"""
+    groups = settings_store.snapshot().get('alert_groups', {})
+    recipients = [to for to in alert_recipients(alert.config, groups) if to not in alert.delivered_to]
+    if not recipients:
+        log.warning("No recipients configured for %s, skipping WhatsApp alert", alert.instance_name, extra={'instance': alert.instance_name})
+        return
     try:
-        with open(SETTINGS_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {"instances": []}
-
-def save_settings(settings):
-    with open(SETTINGS_FILE, 'w') as f:
-        json.dump(settings, f, indent=4)
-
-
-
-def extract_youtube_id(url):
-    patterns = [
-        r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/)([^&\n?#]+)',
-        r'youtube\.com\/watch\?.*v=([^&\n?#]+)'
-    ]
+        delivered = notifier_hub.notify(recipients, alert_message(alert.instance_name, alert.latitude, alert.longitude))
+    except NotificationError as e:
+        alert.delivered_to.update(e.delivered)
+        raise
+    alert.delivered_to.update(delivered)
+
+alert_engine = AlertEngine(send_alert, settings_store.find)
+detection_history = DetectionHistory()
+frame_archive = FrameArchive()
+
+
+def build_instance(instance_config):
+    """Create the instance object described by a settings entry, with its archive ring"""
+    if shard_pool is not None:
+        instance_obj = shard_pool.proxy(instance_config)
+    else:
+        instance_obj = create_instance(instance_config)
+    instance_obj.archive_ring = frame_archive.ring(instance_obj.name, instance_config.get('archive_frames', ARCHIVE_RING_FRAMES))
+    return instance_obj
+
+def publish_instance_event(instance_obj, event, payload):
+    """Forward frame/detection updates from an instance to connected dashboards"""
+    if event == 'frame_updated':
+        # Instances in worker processes hand frames over in shared memory instead of ./frames
+        frame_catalog.register(instance_obj.name, instance_obj.instance_type, instance_obj.image_file,
+                               payload['modified_at'], payload['size'], payload['hash'],
+                               reader=getattr(instance_obj, 'frame_bytes', None))
+    event_pusher.publish(event, instance_obj.name, payload)
+
+def launch_instance(instance_name, instance_obj, immediate=True):
+    """Hand an instance to the configured execution engine and track it as running"""
+    instance_obj.add_listener(publish_instance_event)
+    instance_obj.add_listener(alert_engine.handle_event)
+    instance_obj.add_listener(detection_history.handle_event)
+    instance_obj.add_listener(frame_archive.handle_event)
+    instance_thread = None
+    if shard_pool is not None:
+        shard_pool.add(instance_obj, immediate=immediate)
+    elif async_engine is not None and instance_obj.instance_type == 'camera':
+        async_engine.add(instance_obj, immediate=immediate)
+    elif capture_scheduler is not None:
+        capture_scheduler.add(instance_obj, immediate=immediate)
+    else:
+        instance_thread = threading.Thread(target=instance_obj.start, daemon=True)
+        instance_thread.start()
     
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-    return None
+    instance_objects[instance_name] = instance_obj
+    instances_status[instance_name] = {
+        'status': 'running',
+        'start_time': datetime.now(),
+        'thread': instance_thread
+    }
+
+def halt_instance(instance_name):
+    """Stop a running instance and forget about it. Returns the stopped instance, if any."""
+    instance_obj = instance_objects.pop(instance_name, None)
+    if instance_obj is not None:
+        instance_obj.stop()
+        if shard_pool is not None:
+            shard_pool.remove(instance_name)
+        if async_engine is not None:
+            async_engine.remove(instance_name)
+        if capture_scheduler is not None:
+            capture_scheduler.remove(instance_name)
+    instances_status.pop(instance_name, None)
+    return instance_obj
+
+monitor_thread = None
+monitor_lock = threading.Lock()
+
+def ensure_monitor():
+    """Start sampling system stats once something wants them (a dashboard or /metrics)"""
+    global monitor_thread
+    with monitor_lock:
+        if monitor_thread is None:
+            monitor_thread = threading.Thread(target=monitor_system, daemon=True, name='monitor')
+            monitor_thread.start()
 
 def monitor_system():
     global system_stats
@@ -75,93 +210,109 @@ def monitor_system():
             
             # Emit system stats to connected clients
             socketio.emit('system_stats', system_stats)
+            socketio.emit('pipeline_metrics', metrics.snapshot())
             
         except Exception as e:
-            print(f"Error monitoring system: {e}")
+            log.error("Error monitoring system: %s", e)
         
         time.sleep(5)  # Increased interval to reduce spam
 
-def restore_running_instances():
-    settings = load_settings()
-    for instance_config in settings.get('instances', []):
-        if instance_config.get('status') == 'running':
-            instance_name = instance_config['name']
-            try:
-                # Determine instance type and create appropriate instance
-                instance_type = instance_config.get('instance_type', 'youtube')
-                
-                if instance_type == 'youtube':
-                    instance_obj = YoutubeInstance(
-                        id=instance_config['name'],
-                        name=instance_config['name'],
-                        youtube_url=instance_config['youtube_url'],
-                        lookout_endpoint=instance_config['lookout_endpoint'],
-                        frequency=instance_config['frequency'],
-                        latitude=instance_config.get('latitude', 0.0),
-                        longitude=instance_config.get('longitude', 0.0)
-                    )
-                elif instance_type == 'camera':
-                    instance_obj = CameraInstance(
-                        id=instance_config['name'],
-                        name=instance_config['name'],
-                        camera_url=instance_config['camera_url'],
-                        lookout_endpoint=instance_config['lookout_endpoint'],
-                        camera_username=instance_config['camera_username'],
-                        camera_password=instance_config['camera_password'],
-                        folder_path=instance_config['folder_path'],
-                        frequency=instance_config['frequency'],
-                        latitude=instance_config.get('latitude', 0.0),
-                        longitude=instance_config.get('longitude', 0.0)
-                    )
-                else:
-                    print(f"[SYSTEM] Unknown instance type '{instance_type}' for instance '{instance_name}'")
-                    continue
-                
-                instance_thread = threading.Thread(target=instance_obj.start, daemon=True)
-                instance_thread.start()
-                
-                instance_objects[instance_name] = instance_obj
-                instances_status[instance_name] = {
-                    'status': 'running',
-                    'start_time': datetime.now(),
-                    'thread': instance_thread
-                }
-                
-                print(f"[SYSTEM] Restored running instance '{instance_name}'")
-                
-            except Exception as e:
-                print(f"[SYSTEM] Failed to restore instance '{instance_name}': {e}")
-                instance_config['status'] = 'stopped'
-                save_settings(settings)
+# Progress of restoring the instances that were running at shutdown, per instance:
+# 'pending', 'restored', 'skipped' (started or stopped meanwhile) or 'failed'
+restore_progress = {'total': 0, 'restored': 0, 'failed': 0, 'done': False, 'started_at': None,
+                    'finished_at': None, 'instances': {}}
+restore_lock = threading.Lock()
 
-monitor_thread = threading.Thread(target=monitor_system, daemon=True)
-monitor_thread.start()
+def restore_summary():
+    with restore_lock:
+        return {key: value for key, value in restore_progress.items() if key != 'instances'}
 
-restore_running_instances()
+def restore_instance(instance_config):
+    instance_name = instance_config['name']
+    state = 'failed'
+    try:
+        instance_obj = build_instance(instance_config)
+        with launch_lock:
+            current = settings_store.get(instance_name)
+            if instance_name in instance_objects or not current or current.get('status') != 'running':
+                state = 'skipped'
+            else:
+                # Wait for each instance's slot so a restart doesn't capture everything at once
+                launch_instance(instance_name, instance_obj, immediate=False)
+                state = 'restored'
+        if state == 'restored':
+            log.info("Restored running instance '%s'", instance_name)
+    except Exception as e:
+        log.error("Failed to restore instance '%s': %s", instance_name, e)
+        settings_store.update(instance_name, {'status': 'stopped'})
+    with restore_lock:
+        restore_progress['instances'][instance_name] = state
+        if state in ('restored', 'failed'):
+            restore_progress[state] += 1
+    socketio.emit('restore_progress', {'name': instance_name, 'state': state, **restore_summary()})
+
+def restore_running_instances():
+    """
+    Bring back the instances that were running at shutdown, RESTORE_WORKERS at a time,
+    while the server is already answering requests. Progress is kept in restore_progress
+    and sent to dashboards as each instance comes back.
+    """
+    configs = [c for c in settings_store.instances() if c.get('status') == 'running']
+    with restore_lock:
+        restore_progress.update(total=len(configs), started_at=time.time(),
+                                instances={c['name']: 'pending' for c in configs})
+    if configs:
+        with ThreadPoolExecutor(max_workers=RESTORE_WORKERS, thread_name_prefix='restore') as executor:
+            list(executor.map(restore_instance, configs))
+    with restore_lock:
+        restore_progress.update(done=True, finished_at=time.time())
+    summary = restore_summary()
+    log.info("Restored %d of %d running instances in %.1fs", summary['restored'], summary['total'],
+             summary['finished_at'] - summary['started_at'])
+    socketio.emit('restore_complete', summary)
+
+def resolve_frame_instance(base):
+    instance_config = settings_store.find(base)
+    return instance_config.get('name', '') if instance_config else None
+
+# Frames left over from a previous run are listed until their instance writes a new one
+frame_catalog.scan('./frames', resolve_frame_instance)
+
+threading.Thread(target=restore_running_instances, daemon=True, name='restore').start()
 
 @app.route('/')
 def index():
-    settings = load_settings()
+    settings = settings_store.snapshot()
     return render_template('index.html', settings=settings)
 
 
 
+# Optional settings for adaptive sampling, stored as given
+ADAPTIVE_FIELDS = ('adaptive', 'min_frequency', 'max_frequency', 'adaptive_score_threshold', 'daylight_hours')
+
 @app.route('/api/instances', methods=['GET'])
 def get_instances():
     try:
-        settings = load_settings()
+        settings = settings_store.snapshot()
+        # Running instances report the interval they are actually capturing at
+        for instance_config in settings['instances']:
+            instance_obj = instance_objects.get(instance_config['name'])
+            if instance_obj is not None:
+                stats = instance_obj.stats()
+                instance_config['effective_frequency'] = stats.get('effective_frequency', instance_config['frequency'])
+                if 'sampling' in stats:
+                    instance_config['sampling'] = stats['sampling']
+                instance_config['detector_circuit'] = stats.get('detector_circuit', 'closed')
         return jsonify(settings)
     except Exception as e:
-        print(f"Error in get_instances: {e}")
+        log.error("Error in get_instances: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/instances', methods=['POST'])
 def add_instance():
     
     data = request.get_json()
-    settings = load_settings()
-    
-    existing_names = [instance['name'] for instance in settings['instances']]
+    existing_names = settings_store.names()
     new_name = data.get('name', f"Instance-{len(existing_names) + 1}")
     
     counter = 1
@@ -184,9 +335,9 @@ def add_instance():
         'longitude': data.get('longitude', 0.0),
         'status': 'stopped'
     }
+    new_instance.update({key: data[key] for key in ADAPTIVE_FIELDS if key in data})
     
-    settings['instances'].append(new_instance)
-    save_settings(settings)
+    settings_store.add(new_instance)
     
     socketio.emit('instance_added', new_instance)
     return jsonify(new_instance)
@@ -195,10 +346,9 @@ def add_instance():
 def update_instance(instance_name):
     
     data = request.get_json()
-    settings = load_settings()
     
-    for instance in settings['instances']:
-        if instance['name'] == instance_name:
+    with settings_store.mutate(instance_name) as instance:
+        if instance is not None:
             instance.update({
                 'instance_type': data.get('instance_type', instance.get('instance_type', 'youtube')),
                 'frequency': data.get('frequency', instance['frequency']),
@@ -206,6 +356,7 @@ def update_instance(instance_name):
                 'latitude': data.get('latitude', instance.get('latitude', 0.0)),
                 'longitude': data.get('longitude', instance.get('longitude', 0.0))
             })
+            instance.update({key: data[key] for key in ADAPTIVE_FIELDS if key in data})
             
             # Update type-specific fields
             if instance['instance_type'] == 'youtube':
@@ -215,92 +366,63 @@ def update_instance(instance_name):
                 instance['camera_username'] = data.get('camera_username', instance.get('camera_username', ''))
                 instance['camera_password'] = data.get('camera_password', instance.get('camera_password', ''))
                 instance['folder_path'] = data.get('folder_path', instance.get('folder_path', './images'))
-            break
     
-    save_settings(settings)
     socketio.emit('instance_updated', {'name': instance_name, 'data': data})
     return jsonify({'success': True})
 
 @app.route('/api/instances/<instance_name>', methods=['DELETE'])
 def delete_instance(instance_name):
     
-    if instance_name in instance_objects:
-        instance_obj = instance_objects[instance_name]
-        instance_obj.stop()
-        del instance_objects[instance_name]
-        print(f"[SYSTEM] Stopped instance '{instance_name}' before deletion")
-    
-    if instance_name in instances_status:
-        del instances_status[instance_name]
+    if halt_instance(instance_name) is not None:
+        log.info("Stopped instance '%s' before deletion", instance_name)
     
-    settings = load_settings()
-    settings['instances'] = [inst for inst in settings['instances'] if inst['name'] != instance_name]
-    save_settings(settings)
+    settings_store.remove(instance_name)
+    metrics.remove(instance_name)
+    alert_engine.remove_instance(instance_name)
     
     socketio.emit('instance_deleted', {'name': instance_name})
     return jsonify({'success': True})
 
+@app.route('/api/instances/<instance_name>/stats', methods=['GET'])
+def get_instance_stats(instance_name):
+    """Counters for a running instance"""
+    instance_obj = instance_objects.get(instance_name)
+    if instance_obj is None:
+        return jsonify({'error': 'Instance not running'}), 404
+    return jsonify(instance_obj.stats())
+
 @app.route('/api/instances/<instance_name>/start', methods=['POST'])
 def start_instance(instance_name):
     
     if instance_name in instances_status and instances_status[instance_name]['status'] == 'running':
         return jsonify({'error': 'Instance already running'}), 400
     
-    settings = load_settings()
-    instance_config = next((inst for inst in settings['instances'] if inst['name'] == instance_name), None)
+    instance_config = settings_store.get(instance_name)
     
     if not instance_config:
         return jsonify({'error': 'Instance not found'}), 404
     
     try:
-        # Determine instance type and create appropriate instance
-        instance_type = instance_config.get('instance_type', 'youtube')
-        
-        if instance_type == 'youtube':
-            instance_obj = YoutubeInstance(
-                id=instance_config['name'],
-                name=instance_config['name'],
-                youtube_url=instance_config['youtube_url'],
-                lookout_endpoint=instance_config['lookout_endpoint'],
-                frequency=instance_config['frequency'],
-                latitude=instance_config.get('latitude', 0.0),
-                longitude=instance_config.get('longitude', 0.0)
-            )
-        elif instance_type == 'camera':
-            instance_obj = CameraInstance(
-                id=instance_config['name'],
-                name=instance_config['name'],
-                camera_url=instance_config['camera_url'],
-                lookout_endpoint=instance_config['lookout_endpoint'],
-                camera_username=instance_config['camera_username'],
-                camera_password=instance_config['camera_password'],
-                folder_path=instance_config['folder_path'],
-                frequency=instance_config['frequency'],
-                latitude=instance_config.get('latitude', 0.0),
-                longitude=instance_config.get('longitude', 0.0)
-            )
-        else:
-            return jsonify({'error': f'Unknown instance type: {instance_type}'}), 400
-        
-        instance_thread = threading.Thread(target=instance_obj.start, daemon=True)
-        instance_thread.start()
+        try:
+            instance_obj = build_instance(instance_config)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        instance_objects[instance_name] = instance_obj
-        instances_status[instance_name] = {
-            'status': 'running',
-            'start_time': datetime.now(),
-            'thread': instance_thread
-        }
+        with launch_lock:
+            # A restore may have brought it back while it was being built
+            if instance_name in instance_objects:
+                instance_obj.stop()
+                return jsonify({'error': 'Instance already running'}), 400
+            launch_instance(instance_name, instance_obj)
         
-        instance_config['status'] = 'running'
-        save_settings(settings)
+        settings_store.update(instance_name, {'status': 'running'})
         
-        print(f"[SYSTEM] Started instance '{instance_name}' with frequency {instance_config['frequency']}s")
+        log.info("Started instance '%s' with frequency %ss", instance_name, instance_config['frequency'])
         socketio.emit('instance_status_changed', {'name': instance_name, 'status': 'running'})
         return jsonify({'success': True, 'status': 'running'})
         
     except Exception as e:
-        print(f"[SYSTEM] Error starting instance '{instance_name}': {e}")
+        log.error("Error starting instance '%s': %s", instance_name, e)
         return jsonify({'error': f'Failed to start instance: {str(e)}'}), 500
 
 @app.route('/api/instances/<instance_name>/stop', methods=['POST'])
@@ -308,90 +430,115 @@ def stop_instance(instance_name):
     
     try:
         instance_type = None
-        if instance_name in instance_objects:
-            instance_obj = instance_objects[instance_name]
+        instance_obj = halt_instance(instance_name)
+        if instance_obj is not None:
             instance_type = instance_obj.instance_type
-            instance_obj.stop()
-            del instance_objects[instance_name]
-            print(f"[SYSTEM] Stopped instance '{instance_name}'")
-        
-        if instance_name in instances_status:
-            del instances_status[instance_name]
+            log.info("Stopped instance '%s'", instance_name)
         
-        settings = load_settings()
-        instance_config = next((inst for inst in settings['instances'] if inst['name'] == instance_name), None)
-        if instance_config:
-            instance_config['status'] = 'stopped'
-            save_settings(settings)
+        settings_store.update(instance_name, {'status': 'stopped'})
         
         socketio.emit('instance_status_changed', {'name': instance_name, 'status': 'stopped'})
         
         # Only try to remove frame file if we know the instance type
-        if instance_type and os.path.exists(f"./frames/{instance_type}_{instance_name.lower().replace(' ', '')}.jpg"):
-            os.remove(f"./frames/{instance_type}_{instance_name.lower().replace(' ', '')}.jpg")
+        frame_file = f"./frames/{instance_type}_{instance_name.lower().replace(' ', '')}.jpg"
+        if instance_type:
+            frame_writer.cancel(frame_file)
+            frame_catalog.remove(frame_file)
+        if instance_type and os.path.exists(frame_file):
+            os.remove(frame_file)
         
         return jsonify({'success': True, 'status': 'stopped'})
         
     except Exception as e:
-        print(f"[SYSTEM] Error stopping instance '{instance_name}': {e}")
+        log.error("Error stopping instance '%s': %s", instance_name, e)
         return jsonify({'error': f'Failed to stop instance: {str(e)}'}), 500
     
 
 
+@app.route('/api/scheduler', methods=['GET'])
+def get_scheduler_stats():
+    """Per-instance lag and late-capture counters from the capture scheduler"""
+    stats = capture_scheduler.stats() if capture_scheduler is not None else {'instances': {}}
+    stats['mode'] = EXECUTION_MODE
+    if async_engine is not None:
+        stats['async'] = async_engine.stats()
+    if shard_pool is not None:
+        stats['sharding'] = shard_pool.stats()
+    return jsonify(stats)
+
+@app.route('/api/connections', methods=['GET'])
+def get_connection_stats():
+    """Pooled connection reuse per HTTP endpoint"""
+    return jsonify({'endpoints': http_pool.connection_stats()})
+
+@app.route('/api/batching', methods=['GET'])
+def get_batching_stats():
+    """How many detector posts went out batched vs. individually"""
+    return jsonify(batch_dispatcher.stats())
+
+@app.route('/api/detectors', methods=['GET'])
+def get_detector_stats():
+    """Circuit state, posts in flight and dropped frames per lookout endpoint"""
+    stats = {'endpoints': detector_gate.stats()}
+    if shard_pool is not None:
+        stats['shards'] = shard_pool.detector_stats()
+    return jsonify(stats)
+
+@app.route('/api/restore', methods=['GET'])
+def get_restore_progress():
+    """How far restoring the instances that were running at shutdown has got"""
+    with restore_lock:
+        return jsonify({**restore_progress, 'instances': dict(restore_progress['instances'])})
+
+@app.route('/api/streams', methods=['GET'])
+def get_stream_stats():
+    """YouTube stream URL cache hits and resolve latency"""
+    return jsonify(stream_resolver.stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Pipeline timings and counters in the Prometheus text format. In process mode the
+    worker counters are the ones last reported; ?refresh=1 asks the workers for fresh ones first.
+    """
+    ensure_monitor()
+    if shard_pool is not None and request.args.get('refresh', type=int):
+        # Worker processes otherwise report only every SHARD_STATS_INTERVAL seconds
+        shard_pool.refresh_stats()
+    gauges = {
+        'cpu_percent': ('Process host CPU usage', system_stats['cpu']),
+        'running_instances': ('Instances currently running', len(instance_objects)),
+        'frame_writer_queued': ('Frames waiting to be written to disk', frame_writer.stats()['queued']),
+        'alert_queue_length': ('Alerts waiting to be delivered', alert_engine.stats()['queued']),
+        'detection_history_queued': ('Detections waiting to be logged', detection_history.stats()['queued']),
+    }
+    return app.response_class(metrics.prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/alerts', methods=['GET'])
+def get_alert_stats():
+    """Alert evaluation and delivery counters"""
+    return jsonify(dict(alert_engine.stats(), notifier=notifier_hub.stats()))
+
 @app.route('/api/images', methods=['GET'])
 def get_images():
-    """Get list of all images from frames folder"""
-    images = []
-
-    # Build a lookup of normalized instance names -> display/original name
-    settings = load_settings()
-    normalized_to_instance = {}
-    for inst in settings.get('instances', []):
-        normalized = inst.get('name', '').lower().replace(' ', '')
-        normalized_to_instance[normalized] = inst.get('name', '')
-    
-    # Get all jpg files from frames folder
-    if os.path.exists('./frames'):
-        for filename in os.listdir('./frames'):
-            if filename.endswith('.jpg'):
-                full_path = os.path.join('./frames', filename)
-                try:
-                    mtime = os.path.getmtime(full_path)
-                    modified_iso = datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
-                except Exception:
-                    mtime = 0
-                    modified_iso = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-                # Extract instance name from filename (e.g., youtube_sprayvalley.jpg -> Spray Valley)
-                if filename.startswith('youtube_'):
-                    base = filename.replace('youtube_', '').replace('.jpg', '')
-                    source_name = base.replace('_', ' ').title()
-                    instance_type = 'youtube'
-                elif filename.startswith('camera_'):
-                    base = filename.replace('camera_', '').replace('.jpg', '')
-                    source_name = base.replace('_', ' ').title()
-                    instance_type = 'camera'
-                else:
-                    base = filename.replace('.jpg', '')
-                    source_name = base.replace('_', ' ').title()
-                    instance_type = 'unknown'
-
-                normalized_base = base.lower().replace('_', '')
-                instance_name = normalized_to_instance.get(normalized_base, None)
-
-                images.append({
-                    'url': f'/frames/{filename}',
-                    'source': source_name,
-                    'type': instance_type,
-                    # Show file modified time in UI
-                    'timestamp': modified_iso,
-                    # Machine-friendly version for change detection
-                    'modified_at': mtime,
-                    # Exact instance name used by detections payload (if mapped)
-                    'instance': instance_name
-                })
-
-    return jsonify({'images': images})
+    """
+    Get list of all images from the frame catalog. With ?since=<version> only frames that
+    changed after that catalog version are returned, plus the URLs of removed frames.
+    """
+    since = request.args.get('since', type=int)
+    etag = f"frames-{frame_catalog.version}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    images, removed, version = frame_catalog.changes(since)
+    payload = {'images': images, 'version': version}
+    if since is not None:
+        payload['removed'] = removed
+    response = jsonify(payload)
+    response.set_etag(f"frames-{version}")
+    return response
 
 @app.route('/api/detections', methods=['GET'])
 def get_all_detections():
@@ -399,12 +546,12 @@ def get_all_detections():
     detections = {}
     
     # Only proceed if there is at least one frame image present
-    images_exist = os.path.exists('./frames') and any(fn.endswith('.jpg') for fn in os.listdir('./frames'))
+    images_exist = len(frame_catalog) > 0
     if not images_exist:
         return jsonify({'detections': {}})
 
     # Get real detection results from running instances (only include non-empty results)
-    for instance_name, instance_obj in instance_objects.items():
+    for instance_name, instance_obj in list(instance_objects.items()):
         det_payload = instance_obj.latest_detections
         if isinstance(det_payload, dict):
             results = det_payload.get('results', []) or []
@@ -425,92 +572,91 @@ def get_all_detections():
             ]
         }
     
-    # Check for detections and trigger WhatsApp alert per instance
-    for instance_name, det in detections.items():
-        results = det.get('results', []) or []
-        if not results:
-            continue
-        
-        # Iterate over all results for this instance
-        for r in results:
-            score = r.get('score', 0)
-            if score < 0.5:
-                continue
-            left = r.get('left')
-            top = r.get('top')
-            # Unique key per instance and location (rounded score to reduce key churn)
-            detection_key = f"{instance_name.lower().replace(' ', '_')}_{left}_{top}_{round(score, 2)}"
-            
-            now = datetime.now()
-            last_sent = alerted_detections.get(detection_key)
-            # checking if there was a last detection for this instance/source
-            should_send = (last_sent is None) or ((now - last_sent).total_seconds() >= ALERT_COOLDOWN_SECONDS)
-            
-            if not should_send:
-                if last_sent is not None:
-                    remaining = ALERT_COOLDOWN_SECONDS - int((now - last_sent).total_seconds())
-                else:
-                    remaining = ALERT_COOLDOWN_SECONDS
-                print(f"[SYSTEM] Alert suppressed for detection {detection_key}; cooldown active for another {remaining}s")
-                continue
-            
-            # Lookup instance metadata (lat/lon) by instance name
-            settings = load_settings()
-            instance_config = next((
-                inst for inst in settings['instances']
-                if inst['name'].lower().replace(' ', '').replace('_','') == instance_name.lower().replace(' ', '').replace('_','')
-            ), None)
-            if not instance_config:
-                print(f"[SYSTEM] No metadata found for instance '{instance_name}', skipping alert")
-                continue
-            latitude = instance_config.get('latitude', 0.0)
-            longitude = instance_config.get('longitude', 0.0)
-            
-            try:
-                send_whatsapp_alert(instance_name, latitude, longitude)
-                alerted_detections[detection_key] = now
-                print(f"[SYSTEM] WhatsApp alert sent for {instance_name} at {latitude}, {longitude}")
-            except Exception as e:
-                print(f"[SYSTEM] Error sending WhatsApp alert for {instance_name}: {e}")
-    
     return jsonify({'detections': detections})
 
-
-account_sid = os.getenv('TWILIO_SID')
-auth_token = os.getenv('AUTH_TOKEN')
-client = Client(account_sid, auth_token)
-phone_number = os.getenv('PHONE_NUMBER')
-def send_whatsapp_alert(instance_name, latitude, longitude):
-    if not phone_number:
-        print("[SYSTEM] Phone number not configured, skipping WhatsApp alert")
-        return
-    
-    alert = client.messages.create(
-        from_='whatsapp:+14155238886',
-        to='whatsapp:+1' + phone_number,
-        body=f'🚨 WILDFIRE ALERT 🚨\nLocation: {latitude}, {longitude}\nSource: Camera {instance_name}\nEvacuate immediately. Stay safe.'
-    )
+def parse_time(value):
+    """Epoch seconds or an ISO 8601 timestamp from a query parameter"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route('/api/detections/history', methods=['GET'])
+def get_detection_history():
+    """
+    Past detections, newest first. Filters: instance, start/end (epoch seconds or ISO 8601),
+    bbox=left,top,right,bottom (detections overlapping the box), min_score and limit.
+    """
+    args = request.args
+    try:
+        start = parse_time(args['start']) if 'start' in args else None
+        end = parse_time(args['end']) if 'end' in args else None
+        bbox = None
+        if 'bbox' in args:
+            bbox = [float(v) for v in args['bbox'].split(',')]
+            if len(bbox) != 4:
+                raise ValueError('bbox must be left,top,right,bottom')
+        min_score = float(args['min_score']) if 'min_score' in args else None
+        limit = min(int(args.get('limit', 1000)), 10000)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    detections = detection_history.query(instance=args.get('instance'), start=start, end=end,
+                                         bbox=bbox, min_score=min_score, limit=limit)
+    return jsonify({'detections': detections, 'count': len(detections)})
+
+@app.route('/api/archive', methods=['GET'])
+def get_archive():
+    """Ring buffer usage per instance and the incident folders on disk"""
+    return jsonify(dict(frame_archive.stats(), incidents=frame_archive.incident_list()))
+
+@app.route('/api/detections/history/stats', methods=['GET'])
+def get_detection_history_stats():
+    """Detection log size and writer counters"""
+    return jsonify(detection_history.stats())
 
 
 @socketio.on('connect')
 def handle_connect():
+    ensure_monitor()
+    event_pusher.connect(request.sid)
     emit('connected', {'data': 'Connected to dashboard'})
 
+@socketio.on('disconnect')
+def handle_disconnect():
+    event_pusher.disconnect(request.sid)
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """Let a client choose how often it wants frame/detection updates"""
+    try:
+        interval = float((data or {}).get('min_interval', 1.0))
+    except (TypeError, ValueError):
+        return
+    event_pusher.subscribe(request.sid, interval)
+
 def cleanup_instances():
     """Stop all running instances on server shutdown"""
-    print("[SYSTEM] Stopping all running instances...")
-    for instance_name, instance_obj in instance_objects.items():
+    log.info("Stopping all running instances...")
+    for instance_name, instance_obj in list(instance_objects.items()):
         try:
             instance_obj.stop()
-            print(f"[SYSTEM] Stopped instance '{instance_name}'")
+            log.info("Stopped instance '%s'", instance_name)
         except Exception as e:
-            print(f"[SYSTEM] Error stopping instance '{instance_name}': {e}")
+            log.error("Error stopping instance '%s': %s", instance_name, e)
+    if capture_scheduler is not None:
+        capture_scheduler.shutdown()
+    if async_engine is not None:
+        async_engine.shutdown()
+    if shard_pool is not None:
+        shard_pool.shutdown()
+    alert_engine.shutdown()
+    detection_history.shutdown()
     
-    settings = load_settings()
-    for instance_config in settings.get('instances', []):
-        if instance_config.get('status') == 'running':
-            instance_config['status'] = 'stopped'
-    save_settings(settings)
+    with settings_store.mutate() as settings:
+        for instance_config in settings.get('instances', []):
+            if instance_config.get('status') == 'running':
+                instance_config['status'] = 'stopped'
+    settings_store.flush()
 
 import atexit
 atexit.register(cleanup_instances)
@@ -0,0 +1,262 @@
+"""
+Local stand-ins for the services instances talk to, for benchmarking without the network.
+
+- FakeCamera: Axis-style snapshot endpoint behind HTTP digest auth
+- FakeVideoSource: endless MJPEG stream that cv2.VideoCapture can open
+- FakeDetector: lookout endpoint with configurable latency and results
+
+Every server runs on its own threads on 127.0.0.1 and an ephemeral port.
+"""
+import hashlib
+import json
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+# Snapshots remembered for matching up with detector posts
+SERVED_MAX = 10000
+
+
+def synthetic_jpeg(width, height, seed=0, quality=85):
+    """A noisy test image, so JPEG sizes and decode times are close to a real scene"""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_LINEAR)
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError('Could not encode synthetic frame')
+    return buffer.tobytes()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type, headers=None):
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The app gave up on the request or is shutting down
+            pass
+
+
+class FakeServer:
+    """A ThreadingHTTPServer on a free local port, served from a daemon thread"""
+
+    def __init__(self, handler):
+        handler = type(handler.__name__, (handler,), {'fake': self})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name=type(self).__name__)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.port}{path}'
+
+
+class _CameraHandler(_Handler):
+    def do_GET(self):
+        camera = self.fake
+        auth = camera.check(self.command, self.headers.get('Authorization'))
+        if auth != 'ok':
+            self.send_body(401, b'Unauthorized', 'text/plain', {'WWW-Authenticate': camera.challenge(auth == 'stale')})
+            return
+        self.send_body(200, camera.snapshot(self.path), 'image/jpeg')
+
+
+class FakeCamera(FakeServer):
+    """
+    Snapshot endpoint in the style of an Axis camera's /axis-cgi/jpg/image.cgi.
+
+    Requests need MD5 digest auth (qop=auth); the nonce is rotated every
+    `nonce_lifetime` seconds and answered with stale=true, like a real camera. Each
+    snapshot is one of a few base images with unique bytes after its end marker
+    (which decoders ignore), so the detector side can tell which snapshot it was sent
+    and when it was served.
+    """
+
+    realm = 'AXIS_ACCC8E000000'
+
+    def __init__(self, username='root', password='pass', width=1920, height=1080, nonce_lifetime=300, variants=4):
+        super().__init__(_CameraHandler)
+        self.username = username
+        self.password = password
+        self.nonce_lifetime = nonce_lifetime
+        self.images = [synthetic_jpeg(width, height, seed=i) for i in range(variants)]
+        self._nonce = None
+        self._nonce_at = 0.0
+        self.served = OrderedDict()  # md5 of snapshot -> time served
+        self.snapshots = 0
+        self.challenges = 0
+        self._per_path = {}
+
+    def _current_nonce(self):
+        with self.lock:
+            if self._nonce is None or time.monotonic() - self._nonce_at > self.nonce_lifetime:
+                self._nonce = secrets.token_hex(16)
+                self._nonce_at = time.monotonic()
+            return self._nonce
+
+    def challenge(self, stale=False):
+        with self.lock:
+            self.challenges += 1
+        header = f'Digest realm="{self.realm}", nonce="{self._current_nonce()}", algorithm=MD5, qop="auth"'
+        return header + (', stale=true' if stale else '')
+
+    def check(self, method, header):
+        """'ok', 'stale' for valid credentials with an expired nonce, or 'denied'"""
+        if not header or not header.startswith('Digest '):
+            return 'denied'
+        fields = {}
+        for item in header[len('Digest '):].split(','):
+            key, _, value = item.strip().partition('=')
+            fields[key] = value.strip('"')
+        if fields.get('username') != self.username:
+            return 'denied'
+        ha1 = hashlib.md5(f'{self.username}:{self.realm}:{self.password}'.encode()).hexdigest()
+        ha2 = hashlib.md5(f'{method}:{fields.get("uri")}'.encode()).hexdigest()
+        expected = hashlib.md5(':'.join([ha1, fields.get('nonce', ''), fields.get('nc', ''), fields.get('cnonce', ''),
+                                         fields.get('qop', ''), ha2]).encode()).hexdigest()
+        if fields.get('response') != expected:
+            return 'denied'
+        return 'ok' if fields.get('nonce') == self._current_nonce() else 'stale'
+
+    def snapshot(self, path):
+        with self.lock:
+            self.snapshots += 1
+            # Each camera URL steps through the base images, so consecutive snapshots differ
+            count = self._per_path[path] = self._per_path.get(path, 0) + 1
+            data = self.images[count % len(self.images)] + secrets.token_bytes(16)
+            self.served[hashlib.md5(data).hexdigest()] = time.monotonic()
+            if len(self.served) > SERVED_MAX:
+                self.served.popitem(last=False)
+        return data
+
+    def served_at(self, data):
+        with self.lock:
+            return self.served.pop(hashlib.md5(data).hexdigest(), None)
+
+
+class _VideoHandler(_Handler):
+    def do_GET(self):
+        video = self.fake
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        interval = 1.0 / video.fps
+        try:
+            while video.running:
+                started = time.monotonic()
+                frame = video.frame()
+                self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n'
+                                 + f'Content-Length: {len(frame)}\r\n\r\n'.encode() + frame + b'\r\n')
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class FakeVideoSource(FakeServer):
+    """
+    An endless MJPEG stream at `fps`, standing in for a resolved YouTube stream.
+    Frames cycle through a few pre-encoded images so consecutive frames differ.
+    """
+
+    def __init__(self, width=1280, height=720, fps=15, variants=8):
+        super().__init__(_VideoHandler)
+        self.fps = fps
+        self.frames = [synthetic_jpeg(width, height, seed=i) for i in range(variants)]
+        self.running = True
+        self.sent = 0
+
+    def frame(self):
+        with self.lock:
+            self.sent += 1
+            return self.frames[self.sent % len(self.frames)]
+
+    def stream_url(self, name):
+        return self.url(f'/{name}/stream.mjpg')
+
+    def stop(self):
+        self.running = False
+        super().stop()
+
+
+class _DetectorHandler(_Handler):
+    def do_POST(self):
+        detector = self.fake
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/'):
+            message = BytesParser(policy=default_policy).parsebytes(
+                f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+            images = [part.get_payload(decode=True) for part in message.iter_parts()]
+        else:
+            images = [body]
+        with detector.lock:
+            detector.posts += 1
+        time.sleep(detector.delay())
+        results = [detector.result(image) for image in images]
+        payload = {'batch': results} if content_type.startswith('multipart/') else results[0]
+        self.send_body(200, json.dumps(payload).encode(), 'application/json')
+
+
+class FakeDetector(FakeServer):
+    """
+    Lookout endpoint that answers after `latency` seconds (+/- `jitter`) with
+    `results` boxes of `score`. Batched multipart posts get one result per image.
+
+    When a FakeCamera is given, the time from its serving a snapshot to the detector
+    answering for it is recorded as the end-to-end detection latency.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.05, results=1, score=0.9, camera=None):
+        super().__init__(_DetectorHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.results = results
+        self.score = score
+        self.camera = camera
+        self.posts = 0
+        self.images = 0
+        self.latencies = []  # seconds from snapshot served to detector answer
+
+    def delay(self):
+        return max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter))
+
+    def result(self, image):
+        served_at = self.camera.served_at(image) if self.camera is not None else None
+        with self.lock:
+            self.images += 1
+            if served_at is not None:
+                self.latencies.append(time.monotonic() - served_at)
+        return {'results': [{'left': 100 + 40 * i, 'top': 100, 'right': 180 + 40 * i, 'bottom': 160, 'score': self.score}
+                            for i in range(self.results)]}
+
+    def endpoint(self, name):
+        return self.url(f'/api/detects?instance={name}')
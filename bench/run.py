@@ -0,0 +1,307 @@
+"""
+Load test: how many instances can this machine keep up with?
+
+Starts a fake camera, video source and lookout endpoint (bench/fakes.py), runs the app
+in a scratch directory, creates and starts N instances through its API, and reports
+the capture rate it achieved against the configured one, end-to-end detection latency,
+and the CPU and memory of the app's processes. Exits non-zero when a --min-rate or
+--max-p95 threshold is missed, so it can gate a deploy.
+
+    python -m bench.run --cameras 50 --youtube 5 --frequency 5 --duration 60
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+import requests
+
+from bench.fakes import FakeCamera, FakeDetector, FakeVideoSource
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Runs the app without the debug reloader, which would double its processes
+APP_LAUNCHER = (
+    "import logging, sys, app; "
+    "logging.getLogger('werkzeug').setLevel(logging.WARNING); "
+    "app.socketio.run(app.app, host='127.0.0.1', port=int(sys.argv[1]), allow_unsafe_werkzeug=True)"
+)
+_CAPTURES_PATTERN = re.compile(r'^lookout_captures_total\{.*result="(\w+)".*\} (\S+)$', re.MULTILINE)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class AppProcess:
+    """The app under test, in its own working directory so it starts with no settings"""
+
+    def __init__(self, workdir, env):
+        self.workdir = workdir
+        self.port = free_port()
+        self.env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])), **env)
+        self.process = None
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.port}{path}'
+
+    def start(self, timeout=60):
+        self.process = subprocess.Popen([sys.executable, '-c', APP_LAUNCHER, str(self.port)],
+                                        cwd=self.workdir, env=self.env)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'App exited with code {self.process.returncode}')
+            try:
+                if requests.get(self.url('/api/instances'), timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError('App did not start in time')
+
+    def add_instance(self, config):
+        response = requests.post(self.url('/api/instances'), json=config, timeout=10)
+        response.raise_for_status()
+        name = response.json()['name']
+        requests.post(self.url(f'/api/instances/{name}/start'), timeout=30).raise_for_status()
+        return name
+
+    def stop_instance(self, name):
+        requests.post(self.url(f'/api/instances/{name}/stop'), timeout=30)
+
+    def captures(self):
+        """Captures so far by result, from /metrics"""
+        totals = {}
+        for result, value in _CAPTURES_PATTERN.findall(requests.get(self.url('/metrics'), params={'refresh': 1}, timeout=10).text):
+            totals[result] = totals.get(result, 0) + float(value)
+        return totals
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class ResourceSampler:
+    """CPU and RSS of a process and all of its children (reloader-free app plus shard workers)"""
+
+    def __init__(self, pid, interval=1.0):
+        self.root = psutil.Process(pid)
+        self.interval = interval
+        self.cpu = []
+        self.rss = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _tree(self):
+        try:
+            return [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def _totals(self):
+        cpu, rss = 0.0, 0
+        for process in self._tree():
+            try:
+                times = process.cpu_times()
+                cpu += times.user + times.system
+                rss += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                continue
+        return cpu, rss
+
+    def _run(self):
+        last_cpu, _ = self._totals()
+        last_at = time.monotonic()
+        while not self._stop.wait(self.interval):
+            cpu, rss = self._totals()
+            now = time.monotonic()
+            self.cpu.append(100 * max(0.0, cpu - last_cpu) / (now - last_at))
+            self.rss.append(rss)
+            last_cpu, last_at = cpu, now
+
+
+def run(args):
+    camera = FakeCamera(width=args.width, height=args.height).start()
+    video = FakeVideoSource(width=args.width, height=args.height, fps=args.fps).start() if args.youtube else None
+    detector = FakeDetector(latency=args.detector_latency, jitter=args.jitter, results=args.results,
+                            camera=camera).start()
+    workdir = tempfile.mkdtemp(prefix='lookout-bench-')
+    app = AppProcess(workdir, {
+        'EXECUTION_MODE': args.mode,
+        # Alerts go through the whole delivery path but are only recorded
+        'NOTIFIER': 'mock',
+        'ALERT_RECIPIENTS': '15550000000',
+        'LOG_LEVEL': args.log_level,
+    })
+    names = []
+    try:
+        app.start()
+        for i in range(args.cameras):
+            names.append(app.add_instance({
+                'name': f'bench-camera-{i}',
+                'instance_type': 'camera',
+                'camera_url': camera.url(f'/axis-cgi/jpg/image.cgi?camera={i}'),
+                'camera_username': camera.username,
+                'camera_password': camera.password,
+                'folder_path': os.path.join(workdir, 'images'),
+                'frequency': args.frequency,
+                'lookout_endpoint': detector.endpoint(f'bench-camera-{i}'),
+            }))
+        for i in range(args.youtube):
+            names.append(app.add_instance({
+                'name': f'bench-video-{i}',
+                'instance_type': 'youtube',
+                'youtube_url': video.stream_url(f'bench-video-{i}'),
+                'frequency': args.frequency,
+                'lookout_endpoint': detector.endpoint(f'bench-video-{i}'),
+            }))
+
+        time.sleep(args.warmup)
+        before = app.captures()
+        snapshots, challenges = camera.snapshots, camera.challenges
+        posts, images = detector.posts, detector.images
+        first_latency = len(detector.latencies)
+        sampler = ResourceSampler(app.process.pid)
+        sampler.start()
+        started = time.monotonic()
+        time.sleep(args.duration)
+        elapsed = time.monotonic() - started
+        sampler.stop()
+        after = app.captures()
+        latencies = detector.latencies[first_latency:]
+    finally:
+        for name in names:
+            try:
+                app.stop_instance(name)
+            except requests.RequestException:
+                pass
+        app.stop()
+        for fake in (camera, video, detector):
+            if fake is not None:
+                fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    ok = after.get('ok', 0) - before.get('ok', 0)
+    failed = after.get('failed', 0) - before.get('failed', 0)
+    expected = len(names) / args.frequency
+    achieved = ok / elapsed
+    return {
+        'mode': args.mode,
+        'instances': {'camera': args.cameras, 'youtube': args.youtube, 'frequency': args.frequency},
+        'duration': round(elapsed, 1),
+        'captures': {
+            'ok': int(ok),
+            'failed': int(failed),
+            'per_second': round(achieved, 2),
+            'expected_per_second': round(expected, 2),
+            'rate': round(achieved / expected, 3) if expected else None,
+        },
+        'detector': {'posts': detector.posts - posts, 'images': detector.images - images},
+        'camera': {'snapshots': camera.snapshots - snapshots, 'auth_challenges': camera.challenges - challenges},
+        'latency': {
+            'samples': len(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies) if latencies else None,
+        },
+        'resources': {
+            'cpu_avg': round(sum(sampler.cpu) / len(sampler.cpu), 1) if sampler.cpu else None,
+            'cpu_max': round(max(sampler.cpu), 1) if sampler.cpu else None,
+            'rss_avg_mb': round(sum(sampler.rss) / len(sampler.rss) / 2 ** 20, 1) if sampler.rss else None,
+            'rss_max_mb': round(max(sampler.rss) / 2 ** 20, 1) if sampler.rss else None,
+        },
+    }
+
+
+def _seconds(value):
+    return f'{value * 1000:.0f} ms' if value is not None else 'n/a'
+
+
+def print_report(report):
+    captures, latency, resources = report['captures'], report['latency'], report['resources']
+    instances = report['instances']
+    print(f"{instances['camera']} camera + {instances['youtube']} youtube instances every "
+          f"{instances['frequency']}s, {report['mode']} mode, {report['duration']}s measured")
+    print(f"  captures:  {captures['per_second']}/s of {captures['expected_per_second']}/s expected "
+          f"({(captures['rate'] or 0) * 100:.1f}%), {captures['failed']} failed")
+    print(f"  detector:  {report['detector']['posts']} posts, {report['detector']['images']} images")
+    print(f"  camera:    {report['camera']['snapshots']} snapshots, {report['camera']['auth_challenges']} digest challenges")
+    print(f"  latency:   p50 {_seconds(latency['p50'])}, p95 {_seconds(latency['p95'])}, "
+          f"p99 {_seconds(latency['p99'])}, max {_seconds(latency['max'])} ({latency['samples']} camera frames)")
+    print(f"  resources: CPU avg {resources['cpu_avg']}% / max {resources['cpu_max']}%, "
+          f"RSS avg {resources['rss_avg_mb']} MB / max {resources['rss_max_mb']} MB")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cameras', type=int, default=10, help='camera instances (default 10)')
+    parser.add_argument('--youtube', type=int, default=0, help='YouTube instances reading the fake video stream (default 0)')
+    parser.add_argument('--frequency', type=float, default=5, help='seconds between captures per instance (default 5)')
+    parser.add_argument('--duration', type=float, default=60, help='seconds measured (default 60)')
+    parser.add_argument('--warmup', type=float, default=10, help='seconds before measuring starts (default 10)')
+    parser.add_argument('--mode', default=os.getenv('EXECUTION_MODE', 'scheduler'),
+                        choices=['scheduler', 'thread', 'asyncio', 'process'], help='EXECUTION_MODE of the app')
+    parser.add_argument('--width', type=int, default=1920, help='frame width (default 1920)')
+    parser.add_argument('--height', type=int, default=1080, help='frame height (default 1080)')
+    parser.add_argument('--fps', type=float, default=15, help='frame rate of the fake video stream (default 15)')
+    parser.add_argument('--detector-latency', type=float, default=0.2, help='seconds the fake detector takes (default 0.2)')
+    parser.add_argument('--jitter', type=float, default=0.05, help='+/- seconds added to the detector latency (default 0.05)')
+    parser.add_argument('--results', type=int, default=1, help='boxes in each detector response (default 1)')
+    parser.add_argument('--log-level', default='WARNING', help='LOG_LEVEL of the app (default WARNING)')
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--min-rate', type=float, help='fail if under this fraction of the expected capture rate, e.g. 0.95')
+    parser.add_argument('--max-p95', type=float, help='fail if the p95 end-to-end latency is over this many seconds')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if args.min_rate is not None and (report['captures']['rate'] or 0) < args.min_rate:
+        failures.append(f"capture rate {report['captures']['rate']} is under {args.min_rate}")
+    p95 = report['latency']['p95']
+    if args.max_p95 is not None and p95 is not None and p95 > args.max_p95:
+        failures.append(f'p95 latency {p95:.3f}s is over {args.max_p95}s')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
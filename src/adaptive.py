@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+# Lowest detection score that counts as a likely fire
+ADAPTIVE_SCORE_THRESHOLD = float(os.getenv('ADAPTIVE_SCORE_THRESHOLD', '0.5'))
+# Seconds the interval stays at its minimum after such a detection
+ADAPTIVE_HOLD_SECONDS = float(os.getenv('ADAPTIVE_HOLD_SECONDS', '600'))
+# Mean frame difference (0-255, as measured by ChangeDetector) above which the scene is
+# changing and below which it is static
+ADAPTIVE_CHANGING_DIFFERENCE = float(os.getenv('ADAPTIVE_CHANGING_DIFFERENCE', '8'))
+ADAPTIVE_STATIC_DIFFERENCE = float(os.getenv('ADAPTIVE_STATIC_DIFFERENCE', '1'))
+# Factors the interval is divided by on change and multiplied by on a static frame or detector error
+TIGHTEN_FACTOR = 2.0
+STATIC_FACTOR = 1.5
+ERROR_FACTOR = 2.0
+# Share of the way back to the configured frequency covered after each ordinary frame
+RELAX_RATE = 0.25
+
+
+def parse_hours(spec):
+    """'06:00-20:00' -> (360, 1200) minutes after midnight, or None for no daylight window"""
+    if not spec:
+        return None
+    start, _, end = spec.partition('-')
+
+    def minutes(value):
+        hours, _, mins = value.strip().partition(':')
+        return int(hours) * 60 + int(mins or 0)
+
+    return minutes(start), minutes(end)
+
+
+class AdaptiveInterval:
+    """
+    Capture interval of one instance that follows what the instance sees.
+
+    A detection scoring at least `score_threshold` drops the interval to its minimum and
+    holds it there for `hold_seconds`. Otherwise a changing scene halves the interval,
+    while static frames and failed detector posts lengthen it, and ordinary frames move it
+    back towards the configured frequency. Outside `daylight_hours` the instance runs at
+    its maximum interval unless it is holding after a detection. The interval always stays
+    within [min_interval, max_interval].
+    """
+
+    def __init__(self, frequency, min_interval=None, max_interval=None, score_threshold=ADAPTIVE_SCORE_THRESHOLD,
+                 daylight_hours=None, hold_seconds=ADAPTIVE_HOLD_SECONDS):
+        self.frequency = frequency
+        self.min_interval = min(min_interval or max(1, frequency / 4), frequency)
+        self.max_interval = max(max_interval or frequency * 4, frequency)
+        self.score_threshold = score_threshold
+        self.daylight = parse_hours(daylight_hours)
+        self.hold_seconds = hold_seconds
+        self.interval = float(frequency)
+        self.reason = 'configured'
+        self.adjustments = 0
+        self._hold_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, instance_config):
+        return cls(instance_config['frequency'],
+                   min_interval=instance_config.get('min_frequency'),
+                   max_interval=instance_config.get('max_frequency'),
+                   score_threshold=instance_config.get('adaptive_score_threshold', ADAPTIVE_SCORE_THRESHOLD),
+                   daylight_hours=instance_config.get('daylight_hours'))
+
+    def current(self):
+        """(interval in seconds, why) to wait before the next capture"""
+        with self._lock:
+            if time.monotonic() < self._hold_until:
+                return self.min_interval, 'detection'
+            if not self.in_daylight():
+                return self.max_interval, 'night'
+            return self.interval, self.reason
+
+    def in_daylight(self, now=None):
+        if self.daylight is None:
+            return True
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        start, end = self.daylight
+        if start <= end:
+            return start <= minute < end
+        # A window that wraps past midnight
+        return minute >= start or minute < end
+
+    def detections(self, detection_data):
+        results = detection_data.get('results', []) if isinstance(detection_data, dict) else []
+        scores = [r.get('score', 0) for r in results or [] if isinstance(r, dict)]
+        if scores and max(scores) >= self.score_threshold:
+            with self._lock:
+                self._hold_until = time.monotonic() + self.hold_seconds
+                self._set(self.min_interval, 'detection')
+
+    def scene(self, difference):
+        """A frame was compared with the last one sent; `difference` is None for the first frame"""
+        if difference is None:
+            return
+        with self._lock:
+            if difference >= ADAPTIVE_CHANGING_DIFFERENCE:
+                self._set(self.interval / TIGHTEN_FACTOR, 'changing')
+            elif difference <= ADAPTIVE_STATIC_DIFFERENCE:
+                self._set(self.interval * STATIC_FACTOR, 'static')
+            else:
+                self._set(self.interval + RELAX_RATE * (self.frequency - self.interval), 'configured')
+
+    def detector_result(self, ok):
+        if ok:
+            return
+        with self._lock:
+            self._set(self.interval * ERROR_FACTOR, 'detector_errors')
+
+    def stats(self):
+        interval, reason = self.current()
+        return {
+            'effective_interval': round(interval, 2),
+            'reason': reason,
+            'min_interval': self.min_interval,
+            'max_interval': self.max_interval,
+            'adjustments': self.adjustments,
+        }
+
+    def _set(self, interval, reason):
+        interval = min(self.max_interval, max(self.min_interval, interval))
+        if round(interval, 2) != round(self.interval, 2):
+            self.adjustments += 1
+        self.interval = interval
+        self.reason = reason
@@ -0,0 +1,202 @@
+import os
+import queue
+import threading
+import time
+
+from src.detection_tracks import TrackIndex
+from src.log import get_logger
+from src.metrics import metrics
+
+log = get_logger('alerts')
+
+ALERT_COOLDOWN_SECONDS = int(os.getenv('ALERT_COOLDOWN_SECONDS', '7200'))  # default 2 hours
+ALERT_MIN_SCORE = float(os.getenv('ALERT_MIN_SCORE', '0.5'))
+ALERT_WORKERS = int(os.getenv('ALERT_WORKERS', '2'))
+ALERT_MAX_ATTEMPTS = int(os.getenv('ALERT_MAX_ATTEMPTS', '3'))
+# Delay before the first retry of a failed delivery, doubled for each further attempt
+ALERT_RETRY_DELAY = float(os.getenv('ALERT_RETRY_DELAY', '5'))
+# How often tracks of instances that stopped reporting are swept out
+TRACK_SWEEP_INTERVAL = 60
+
+
+class Alert:
+    def __init__(self, instance_name, config, tracks):
+        self.instance_name = instance_name
+        self.config = config
+        self.latitude = config.get('latitude', 0.0)
+        self.longitude = config.get('longitude', 0.0)
+        # Detection tracks this alert covers; they start their cooldown once it is delivered
+        self.tracks = tracks
+        self.created_at = time.monotonic()
+        self.attempts = 0
+        # Recipients already reached, so retries only go to the rest
+        self.delivered_to = set()
+
+
+class AlertEngine:
+    """
+    Decides when new detections warrant an alert and delivers alerts in the background.
+
+    Instances feed detections in as soon as they are recorded, so alerts no longer depend
+    on anyone polling the dashboard. Evaluation only matches boxes against the instance's
+    tracks (see TrackIndex) under a lock; delivery happens on worker threads with retries.
+    A track is claimed when its alert is queued, so the same event seen again before
+    delivery finishes does not queue a second alert, and while an instance already has an
+    alert waiting, newly seen events are folded into it instead of sending another message.
+
+    `send(alert)` delivers one Alert and raises on failure.
+    `locate(instance_name)` returns the instance's settings, or None if it is unknown.
+    """
+
+    def __init__(self, send, locate, cooldown=ALERT_COOLDOWN_SECONDS, min_score=ALERT_MIN_SCORE,
+                 workers=ALERT_WORKERS, max_attempts=ALERT_MAX_ATTEMPTS, retry_delay=ALERT_RETRY_DELAY):
+        self.send = send
+        self.locate = locate
+        self.cooldown = cooldown
+        self.min_score = min_score
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._tracks = TrackIndex(cooldown)
+        self._last_sweep = time.monotonic()
+        self._pending = {}  # instance name -> alert still waiting in the queue
+        self._queue = queue.Queue()
+        self._stopping = False
+        self.evaluated = 0
+        self.suppressed = 0
+        self.queued = 0
+        self.delivered = 0
+        self.retries = 0
+        self.failed = 0
+        self.last_latency = None
+        self._workers = [threading.Thread(target=self._deliver, daemon=True, name=f'alert-worker-{i}')
+                         for i in range(max(1, workers))]
+        for worker in self._workers:
+            worker.start()
+
+    def handle_event(self, instance_obj, event, payload):
+        """Instance listener: evaluate detections as soon as an instance records them"""
+        if event == 'detections_updated':
+            self.evaluate(instance_obj.name, payload.get('detections'))
+
+    def evaluate(self, instance_name, detection_data):
+        if not isinstance(detection_data, dict):
+            return
+        results = [r for r in detection_data.get('results', []) or [] if r.get('score', 0) >= self.min_score]
+        if not results:
+            return
+
+        # Lookup instance metadata (lat/lon) by instance name, before taking the lock so the
+        # alert can be queued or extended in the same critical section as the tracks are claimed
+        instance_config = self.locate(instance_name)
+        now = time.monotonic()
+        with self._lock:
+            self.evaluated += 1
+            if now - self._last_sweep >= TRACK_SWEEP_INTERVAL:
+                self._tracks.sweep(now)
+                self._last_sweep = now
+            new_tracks = []
+            for track in self._tracks.observe(instance_name, results, now):
+                if track.claimed:
+                    continue
+                remaining = self._tracks.cooldown_remaining(track, now)
+                if remaining > 0:
+                    self.suppressed += 1
+                    log.debug("Alert suppressed for detection at %s; cooldown active for another %ds",
+                              track.box, remaining, extra={'instance': instance_name})
+                    continue
+                track.claimed = True
+                new_tracks.append(track)
+            if not new_tracks:
+                return
+            pending = self._pending.get(instance_name)
+            if pending is not None:
+                pending.tracks.extend(new_tracks)
+                return
+            if not instance_config:
+                for track in new_tracks:
+                    track.claimed = False
+                alert = None
+            else:
+                alert = Alert(instance_name, instance_config, new_tracks)
+                self._pending[instance_name] = alert
+                self.queued += 1
+
+        if alert is None:
+            log.warning("No metadata found for instance '%s', skipping alert", instance_name, extra={'instance': instance_name})
+            return
+        self._queue.put(alert)
+
+    def remove_instance(self, instance_name):
+        """Forget an instance's detection tracks, e.g. when it is deleted"""
+        with self._lock:
+            self._tracks.remove_instance(instance_name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'tracks': self._tracks.stats(),
+                'evaluated': self.evaluated,
+                'suppressed': self.suppressed,
+                'alerts_queued': self.queued,
+                'delivered': self.delivered,
+                'retries': self.retries,
+                'failed': self.failed,
+                'last_latency': self.last_latency,
+            }
+
+    def shutdown(self, timeout=5):
+        """Stop the workers once the alerts already queued have been attempted"""
+        self._stopping = True
+        for _ in self._workers:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0, deadline - time.monotonic()))
+
+    def _deliver(self):
+        while True:
+            alert = self._queue.get()
+            if alert is None:
+                return
+            with self._lock:
+                if self._pending.get(alert.instance_name) is alert:
+                    del self._pending[alert.instance_name]
+            self._send_with_retries(alert)
+
+    def _send_with_retries(self, alert):
+        while True:
+            alert.attempts += 1
+            try:
+                with metrics.timer(alert.instance_name, 'alert_send'):
+                    self.send(alert)
+            except Exception as e:
+                metrics.count(alert.instance_name, 'alert_sends', 'failed')
+                log.error("Error sending alert (attempt %d/%d): %s", alert.attempts, self.max_attempts, e, extra={'instance': alert.instance_name})
+                if alert.attempts >= self.max_attempts or self._stopping:
+                    with self._lock:
+                        self.failed += 1
+                    # Let the next sighting of these events try again
+                    self._release(alert.tracks)
+                    return
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.retry_delay * 2 ** (alert.attempts - 1))
+                continue
+
+            metrics.count(alert.instance_name, 'alert_sends', 'ok')
+            now = time.monotonic()
+            with self._lock:
+                for track in alert.tracks:
+                    track.last_alerted = now
+                    track.claimed = False
+                self.delivered += 1
+                self.last_latency = round(time.monotonic() - alert.created_at, 3)
+            log.info("Alert sent for %s at %s, %s", alert.instance_name, alert.latitude, alert.longitude, extra={'instance': alert.instance_name})
+            return
+
+    def _release(self, tracks):
+        with self._lock:
+            for track in tracks:
+                track.claimed = False
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import threading
+import zlib
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp import DigestAuthMiddleware
+
+from src.detector_gate import detector_gate, is_failure
+from src.instance import RETRY_DELAY
+from src.log import get_logger
+from src.metrics import metrics
+
+log = get_logger('async')
+
+
+class AsyncCameraEngine:
+    """
+    Runs CameraInstance capture cycles as coroutines on one event loop.
+
+    Snapshot fetches and detector posts are awaited instead of blocking a thread, so a
+    single process can keep thousands of HTTP cameras in flight. Concurrency is capped
+    per camera host and per detector host, and every request has a timeout. Detector
+    posts share the DetectorGate's circuit breakers, and a frame that waited longer than
+    its age limit for a slot is dropped. Decoding and writing frames still happens on
+    the loop's default executor.
+    """
+
+    def __init__(self, camera_host_limit=4, detector_host_limit=64, max_connections=1000,
+                 capture_timeout=10, post_timeout=30):
+        self.camera_host_limit = camera_host_limit
+        self.detector_host_limit = detector_host_limit
+        self.max_connections = max_connections
+        self.capture_timeout = aiohttp.ClientTimeout(total=capture_timeout)
+        self.post_timeout = aiohttp.ClientTimeout(total=post_timeout)
+        self._tasks = {}
+        self._auth = {}
+        self._limits = {}
+        self._stats = {}
+        self._session = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def add(self, instance, immediate=True):
+        """Start driving a CameraInstance on the event loop."""
+        delay = 0.0
+        if not immediate:
+            # Spread restored instances over their frequency window
+            delay = (zlib.crc32(instance.name.encode('utf-8')) % 1000) / 1000 * instance.frequency
+        asyncio.run_coroutine_threadsafe(self._add(instance, delay), self._loop).result()
+
+    def remove(self, name):
+        self._loop.call_soon_threadsafe(self._cancel, name)
+
+    def stats(self):
+        return {
+            'in_flight': sum(s.get('in_flight', 0) for s in list(self._stats.values())),
+            'instances': {name: dict(s) for name, s in list(self._stats.items())},
+        }
+
+    def shutdown(self):
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        try:
+            future.result(timeout=5)
+        except Exception as e:
+            log.error("Error shutting down engine: %s", e)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _add(self, instance, delay):
+        if instance.name in self._tasks:
+            raise ValueError(f"Instance '{instance.name}' is already running")
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector)
+        self._auth[instance.name] = DigestAuthMiddleware(instance.camera_username, instance.camera_password)
+        self._stats[instance.name] = {'captures': 0, 'failures': 0, 'in_flight': 0}
+        self._tasks[instance.name] = self._loop.create_task(self._drive(instance, delay))
+
+    def _cancel(self, name):
+        task = self._tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+        self._auth.pop(name, None)
+        self._stats.pop(name, None)
+
+    async def _shutdown(self):
+        for name in list(self._tasks):
+            self._cancel(name)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _limit(self, url, limit):
+        parts = urlsplit(url)
+        key = (parts.hostname, parts.port, limit)
+        semaphore = self._limits.get(key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(limit)
+            self._limits[key] = semaphore
+        return semaphore
+
+    async def _drive(self, instance, delay):
+        await asyncio.sleep(delay)
+        while instance.run:
+            started = self._loop.time()
+            stats = self._stats.get(instance.name)
+            try:
+                ok = await self._cycle(instance)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                instance.log.error("Error in capture cycle: %s", e)
+                ok = False
+            metrics.record_cycle(instance.name, instance.frequency, ok, started, self._loop.time() - started)
+            if stats is not None:
+                stats['captures'] += 1
+                if not ok:
+                    stats['failures'] += 1
+            wait = instance.interval() if ok else RETRY_DELAY
+            await asyncio.sleep(max(0, wait - (self._loop.time() - started)))
+
+    async def _cycle(self, instance):
+        stats = self._stats.get(instance.name, {})
+        stats['in_flight'] = 1
+        try:
+            # step 1: capture image
+            try:
+                with metrics.timer(instance.name, 'read'):
+                    async with self._limit(instance.camera_url, self.camera_host_limit):
+                        async with self._session.get(instance.camera_url, timeout=self.capture_timeout,
+                                                     middlewares=(self._auth[instance.name],)) as response:
+                            if response.status != 200:
+                                instance.log.error("Could not capture image, status code %s", response.status)
+                                return False
+                            content = await response.read()
+            except asyncio.TimeoutError:
+                instance.log.error("Error capturing image: timed out")
+                return False
+            except aiohttp.ClientError as e:
+                instance.log.error("Error capturing image: %s", e)
+                return False
+
+            frame = await self._loop.run_in_executor(None, instance.save_image, content)
+            if frame is None:
+                return False
+            if not await self._loop.run_in_executor(None, instance.should_post, frame):
+                return True
+            image_bytes, transform = await self._loop.run_in_executor(None, instance.prepare_upload, content)
+            if image_bytes is None:
+                return False
+
+            # step 2: post image to API
+            breaker = detector_gate.breaker(instance.lookout_endpoint)
+            if breaker.is_open():
+                instance.record_drop('circuit_open')
+                return True
+            queued_at = self._loop.time()
+            try:
+                async with self._limit(instance.lookout_endpoint, self.detector_host_limit):
+                    if self._loop.time() - queued_at > detector_gate.max_age:
+                        instance.record_drop('stale')
+                        return True
+                    if not breaker.allow():
+                        instance.record_drop('circuit_open')
+                        return True
+                    try:
+                        with metrics.timer(instance.name, 'detector_post'):
+                            async with self._session.post(instance.lookout_endpoint, data=image_bytes, timeout=self.post_timeout,
+                                                          headers={'Content-Type': 'image/jpeg'}) as response:
+                                status = response.status
+                                body = await response.read()
+                    except (asyncio.TimeoutError, aiohttp.ClientError):
+                        breaker.record(False)
+                        raise
+                    except asyncio.CancelledError:
+                        breaker.abandon()
+                        raise
+            # The capture itself succeeded: like the threaded engines, wait a normal interval
+            # and leave backing off a failing detector to its circuit breaker
+            except asyncio.TimeoutError:
+                instance.record_post('error')
+                instance.log.error("Error posting image: timed out")
+                return True
+            except aiohttp.ClientError as e:
+                instance.record_post('error')
+                instance.log.error("Error posting image: %s", e)
+                return True
+            breaker.record(not is_failure(f'http_{status}'))
+            if status != 200:
+                instance.record_post(f'http_{status}')
+                instance.log.warning("Failed to post image, status code %s", status)
+                return True
+            instance.record_post('ok')
+            instance.log.info("Image posted successfully")
+            try:
+                with metrics.timer(instance.name, 'parse'):
+                    detection_data = json.loads(body)
+                instance.record_detections(detection_data, transform)
+            except ValueError as parse_error:
+                instance.log.error("Error parsing detection results: %s", parse_error)
+            return True
+        finally:
+            stats['in_flight'] = 0
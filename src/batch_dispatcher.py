@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from src import http_pool
+from src.log import get_logger
+
+log = get_logger('batch')
+
+# 'multipart' batches frames headed for the same endpoint, 'off' posts each frame on its own
+DETECTOR_BATCHING = os.getenv('DETECTOR_BATCHING', 'off')
+# How long a frame may wait for others to join its batch
+DETECTOR_BATCH_WINDOW = float(os.getenv('DETECTOR_BATCH_WINDOW', '0.25'))
+DETECTOR_BATCH_MAX = int(os.getenv('DETECTOR_BATCH_MAX', '16'))
+# After an endpoint rejects a batch, post singles to it for this long before trying again
+BATCH_RETRY_AFTER = 600
+
+
+class BatchResult:
+    """Stands in for a requests.Response for one image out of a batch response."""
+
+    status_code = 200
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class PendingFrame:
+    def __init__(self, image_bytes):
+        self.image_bytes = image_bytes
+        self.future = Future()
+        self.queued_at = time.monotonic()
+
+
+class BatchDispatcher:
+    """
+    Collects frames posted to the same lookout endpoint within a short window and
+    submits them in one multipart request (one `images` part per frame).
+
+    The endpoint is expected to answer with a JSON list, or {"batch": [...]}, holding
+    one detection payload per image in the order they were sent. If it answers with
+    anything else the frames of that batch are posted individually in parallel, and
+    the endpoint gets singles only for a while. Callers get a Future whose result
+    behaves like the response of a single post.
+    """
+
+    def __init__(self, mode=DETECTOR_BATCHING, window=DETECTOR_BATCH_WINDOW, max_size=DETECTOR_BATCH_MAX, workers=16):
+        self.mode = mode
+        self.window = window
+        self.max_size = max_size
+        self._queues = {}
+        self._unsupported_until = {}
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='detect-batch')
+        self._thread = None
+        self.batches = 0
+        self.batched_frames = 0
+        self.single_frames = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self):
+        return self.mode == 'multipart'
+
+    def submit(self, endpoint, image_bytes):
+        frame = PendingFrame(image_bytes)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, daemon=True, name='detect-batcher')
+                self._thread.start()
+            self._queues.setdefault(endpoint, []).append(frame)
+            self._cond.notify()
+        return frame.future
+
+    def stats(self):
+        with self._cond:
+            return {
+                'mode': self.mode,
+                'queued': sum(len(q) for q in self._queues.values()),
+                'batches': self.batches,
+                'batched_frames': self.batched_frames,
+                'single_frames': self.single_frames,
+                'fallbacks': self.fallbacks,
+            }
+
+    def _collect(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    ready = []
+                    next_deadline = None
+                    for endpoint, queue in list(self._queues.items()):
+                        deadline = queue[0].queued_at + self.window
+                        if len(queue) >= self.max_size or deadline <= now:
+                            ready.append((endpoint, queue[:self.max_size]))
+                            del queue[:self.max_size]
+                            if not queue:
+                                del self._queues[endpoint]
+                        elif next_deadline is None or deadline < next_deadline:
+                            next_deadline = deadline
+                    if ready:
+                        break
+                    self._cond.wait(None if next_deadline is None else next_deadline - now)
+            for endpoint, frames in ready:
+                self._executor.submit(self._send_batch, endpoint, frames)
+
+    def _send_batch(self, endpoint, frames):
+        if len(frames) > 1 and time.monotonic() >= self._unsupported_until.get(endpoint, 0):
+            try:
+                files = [('images', (f'frame{i}.jpg', frame.image_bytes, 'image/jpeg')) for i, frame in enumerate(frames)]
+                response = http_pool.post(endpoint, files=files)
+                results = response.json() if response.status_code == 200 else None
+                if isinstance(results, dict):
+                    results = results.get('batch')
+                if isinstance(results, list) and len(results) == len(frames):
+                    for frame, result in zip(frames, results):
+                        frame.future.set_result(BatchResult(result))
+                    with self._cond:
+                        self.batches += 1
+                        self.batched_frames += len(frames)
+                    return
+                log.warning("%s did not accept a batch (status %s), posting frames individually", endpoint, response.status_code)
+            except Exception as e:
+                log.error("Error posting batch to %s: %s", endpoint, e)
+            with self._cond:
+                self.fallbacks += 1
+                self._unsupported_until[endpoint] = time.monotonic() + BATCH_RETRY_AFTER
+
+        for frame in frames:
+            self._executor.submit(self._send_single, endpoint, frame)
+
+    def _send_single(self, endpoint, frame):
+        try:
+            response = http_pool.post(endpoint, data=frame.image_bytes, headers={'Content-Type': 'image/jpeg'})
+        except Exception as e:
+            frame.future.set_exception(e)
+            return
+        with self._cond:
+            self.single_frames += 1
+        frame.future.set_result(response)
+
+
+batch_dispatcher = BatchDispatcher()
@@ -0,0 +1,55 @@
+import time
+
+# Frames are compared at this size (width, height)
+THUMBNAIL_SIZE = (64, 36)
+
+
+class ChangeDetector:
+    """
+    Decides whether a frame has changed enough since the last one sent to the detector.
+
+    Frames are reduced to small grayscale thumbnails and compared by mean absolute
+    difference on a 0-255 scale. A threshold of 0 disables skipping. Even an unchanged
+    scene is sent again once max_skip_seconds have passed since the last post.
+    """
+
+    def __init__(self, threshold=0.0, max_skip_seconds=300):
+        self.threshold = threshold
+        self.max_skip_seconds = max_skip_seconds
+        self.sent = 0
+        self.skipped = 0
+        self.last_difference = None
+        self._reference = None
+        self._reference_time = 0.0
+
+    @staticmethod
+    def thumbnail(frame):
+        import cv2
+        import numpy as np
+        small = cv2.resize(frame, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small.astype(np.int16)
+
+    def should_send(self, frame):
+        """Compare the frame with the last one sent; returns False if it should be skipped."""
+        thumb = self.thumbnail(frame)
+        now = time.time()
+        if self._reference is not None:
+            self.last_difference = float(abs(thumb - self._reference).mean())
+            if (self.threshold > 0 and self.last_difference < self.threshold
+                    and now - self._reference_time < self.max_skip_seconds):
+                self.skipped += 1
+                return False
+        self._reference = thumb
+        self._reference_time = now
+        self.sent += 1
+        return True
+
+    def stats(self):
+        return {
+            'frames_sent': self.sent,
+            'frames_skipped': self.skipped,
+            'last_difference': None if self.last_difference is None else round(self.last_difference, 3),
+            'change_threshold': self.threshold,
+        }
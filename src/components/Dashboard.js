@@ -15,7 +15,14 @@ function Dashboard() {
   const navigate = useNavigate()
 
   const { instances, loading, error, refreshInstances } = useInstances()
-  const { systemStats } = useSocket()
+  const { systemStats, restoreProgress } = useSocket()
+
+  // Pick up the instances a server restart brought back
+  useEffect(() => {
+    if (restoreProgress && restoreProgress.done) {
+      refreshInstances()
+    }
+  }, [restoreProgress && restoreProgress.done])
 
   const showNotification = (message, type = 'info') => {
     const id = Date.now()
@@ -136,6 +143,14 @@ function Dashboard() {
         </div>
       </header>
 
+      {restoreProgress && !restoreProgress.done && (
+        <div className="restore-progress">
+          <i className="fas fa-sync-alt"></i> Restoring instances:{' '}
+          {restoreProgress.restored} of {restoreProgress.total}
+          {restoreProgress.failed > 0 && ` (${restoreProgress.failed} failed)`}
+        </div>
+      )}
+
       <InstancesTable
         instances={filteredInstances}
         onStart={(name) => handleInstanceAction(name, 'start')}
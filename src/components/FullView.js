@@ -1,10 +1,36 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import { useNavigate } from 'react-router-dom'
+import io from 'socket.io-client'
+
+// Pushed updates keep the view current; polling only catches anything missed
+const FALLBACK_POLL_MS = 60000
+
+const formatTimestamp = (seconds) => {
+  const date = new Date(seconds * 1000)
+  const pad = (n) => String(n).padStart(2, '0')
+  return `${date.getFullYear()}-${pad(date.getMonth() + 1)}-${pad(
+    date.getDate()
+  )} ${pad(date.getHours())}:${pad(date.getMinutes())}:${pad(
+    date.getSeconds()
+  )}`
+}
+
+const hasResults = (detections) =>
+  !!(detections && detections.results && detections.results.length > 0)
 
 function FullView() {
   const navigate = useNavigate()
   const [images, setImages] = useState([])
   const [loading, setLoading] = useState(true)
+  const imagesRef = useRef([])
+
+  const updateImages = (update) => {
+    setImages((prev) => {
+      const next = update(prev)
+      imagesRef.current = next
+      return next
+    })
+  }
 
   const handleBack = () => {
     navigate('/')
@@ -18,7 +44,7 @@ function FullView() {
         const imagesData = await imagesResponse.json()
 
         // Detect if any image file changed (by modified_at)
-        const previous = images
+        const previous = imagesRef.current
         const changed =
           previous.length !== imagesData.images.length ||
           imagesData.images.some((img, idx) => {
@@ -43,7 +69,7 @@ function FullView() {
           return { ...image, detections }
         })
 
-        setImages(imagesWithDetections || [])
+        updateImages(() => imagesWithDetections || [])
       } else {
         console.error('Failed to fetch data:', imagesResponse.status)
       }
@@ -54,10 +80,44 @@ function FullView() {
     }
   }
 
+  const applyUpdate = (instance, changes) => {
+    if (!imagesRef.current.some((image) => image.instance === instance)) {
+      // A camera we haven't listed yet; pick it up from the API
+      fetchImages()
+      return
+    }
+    updateImages((prev) =>
+      prev.map((image) =>
+        image.instance === instance ? { ...image, ...changes } : image
+      )
+    )
+  }
+
   useEffect(() => {
     fetchImages()
-    const interval = setInterval(fetchImages, 10000)
-    return () => clearInterval(interval)
+    const interval = setInterval(fetchImages, FALLBACK_POLL_MS)
+
+    const socket = io({ transports: ['websocket', 'polling'] })
+    socket.on('connect', () => {
+      socket.emit('subscribe', { min_interval: 1 })
+    })
+    socket.on('frame_updated', (update) => {
+      applyUpdate(update.instance, {
+        url: update.url,
+        modified_at: update.modified_at,
+        timestamp: formatTimestamp(update.modified_at),
+      })
+    })
+    socket.on('detections_updated', (update) => {
+      applyUpdate(update.instance, {
+        detections: hasResults(update.detections) ? update.detections : null,
+      })
+    })
+
+    return () => {
+      clearInterval(interval)
+      socket.close()
+    }
   }, [])
 
   return (
@@ -83,7 +143,7 @@ function FullView() {
               <div key={index} className="image-card">
                 <div className="image-container">
                   <img
-                    src={`${image.url}?t=${Date.now()}`}
+                    src={`${image.url}?w=640&v=${image.modified_at}`}
                     alt={`Camera ${image.source}`}
                     className="camera-image"
                     onError={(e) => {
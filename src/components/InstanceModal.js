@@ -14,6 +14,10 @@ function InstanceModal({ instance, onClose, onSave }) {
     lookout_endpoint: '',
     latitude: 0.0,
     longitude: 0.0,
+    adaptive: false,
+    min_frequency: '',
+    max_frequency: '',
+    daylight_hours: '',
   })
 
   const [loading, setLoading] = useState(false)
@@ -37,6 +41,10 @@ function InstanceModal({ instance, onClose, onSave }) {
         lookout_endpoint: instance.lookout_endpoint || '',
         latitude: instance.latitude || 0.0,
         longitude: instance.longitude || 0.0,
+        adaptive: !!instance.adaptive,
+        min_frequency: instance.min_frequency || '',
+        max_frequency: instance.max_frequency || '',
+        daylight_hours: instance.daylight_hours || '',
       })
     } else {
       // Adding new instance
@@ -52,15 +60,19 @@ function InstanceModal({ instance, onClose, onSave }) {
         lookout_endpoint: '',
         latitude: 0.0,
         longitude: 0.0,
+        adaptive: false,
+        min_frequency: '',
+        max_frequency: '',
+        daylight_hours: '',
       })
     }
   }, [instance])
 
   const handleInputChange = (e) => {
-    const { name, value } = e.target
+    const { name, value, type, checked } = e.target
     setFormData((prev) => ({
       ...prev,
-      [name]: value,
+      [name]: type === 'checkbox' ? checked : value,
     }))
   }
 
@@ -76,6 +88,13 @@ function InstanceModal({ instance, onClose, onSave }) {
         lookout_endpoint: formData.lookout_endpoint,
         latitude: parseFloat(formData.latitude),
         longitude: parseFloat(formData.longitude),
+        adaptive: formData.adaptive,
+      }
+
+      if (formData.adaptive) {
+        data.min_frequency = formData.min_frequency ? parseInt(formData.min_frequency) : null
+        data.max_frequency = formData.max_frequency ? parseInt(formData.max_frequency) : null
+        data.daylight_hours = formData.daylight_hours || null
       }
 
       // Add type-specific fields
@@ -225,6 +244,58 @@ function InstanceModal({ instance, onClose, onSave }) {
                 required
               />
             </div>
+            <div className="form-group">
+              <label htmlFor="adaptive">
+                <input
+                  type="checkbox"
+                  id="adaptive"
+                  name="adaptive"
+                  checked={formData.adaptive}
+                  onChange={handleInputChange}
+                />{' '}
+                Adaptive frequency
+              </label>
+            </div>
+            {formData.adaptive && (
+              <div className="adaptive-fields">
+                <div className="form-group">
+                  <label htmlFor="min-frequency">Minimum (seconds):</label>
+                  <input
+                    type="number"
+                    id="min-frequency"
+                    name="min_frequency"
+                    min="1"
+                    placeholder={Math.max(1, Math.round(formData.frequency / 4))}
+                    value={formData.min_frequency}
+                    onChange={handleInputChange}
+                  />
+                </div>
+                <div className="form-group">
+                  <label htmlFor="max-frequency">Maximum (seconds):</label>
+                  <input
+                    type="number"
+                    id="max-frequency"
+                    name="max_frequency"
+                    min="1"
+                    placeholder={formData.frequency * 4}
+                    value={formData.max_frequency}
+                    onChange={handleInputChange}
+                  />
+                </div>
+                <div className="form-group">
+                  <label htmlFor="daylight-hours">Daylight Hours:</label>
+                  <input
+                    type="text"
+                    id="daylight-hours"
+                    name="daylight_hours"
+                    placeholder="06:00-20:00"
+                    pattern="\d{1,2}(:\d{2})?-\d{1,2}(:\d{2})?"
+                    value={formData.daylight_hours}
+                    onChange={handleInputChange}
+                  />
+                </div>
+              </div>
+            )}
             <div className="form-group">
               <label htmlFor="lookout-endpoint">Lookout Endpoint:</label>
               <input
@@ -81,9 +81,29 @@ function InstancesTable({ instances, onStart, onStop, onEdit, onDelete, filterTy
                     {(instance.status || 'stopped').charAt(0).toUpperCase() +
                       (instance.status || 'stopped').slice(1)}
                   </span>
+                  {instance.detector_circuit && instance.detector_circuit !== 'closed' && (
+                    <span
+                      className={`status-badge circuit-${instance.detector_circuit}`}
+                      title="Detector endpoint is failing; frames are not being sent"
+                    >
+                      {instance.detector_circuit === 'open' ? 'Detector down' : 'Detector retrying'}
+                    </span>
+                  )}
                 </td>
                 <td>{instance.name}</td>
-                <td>{instance.frequency}</td>
+                <td>
+                  {instance.frequency}
+                  {instance.effective_frequency !== undefined &&
+                    instance.effective_frequency !== instance.frequency && (
+                      <span
+                        className="effective-frequency"
+                        title={instance.sampling ? instance.sampling.reason : ''}
+                      >
+                        {' '}
+                        (now {Math.round(instance.effective_frequency)})
+                      </span>
+                    )}
+                </td>
                 <td>{getInstanceType(instance)}</td>
                 <td>
                   <a
@@ -0,0 +1,198 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from src.log import get_logger
+
+log = get_logger('history')
+
+DETECTION_DB = os.getenv('DETECTION_DB', './detections.db')
+DETECTION_RETENTION_DAYS = float(os.getenv('DETECTION_RETENTION_DAYS', '30'))
+# Rows are written in one transaction per batch, at least this often
+HISTORY_FLUSH_INTERVAL = 1.0
+HISTORY_BATCH_MAX = 500
+# How often rows past retention are deleted and the freed pages returned to the filesystem
+HISTORY_COMPACT_INTERVAL = 3600
+HISTORY_QUERY_LIMIT = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    instance TEXT NOT NULL,
+    score REAL,
+    left REAL,
+    top REAL,
+    right REAL,
+    bottom REAL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_detections_instance_ts ON detections (instance, ts);
+CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections (ts);
+"""
+
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) else None
+
+
+class DetectionHistory:
+    """
+    Append-only log of every detection result, kept in SQLite in WAL mode.
+
+    Capture threads only put rows on a queue; a writer thread inserts them in batches,
+    one transaction per batch, and periodically deletes rows older than the retention
+    period and compacts the file. Queries open their own connection per thread, which
+    WAL lets run alongside the writer.
+    """
+
+    def __init__(self, path=DETECTION_DB, retention_days=DETECTION_RETENTION_DAYS,
+                 flush_interval=HISTORY_FLUSH_INTERVAL, batch_max=HISTORY_BATCH_MAX):
+        self.path = path
+        self.retention_days = retention_days
+        self.flush_interval = flush_interval
+        self.batch_max = batch_max
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.inserted = 0
+        self.deleted = 0
+        self.errors = 0
+        self._writer = self._connect()
+        # Must be set before the first table is created to take effect
+        self._writer.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self._writer.executescript(SCHEMA)
+        self._thread = threading.Thread(target=self._run, daemon=True, name='detection-history')
+        self._thread.start()
+
+    def handle_event(self, instance_obj, event, payload):
+        """Instance listener: log each detection result as it is recorded"""
+        if event == 'detections_updated':
+            self.record(instance_obj.name, payload.get('detections'))
+
+    def record(self, instance_name, detection_data, timestamp=None):
+        if not isinstance(detection_data, dict):
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        for result in detection_data.get('results', []) or []:
+            if not isinstance(result, dict):
+                continue
+            self._queue.put((
+                timestamp, instance_name, _number(result.get('score')),
+                _number(result.get('left')), _number(result.get('top')),
+                _number(result.get('right')), _number(result.get('bottom')),
+                json.dumps(result),
+            ))
+
+    def query(self, instance=None, start=None, end=None, bbox=None, min_score=None, limit=HISTORY_QUERY_LIMIT):
+        """
+        Detections, newest first. `start`/`end` are epoch seconds; `bbox` is
+        (left, top, right, bottom) and matches detections whose box overlaps it.
+        """
+        clauses, params = [], []
+        if instance is not None:
+            clauses.append('instance = ?')
+            params.append(instance)
+        if start is not None:
+            clauses.append('ts >= ?')
+            params.append(start)
+        if end is not None:
+            clauses.append('ts <= ?')
+            params.append(end)
+        if min_score is not None:
+            clauses.append('score >= ?')
+            params.append(min_score)
+        if bbox is not None:
+            left, top, right, bottom = bbox
+            clauses.append('left < ? AND right > ? AND top < ? AND bottom > ?')
+            params.extend([right, left, bottom, top])
+        sql = 'SELECT ts, instance, data FROM detections'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY ts DESC LIMIT ?'
+        params.append(limit)
+        rows = self._reader().execute(sql, params).fetchall()
+        return [dict(json.loads(data), timestamp=ts, instance=name) for ts, name, data in rows]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': self.path,
+                'queued': self._queue.qsize(),
+                'inserted': self.inserted,
+                'deleted': self.deleted,
+                'errors': self.errors,
+                'size': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            }
+
+    def shutdown(self, timeout=5):
+        """Write out whatever is still queued"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _reader(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    def _run(self):
+        last_compact = 0.0
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_max:
+                try:
+                    row = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            if batch:
+                self._insert(batch)
+            if not stopping and time.monotonic() - last_compact >= HISTORY_COMPACT_INTERVAL:
+                last_compact = time.monotonic()
+                self._compact()
+
+    def _insert(self, batch):
+        try:
+            with self._writer:
+                self._writer.executemany(
+                    'INSERT INTO detections (ts, instance, score, left, top, right, bottom, data) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+            with self._lock:
+                self.inserted += len(batch)
+        except sqlite3.Error as e:
+            log.error("Error writing %d detections: %s", len(batch), e)
+            with self._lock:
+                self.errors += 1
+
+    def _compact(self):
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        try:
+            with self._writer:
+                deleted = self._writer.execute('DELETE FROM detections WHERE ts < ?', (cutoff,)).rowcount
+            if deleted:
+                self._writer.execute('PRAGMA incremental_vacuum')
+                self._writer.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                log.info("Removed %d detections older than %s days", deleted, self.retention_days)
+            with self._lock:
+                self.deleted += deleted
+        except sqlite3.Error as e:
+            log.error("Error removing old detections: %s", e)
+            with self._lock:
+                self.errors += 1
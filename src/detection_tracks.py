@@ -0,0 +1,156 @@
+import os
+import time
+
+# How much two boxes must overlap (after time decay) to count as the same event
+TRACK_IOU_THRESHOLD = float(os.getenv('TRACK_IOU_THRESHOLD', '0.3'))
+# A track's match strength halves for every this many seconds it goes unseen
+TRACK_HALF_LIFE = float(os.getenv('TRACK_HALF_LIFE', '1800'))
+# Tracks not seen for this long are forgotten once their cooldown has also ended
+TRACK_TTL = float(os.getenv('TRACK_TTL', '600'))
+TRACK_MAX_PER_INSTANCE = int(os.getenv('TRACK_MAX_PER_INSTANCE', '64'))
+
+
+def detection_box(result):
+    """(left, top, right, bottom) of a detection result, or None if it has no usable box"""
+    try:
+        left, top, right, bottom = (float(result[k]) for k in ('left', 'top', 'right', 'bottom'))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (min(left, right), min(top, bottom), max(left, right), max(top, bottom))
+
+
+def iou(a, b):
+    if a is None or b is None:
+        # Detections without boxes can only be told apart by instance
+        return 1.0 if a is None and b is None else 0.0
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 1.0 if a == b else 0.0
+    inter = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """One ongoing event (e.g. a smoke plume) seen by an instance, followed as its box drifts."""
+
+    def __init__(self, box, score, now):
+        self.box = box
+        self.score = score
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        self.last_alerted = None
+        # True while an alert for this track is queued or being delivered
+        self.claimed = False
+
+    def update(self, box, score, now):
+        self.box = box
+        self.score = score
+        self.last_seen = now
+        self.hits += 1
+
+
+class TrackIndex:
+    """
+    Per-instance index of detection tracks, used to tell a new event from one already seen.
+
+    Each observed box is matched to the existing track it overlaps most, with a track's
+    overlap weighted down the longer it has gone unseen, so a plume that drifts a few
+    pixels or changes score stays the same track while a box in the same place hours
+    later does not. Tracks expire once they have been unseen for `ttl` and are past
+    their alert cooldown, and each instance keeps at most `max_tracks` (least recently
+    seen dropped first), so memory stays bounded however long the app runs.
+
+    Not thread-safe; callers serialize access.
+    """
+
+    def __init__(self, cooldown, iou_threshold=TRACK_IOU_THRESHOLD, half_life=TRACK_HALF_LIFE,
+                 ttl=TRACK_TTL, max_tracks=TRACK_MAX_PER_INSTANCE):
+        self.cooldown = cooldown
+        self.iou_threshold = iou_threshold
+        self.half_life = half_life
+        self.ttl = ttl
+        self.max_tracks = max_tracks
+        self._tracks = {}
+        self.created = 0
+        self.expired = 0
+
+    def observe(self, instance_name, results, now=None):
+        """Match detection results to the instance's tracks and return the tracks they belong to."""
+        now = time.monotonic() if now is None else now
+        tracks = self._tracks.setdefault(instance_name, [])
+        self._expire(instance_name, now)
+
+        candidates = []
+        boxes = [(detection_box(r), r.get('score', 0)) for r in results]
+        for i, (box, _) in enumerate(boxes):
+            for track in tracks:
+                strength = iou(box, track.box) * self._decay(track, now)
+                if strength >= self.iou_threshold:
+                    candidates.append((strength, i, track))
+        # Greedy one-to-one assignment, strongest matches first
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        matched = {}
+        used = set()
+        for _, i, track in candidates:
+            if i in matched or id(track) in used:
+                continue
+            matched[i] = track
+            used.add(id(track))
+
+        observed = []
+        for i, (box, score) in enumerate(boxes):
+            track = matched.get(i)
+            if track is None:
+                track = Track(box, score, now)
+                tracks.append(track)
+                self.created += 1
+            else:
+                track.update(box, score, now)
+            observed.append(track)
+
+        if len(tracks) > self.max_tracks:
+            tracks.sort(key=lambda t: t.last_seen, reverse=True)
+            self.expired += len(tracks) - self.max_tracks
+            del tracks[self.max_tracks:]
+        return observed
+
+    def cooldown_remaining(self, track, now=None):
+        """Seconds until the track may alert again (0 if it may alert now)"""
+        if track.last_alerted is None:
+            return 0
+        now = time.monotonic() if now is None else now
+        return max(0, self.cooldown - (now - track.last_alerted))
+
+    def remove_instance(self, instance_name):
+        self._tracks.pop(instance_name, None)
+
+    def stats(self):
+        return {
+            'instances': len(self._tracks),
+            'tracks': sum(len(t) for t in self._tracks.values()),
+            'created': self.created,
+            'expired': self.expired,
+        }
+
+    def sweep(self, now=None):
+        """Expire stale tracks of every instance, dropping instances left with none"""
+        now = time.monotonic() if now is None else now
+        for instance_name in list(self._tracks):
+            self._expire(instance_name, now)
+            if not self._tracks[instance_name]:
+                del self._tracks[instance_name]
+
+    def _decay(self, track, now):
+        if not self.half_life:
+            return 1.0
+        return 0.5 ** ((now - track.last_seen) / self.half_life)
+
+    def _expire(self, instance_name, now):
+        tracks = self._tracks[instance_name]
+        alive = [t for t in tracks
+                 if t.claimed or now - t.last_seen < self.ttl or self.cooldown_remaining(t, now) > 0]
+        self.expired += len(tracks) - len(alive)
+        tracks[:] = alive
@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from src.http_pool import endpoint_key
+from src.log import get_logger
+from src.metrics import metrics
+
+log = get_logger('detector')
+
+# Detector posts in flight at once per endpoint; further frames wait, newest per instance only
+DETECTOR_MAX_IN_FLIGHT = int(os.getenv('DETECTOR_MAX_IN_FLIGHT', '8'))
+# Frames that waited longer than this many seconds for a free slot are dropped, not posted
+DETECTOR_MAX_FRAME_AGE = float(os.getenv('DETECTOR_MAX_FRAME_AGE', '30'))
+# Consecutive failed posts that open an endpoint's circuit
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', '5'))
+# Seconds an opened circuit stays open; doubled each time a trial post fails, up to the maximum
+BREAKER_BACKOFF = float(os.getenv('BREAKER_BACKOFF', '5'))
+BREAKER_MAX_BACKOFF = float(os.getenv('BREAKER_MAX_BACKOFF', '300'))
+# Threads posting frames, shared by all endpoints
+DETECTOR_POST_WORKERS = int(os.getenv('DETECTOR_POST_WORKERS', '64'))
+
+
+def is_failure(result):
+    """Whether a detector post result ('ok', 'error', 'http_<status>') says the endpoint is in trouble"""
+    if result == 'error':
+        return True
+    if result.startswith('http_'):
+        status = int(result[len('http_'):])
+        return status >= 500 or status == 429
+    return False
+
+
+class CircuitBreaker:
+    """
+    Closed, open or half-open state of one detector endpoint.
+
+    Closed lets every post through. `failure_threshold` consecutive failures open the
+    circuit, and nothing is posted for `backoff` seconds. After that the circuit is
+    half-open: a single trial post goes through, and closes the circuit if it succeeds
+    or opens it again for twice as long if it fails, up to `max_backoff`.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, backoff=BREAKER_BACKOFF, max_backoff=BREAKER_MAX_BACKOFF):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.state = 'closed'
+        self.failures = 0
+        self.backoff = backoff
+        self.opened = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a post may go out now. A True in half-open state is the trial post"""
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() < self._open_until:
+                    return False
+                self.state = 'half_open'
+                self._trial_in_flight = False
+            if self.state == 'half_open':
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def record(self, ok):
+        with self._lock:
+            if self.state == 'open':
+                # Answers to posts sent before the circuit opened say nothing new
+                return
+            if ok:
+                if self.state == 'half_open':
+                    log.info("Detector endpoint recovered, closing circuit")
+                self.state = 'closed'
+                self.failures = 0
+                self.backoff = self.base_backoff
+                return
+            self.failures += 1
+            if self.state == 'half_open':
+                self._open(min(self.max_backoff, self.backoff * 2))
+            elif self.failures >= self.failure_threshold:
+                self._open(self.base_backoff)
+
+    def abandon(self):
+        """A post allowed through was never sent; in half-open state another trial may go"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def is_open(self):
+        with self._lock:
+            return self.state == 'open' and time.monotonic() < self._open_until
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'opened': self.opened,
+                'backoff': self.backoff,
+                'retry_in': round(max(0.0, self._open_until - time.monotonic()), 1) if self.state == 'open' else 0,
+            }
+
+    def _open(self, backoff):
+        self.state = 'open'
+        self.backoff = backoff
+        self.opened += 1
+        self._open_until = time.monotonic() + backoff
+        self._trial_in_flight = False
+        log.warning("Detector endpoint failing, opening circuit for %gs", backoff)
+
+
+class PendingPost:
+    def __init__(self, instance, image_bytes, transform):
+        self.instance = instance
+        self.image_bytes = image_bytes
+        self.transform = transform
+        self.queued_at = time.monotonic()
+
+
+class Endpoint:
+    def __init__(self, key):
+        self.key = key
+        self.breaker = CircuitBreaker()
+        self.pending = OrderedDict()  # instance name -> PendingPost, oldest first
+        self.in_flight = 0
+        self.posted = 0
+        self.dropped = {}  # reason -> frames
+
+
+class DetectorGate:
+    """
+    Posts frames to lookout endpoints off the capture thread, with backpressure.
+
+    Capture cycles hand their frame over and carry on. Each endpoint (scheme, host and
+    port) has at most `max_in_flight` posts in flight; other frames wait in a queue
+    that holds only the newest frame of each instance, so a frame that is overtaken by
+    a fresher one from the same instance is dropped instead of posted late. Frames that
+    still waited more than `max_age` seconds are dropped too. Each endpoint has a
+    CircuitBreaker: while it is open, frames for the endpoint are dropped at once.
+    """
+
+    def __init__(self, max_in_flight=DETECTOR_MAX_IN_FLIGHT, max_age=DETECTOR_MAX_FRAME_AGE, workers=DETECTOR_POST_WORKERS):
+        self.max_in_flight = max_in_flight
+        self.max_age = max_age
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='detect-post')
+
+    def submit(self, instance, image_bytes, transform=None):
+        """Queue a frame for the instance's endpoint. Returns False if it was dropped because the circuit is open"""
+        endpoint = self._endpoint(instance.lookout_endpoint)
+        if endpoint.breaker.is_open():
+            self._drop(endpoint, instance, 'circuit_open')
+            return False
+        with self._lock:
+            replaced = endpoint.pending.pop(instance.name, None)
+            endpoint.pending[instance.name] = PendingPost(instance, image_bytes, transform)
+        if replaced is not None:
+            self._drop(endpoint, instance, 'replaced')
+        self._pump(endpoint)
+        return True
+
+    def breaker(self, url):
+        return self._endpoint(url).breaker
+
+    def state(self, url):
+        """Circuit state of the endpoint serving `url`"""
+        with self._lock:
+            endpoint = self._endpoints.get(endpoint_key(url))
+        return endpoint.breaker.state if endpoint is not None else 'closed'
+
+    def stats(self):
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+            return {endpoint.key: {
+                **endpoint.breaker.stats(),
+                'in_flight': endpoint.in_flight,
+                'pending': len(endpoint.pending),
+                'posted': endpoint.posted,
+                'dropped': dict(endpoint.dropped),
+            } for endpoint in endpoints}
+
+    def _endpoint(self, url):
+        key = endpoint_key(url)
+        with self._lock:
+            endpoint = self._endpoints.get(key)
+            if endpoint is None:
+                endpoint = self._endpoints[key] = Endpoint(key)
+            return endpoint
+
+    def _drop(self, endpoint, instance, reason):
+        with self._lock:
+            endpoint.dropped[reason] = endpoint.dropped.get(reason, 0) + 1
+        instance.record_drop(reason)
+
+    def _pump(self, endpoint):
+        """Start posts for waiting frames while the endpoint has room and its circuit allows"""
+        dropped = []
+        with self._lock:
+            while endpoint.pending and endpoint.in_flight < self.max_in_flight:
+                name, post = next(iter(endpoint.pending.items()))
+                if not post.instance.run or time.monotonic() - post.queued_at > self.max_age:
+                    del endpoint.pending[name]
+                    dropped.append((post.instance, 'stale'))
+                    continue
+                if not endpoint.breaker.allow():
+                    if endpoint.breaker.is_open():
+                        # Waiting frames would be stale by the time the circuit closes
+                        dropped.extend((p.instance, 'circuit_open') for p in endpoint.pending.values())
+                        endpoint.pending.clear()
+                    # Otherwise a half-open trial post is out; its answer pumps again
+                    break
+                del endpoint.pending[name]
+                endpoint.in_flight += 1
+                self._executor.submit(self._post, endpoint, post)
+        for instance, reason in dropped:
+            self._drop(endpoint, instance, reason)
+
+    def _post(self, endpoint, post):
+        metrics.observe(post.instance.name, 'detector_queue', time.monotonic() - post.queued_at)
+        result = 'error'
+        try:
+            result = post.instance.send_detection(post.image_bytes, post.transform)
+        except Exception as e:
+            post.instance.log.error("Error sending frame to detector: %s", e)
+        finally:
+            endpoint.breaker.record(not is_failure(result))
+            with self._lock:
+                endpoint.in_flight -= 1
+                endpoint.posted += 1
+            self._pump(endpoint)
+
+
+detector_gate = DetectorGate()
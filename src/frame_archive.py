@@ -0,0 +1,325 @@
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+
+from src.frame_writer import frame_writer
+from src.log import get_logger
+
+log = get_logger('archive')
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', './archive')
+# Frames kept per instance in its ring buffer; 0 turns the archive off
+ARCHIVE_RING_FRAMES = int(os.getenv('ARCHIVE_RING_FRAMES', '120'))
+# Seconds of frames before and after a detection that are promoted to its incident
+ARCHIVE_PRE_SECONDS = float(os.getenv('ARCHIVE_PRE_SECONDS', '300'))
+ARCHIVE_POST_SECONDS = float(os.getenv('ARCHIVE_POST_SECONDS', '300'))
+ARCHIVE_MIN_SCORE = float(os.getenv('ARCHIVE_MIN_SCORE', '0.5'))
+# Caps on the incident folders; the oldest incidents are removed first
+ARCHIVE_MAX_MB = float(os.getenv('ARCHIVE_MAX_MB', '2048'))
+ARCHIVE_RETENTION_DAYS = float(os.getenv('ARCHIVE_RETENTION_DAYS', '30'))
+ARCHIVE_SWEEP_INTERVAL = 60
+
+
+def archive_slug(name):
+    return re.sub(r'[^a-z0-9_-]', '', name.lower().replace(' ', '_')) or 'instance'
+
+
+class FrameRing:
+    """
+    The last `capacity` frames of one instance, as fixed slot files plus an index.
+
+    Slots are reused in turn, so the ring never grows. Frames are written through the
+    shared frame writer, and the index (slot -> sequence number, time, size) is
+    rewritten after each frame lands, which the writer coalesces when frames arrive
+    faster than it can keep up. Because slot files are replaced by rename, a frame that
+    was hard-linked elsewhere keeps its content when its slot is reused. The index also
+    records each slot file's inode, so `keep` can tell whether a slot still holds the
+    frame it was asked for. The ring's size on disk is bounded by its capacity and is not
+    counted against the incident caps.
+    """
+
+    def __init__(self, instance_name, directory, capacity, on_archived=None):
+        self.instance_name = instance_name
+        self.directory = directory
+        self.capacity = capacity
+        self.on_archived = on_archived
+        self.index_path = os.path.join(directory, 'index.json')
+        self._lock = threading.Lock()
+        self._slots = {}
+        self.seq = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def slot_path(self, slot):
+        return os.path.join(self.directory, f'slot_{slot:04d}.jpg')
+
+    def append(self, image_bytes, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            seq = self.seq
+            self.seq += 1
+        slot = seq % self.capacity
+        frame_writer.write(self.slot_path(slot), image_bytes,
+                           on_written=lambda path, data: self._written(slot, seq, timestamp, len(data)))
+
+    def frames(self, since=None):
+        """(seq, timestamp, path) of the frames on disk, oldest first"""
+        with self._lock:
+            entries = sorted(self._slots.items(), key=lambda item: item[1]['seq'])
+        return [(e['seq'], e['ts'], self.slot_path(slot)) for slot, e in entries
+                if since is None or e['ts'] >= since]
+
+    def keep(self, seq, target):
+        """Hard-link (or copy) frame `seq` to `target`. False if its slot was reused by a newer frame"""
+        slot = seq % self.capacity
+        with self._lock:
+            entry = self._slots.get(slot)
+            inode = entry.get('ino') if entry is not None and entry['seq'] == seq else None
+        if inode is None:
+            return False
+        path = self.slot_path(slot)
+        # The writer renames a newer frame over the slot without taking the ring's lock, so
+        # the slot may have been replaced since the check; a new file has a new inode
+        with open(path, 'rb') as src:
+            st = os.fstat(src.fileno())
+            if st.st_ino != inode:
+                return False
+            try:
+                os.link(path, target)
+            except OSError:
+                # Copy from the handle just checked, not from whatever the path holds now
+                try:
+                    with open(target, 'wb') as dst:
+                        shutil.copyfileobj(src, dst)
+                    os.utime(target, (st.st_atime, st.st_mtime))
+                except OSError:
+                    # Don't leave a partial copy that later promotions would take as done
+                    if os.path.exists(target):
+                        os.remove(target)
+                    raise
+                return True
+        if os.stat(target).st_ino != inode:
+            os.remove(target)
+            return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'frames': len(self._slots),
+                'bytes': sum(e['size'] for e in self._slots.values()),
+            }
+
+    def _written(self, slot, seq, timestamp, size):
+        # The writer is the only one replacing slot files, so this is still the file just written
+        try:
+            inode = os.stat(self.slot_path(slot)).st_ino
+        except OSError:
+            return
+        with self._lock:
+            self._slots[slot] = {'seq': seq, 'ts': timestamp, 'size': size, 'ino': inode}
+            index = json.dumps({'capacity': self.capacity, 'slots': self._slots}).encode()
+        frame_writer.write(self.index_path, index)
+        if self.on_archived is not None:
+            self.on_archived(self, seq, timestamp, self.slot_path(slot))
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        for slot, entry in index.get('slots', {}).items():
+            slot = int(slot)
+            if slot >= self.capacity:
+                continue
+            try:
+                entry['ino'] = os.stat(self.slot_path(slot)).st_ino
+            except OSError:
+                continue
+            self._slots[slot] = entry
+        if self._slots:
+            self.seq = max(e['seq'] for e in self._slots.values()) + 1
+
+
+class Incident:
+    def __init__(self, instance_name, directory, start, until):
+        self.instance_name = instance_name
+        self.directory = directory
+        # Frames taken between start and until belong to the incident
+        self.start = start
+        self.until = until
+
+
+class FrameArchive:
+    """
+    Ring buffers of recent frames per instance, with incident promotion.
+
+    When an instance reports a detection, the frames of the preceding `pre_seconds`
+    and the frames captured for `post_seconds` afterwards are kept in an incident folder
+    (hard-linked from the ring where the filesystem allows, copied otherwise); further
+    detections extend the open incident. A background thread does the promotion and
+    keeps the incident folders under the size and age caps; the rings are bounded by
+    their capacity instead and are not capped.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR, pre_seconds=ARCHIVE_PRE_SECONDS, post_seconds=ARCHIVE_POST_SECONDS,
+                 min_score=ARCHIVE_MIN_SCORE, max_mb=ARCHIVE_MAX_MB, retention_days=ARCHIVE_RETENTION_DAYS):
+        self.root = root
+        self.incidents_dir = os.path.join(root, 'incidents')
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.min_score = min_score
+        self.max_bytes = max_mb * 1024 * 1024
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._rings = {}
+        self._open = {}  # instance name -> open incident
+        self._queue = queue.Queue()
+        self.promoted = 0
+        self.incidents = 0
+        self.removed_incidents = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name='frame-archive')
+        self._thread.start()
+
+    def ring(self, instance_name, capacity=ARCHIVE_RING_FRAMES):
+        """The ring buffer for an instance, or None if archiving is off for it"""
+        if not capacity:
+            return None
+        with self._lock:
+            ring = self._rings.get(instance_name)
+            if ring is None or ring.capacity != capacity:
+                ring = FrameRing(instance_name, os.path.join(self.root, archive_slug(instance_name), 'ring'),
+                                 capacity, on_archived=self._frame_archived)
+                self._rings[instance_name] = ring
+            return ring
+
+    def handle_event(self, instance_obj, event, payload):
+        """Instance listener: open or extend an incident when detections come in"""
+        if event != 'detections_updated':
+            return
+        detection_data = payload.get('detections')
+        if not isinstance(detection_data, dict):
+            return
+        if any(r.get('score', 0) >= self.min_score for r in detection_data.get('results', []) or []):
+            self.promote(instance_obj.name)
+
+    def promote(self, instance_name):
+        now = time.time()
+        with self._lock:
+            ring = self._rings.get(instance_name)
+            if ring is None:
+                return
+            incident = self._open.get(instance_name)
+            if incident is None or incident.until < now:
+                directory = os.path.join(self.incidents_dir, archive_slug(instance_name),
+                                         datetime.now().strftime('%Y%m%d-%H%M%S'))
+                incident = Incident(instance_name, directory, now - self.pre_seconds, now + self.post_seconds)
+                self._open[instance_name] = incident
+                self.incidents += 1
+                log.info("Incident opened for %s in %s", instance_name, directory, extra={'instance': instance_name})
+            else:
+                incident.until = now + self.post_seconds
+        self._queue.put((incident, ring, ring.frames(since=incident.start)))
+
+    def incident_list(self):
+        incidents = []
+        for directory, size, mtime in self._incident_dirs():
+            instance_dir, name = os.path.split(directory)
+            incidents.append({
+                'instance': os.path.basename(instance_dir),
+                'incident': name,
+                'frames': len(os.listdir(directory)),
+                'bytes': size,
+                'updated_at': mtime,
+            })
+        return incidents
+
+    def stats(self):
+        with self._lock:
+            rings = {name: ring.stats() for name, ring in self._rings.items()}
+            return {
+                'rings': rings,
+                'open_incidents': [name for name, incident in self._open.items() if incident.until >= time.time()],
+                'incidents_opened': self.incidents,
+                'frames_promoted': self.promoted,
+                'incidents_removed': self.removed_incidents,
+            }
+
+    def _frame_archived(self, ring, seq, timestamp, path):
+        with self._lock:
+            incident = self._open.get(ring.instance_name)
+        if incident is not None and incident.start <= timestamp <= incident.until:
+            self._queue.put((incident, ring, [(seq, timestamp, path)]))
+
+    def _run(self):
+        last_sweep = 0.0
+        while True:
+            try:
+                incident, ring, frames = self._queue.get(timeout=ARCHIVE_SWEEP_INTERVAL)
+                self._promote_frames(incident, ring, frames)
+            except queue.Empty:
+                pass
+            if time.monotonic() - last_sweep >= ARCHIVE_SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                self._enforce_caps()
+
+    def _promote_frames(self, incident, ring, frames):
+        os.makedirs(incident.directory, exist_ok=True)
+        for seq, timestamp, path in frames:
+            target = os.path.join(incident.directory, f'{seq:08d}_{int(timestamp)}.jpg')
+            if os.path.exists(target):
+                continue
+            try:
+                if not ring.keep(seq, target):
+                    # Overwritten by a frame taken after the incident window was listed
+                    continue
+            except OSError as e:
+                log.error("Error keeping frame %s for incident: %s", path, e)
+                continue
+            with self._lock:
+                self.promoted += 1
+
+    def _incident_dirs(self):
+        """(path, size, mtime) of every incident folder, oldest first"""
+        incidents = []
+        if not os.path.isdir(self.incidents_dir):
+            return incidents
+        for instance_slug in os.listdir(self.incidents_dir):
+            instance_dir = os.path.join(self.incidents_dir, instance_slug)
+            if not os.path.isdir(instance_dir):
+                continue
+            for name in os.listdir(instance_dir):
+                directory = os.path.join(instance_dir, name)
+                try:
+                    files = [os.stat(os.path.join(directory, f)) for f in os.listdir(directory)]
+                    mtime = max((st.st_mtime for st in files), default=os.stat(directory).st_mtime)
+                except OSError:
+                    continue
+                incidents.append((directory, sum(st.st_size for st in files), mtime))
+        incidents.sort(key=lambda item: item[2])
+        return incidents
+
+    def _enforce_caps(self):
+        incidents = self._incident_dirs()
+        with self._lock:
+            open_dirs = {incident.directory for incident in self._open.values() if incident.until >= time.time()}
+        total = sum(size for _, size, _ in incidents)
+        cutoff = time.time() - self.retention_days * 86400 if self.retention_days else None
+        for directory, size, mtime in incidents:
+            if directory in open_dirs:
+                continue
+            expired = cutoff is not None and mtime < cutoff
+            if not expired and total <= self.max_bytes:
+                continue
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+            with self._lock:
+                self.removed_incidents += 1
+            log.info("Removed incident %s", directory)
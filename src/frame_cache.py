@@ -0,0 +1,87 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+FRAME_CACHE_MB = int(os.getenv('FRAME_CACHE_MB', '64'))
+# Requested thumbnail widths are rounded up to one of these so each frame has few variants
+THUMBNAIL_WIDTHS = (160, 320, 480, 640, 960, 1280)
+
+
+def thumbnail_width(requested):
+    """The cached width to use for a requested width, or None for the full frame."""
+    if not requested or requested <= 0:
+        return None
+    for width in THUMBNAIL_WIDTHS:
+        if requested <= width:
+            return width
+    return None
+
+
+class FrameCache:
+    """
+    LRU cache of encoded frames and their thumbnails, bounded by total size.
+
+    Entries are keyed by filename, content hash and width, so a new frame under the
+    same filename never serves stale bytes, and each thumbnail size is generated once
+    per frame version.
+    """
+
+    def __init__(self, max_bytes=FRAME_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def frame(self, entry, width=None):
+        """
+        (JPEG bytes, content hash) for a catalog entry, scaled to `width` if given. The
+        hash is that of the full frame the bytes came from: when a newer frame replaced
+        the entry's since it was looked up, it differs from entry.content_hash, and the
+        bytes are cached under the newer frame's hash.
+        """
+        key = (entry.filename, entry.content_hash, width or 0)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data, entry.content_hash
+            self.misses += 1
+
+        if width:
+            data, content_hash = self.frame(entry)
+            data = self._thumbnail(data, width)
+        else:
+            data = entry.read()
+            content_hash = hashlib.md5(data).hexdigest()
+        self._put((entry.filename, content_hash, width or 0), data)
+        return data, content_hash
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._size, 'hits': self.hits, 'misses': self.misses}
+
+    def _put(self, key, data):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    @staticmethod
+    def _thumbnail(data, width):
+        import cv2
+        import numpy as np
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None or frame.shape[1] <= width:
+            return data
+        height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+        small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        return buffer.tobytes() if ok else data
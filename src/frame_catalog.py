@@ -0,0 +1,125 @@
+import hashlib
+import os
+import threading
+from datetime import datetime
+
+
+def source_name(filename):
+    """Display name and instance type from a frame filename, e.g. youtube_sprayvalley.jpg -> Sprayvalley"""
+    base = filename[:-len('.jpg')] if filename.endswith('.jpg') else filename
+    instance_type = 'unknown'
+    for prefix in ('youtube', 'camera'):
+        if base.startswith(f'{prefix}_'):
+            base = base[len(prefix) + 1:]
+            instance_type = prefix
+            break
+    return base, base.replace('_', ' ').title(), instance_type
+
+
+class FrameEntry:
+    def __init__(self, filename, instance, instance_type, path, mtime, size, content_hash, version, reader=None):
+        self.filename = filename
+        self.instance = instance
+        self.instance_type = instance_type
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.content_hash = content_hash
+        self.version = version
+        # Returns the frame's bytes when they are held in memory rather than on disk
+        self.reader = reader
+
+    def read(self):
+        if self.reader is None:
+            with open(self.path, 'rb') as f:
+                return f.read()
+        data = self.reader()
+        if data is None:
+            raise OSError(f"Frame {self.filename} is no longer available")
+        return data
+
+    def to_dict(self):
+        _, source, _ = source_name(self.filename)
+        return {
+            'url': f'/frames/{self.filename}',
+            'source': source,
+            'type': self.instance_type,
+            # Show file modified time in UI
+            'timestamp': datetime.fromtimestamp(self.mtime).strftime('%Y-%m-%d %H:%M:%S'),
+            # Machine-friendly version for change detection
+            'modified_at': self.mtime,
+            # Exact instance name used by detections payload (if mapped)
+            'instance': self.instance,
+            'size': self.size,
+            'hash': self.content_hash,
+            'version': self.version,
+        }
+
+
+class FrameCatalog:
+    """
+    In-memory index of the frames in ./frames, kept up to date by the capture code.
+
+    Every change bumps a catalog-wide version. Each entry remembers the version at which
+    it last changed, and removals are remembered too, so clients can ask for just what
+    changed since a version they already have.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._removed = {}
+        self._version = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def __len__(self):
+        return len(self._entries)
+
+    def register(self, instance, instance_type, path, mtime, size, content_hash, reader=None):
+        """Add or update a frame. `reader()`, if given, returns its bytes instead of reading `path`."""
+        filename = os.path.basename(path)
+        with self._lock:
+            self._version += 1
+            self._entries[filename] = FrameEntry(filename, instance, instance_type, path, mtime, size, content_hash,
+                                                 self._version, reader)
+            self._removed.pop(filename, None)
+
+    def remove(self, path):
+        filename = os.path.basename(path)
+        with self._lock:
+            if self._entries.pop(filename, None) is not None:
+                self._version += 1
+                self._removed[filename] = self._version
+
+    def get(self, filename):
+        with self._lock:
+            return self._entries.get(filename)
+
+    def changes(self, since=None):
+        """Entries changed after version `since` (all of them if None) and filenames removed since then."""
+        with self._lock:
+            if since is None:
+                return [e.to_dict() for e in self._entries.values()], [], self._version
+            images = [e.to_dict() for e in self._entries.values() if e.version > since]
+            removed = [f'/frames/{name}' for name, version in self._removed.items() if version > since]
+            return images, removed, self._version
+
+    def scan(self, directory, resolve_instance):
+        """Seed the catalog from frames already on disk. `resolve_instance(base)` maps a filename to an instance name."""
+        if not os.path.exists(directory):
+            return
+        for filename in os.listdir(directory):
+            if not filename.endswith('.jpg'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            base, _, instance_type = source_name(filename)
+            self.register(resolve_instance(base), instance_type, path, mtime, len(data), hashlib.md5(data).hexdigest())
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from src.log import get_logger
+from src.metrics import metrics
+
+log = get_logger('writer')
+
+
+class FrameWriter:
+    """
+    Writes encoded frames to disk on a background thread.
+
+    Each file is written to a temporary name next to its destination and renamed over
+    it, so readers never see a half-written JPEG. If a newer frame for the same path is
+    queued before the previous one was written, only the newest one hits the disk.
+    """
+
+    def __init__(self):
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self.written = 0
+        self.replaced = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name='frame-writer')
+        self._thread.start()
+
+    def write(self, path, data, on_written=None):
+        """Queue `data` to be written to `path`. `on_written(path, data)` is called once it's on disk."""
+        with self._cond:
+            if path in self._pending:
+                self.replaced += 1
+                del self._pending[path]
+            self._pending[path] = (data, on_written)
+            self._cond.notify()
+
+    def cancel(self, path):
+        """Drop a queued write, e.g. because the file is about to be removed."""
+        with self._cond:
+            self._pending.pop(path, None)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._pending),
+                'written': self.written,
+                'replaced': self.replaced,
+                'errors': self.errors,
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                path, (data, on_written) = self._pending.popitem(last=False)
+            tmp_path = f"{path}.tmp"
+            started = time.perf_counter()
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                metrics.observe(None, 'disk_write', time.perf_counter() - started)
+            except OSError as e:
+                log.error("Error writing %s: %s", path, e)
+                with self._cond:
+                    self.errors += 1
+                continue
+            with self._cond:
+                self.written += 1
+            if on_written is not None:
+                try:
+                    on_written(path, data)
+                except Exception as e:
+                    log.error("Error in callback for %s: %s", path, e)
+
+
+frame_writer = FrameWriter()
@@ -7,6 +7,8 @@ export function useSocket() {
     network_sent: 0,
     network_recv: 0,
   })
+  // Instances being brought back after a server restart
+  const [restoreProgress, setRestoreProgress] = useState(null)
   const socketRef = useRef(null)
 
   useEffect(() => {
@@ -30,6 +32,14 @@ export function useSocket() {
       socketRef.current.on('system_stats', (stats) => {
         setSystemStats(stats)
       })
+
+      socketRef.current.on('restore_progress', (progress) => {
+        setRestoreProgress(progress)
+      })
+
+      socketRef.current.on('restore_complete', (progress) => {
+        setRestoreProgress(progress)
+      })
     }
 
     return () => {
@@ -41,5 +51,5 @@ export function useSocket() {
     }
   }, [])
 
-  return { socket: socketRef.current, systemStats }
+  return { socket: socketRef.current, systemStats, restoreProgress }
 }
@@ -0,0 +1,94 @@
+import os
+import threading
+import types
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPDigestAuth
+from urllib3.util.retry import Retry
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', '0.5'))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '32'))
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+class CachedDigestAuth(HTTPDigestAuth):
+    """
+    HTTPDigestAuth that keeps the server nonce across threads.
+
+    requests stores digest state per thread, so when scheduler workers take turns
+    capturing the same camera each of them starts with a 401 challenge. Sharing the
+    state lets every request after the first authenticate preemptively. One instance
+    never has two captures in flight, so the state is never used concurrently.
+    """
+
+    def __init__(self, username, password):
+        super().__init__(username, password)
+        self._thread_local = types.SimpleNamespace()
+
+
+def endpoint_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.hostname}:{parts.port or (443 if parts.scheme == 'https' else 80)}"
+
+
+def get_session(url):
+    """Return the shared keep-alive session for the endpoint serving `url`."""
+    key = endpoint_key(url)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=HTTP_BACKOFF,
+                status_forcelist=(502, 503, 504),
+                # Connection failures are retried for every method; status and read errors only for GET
+                allowed_methods=frozenset({'GET', 'HEAD'}),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+    return session
+
+
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_session(url).get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_session(url).post(url, **kwargs)
+
+
+def connection_stats():
+    """Requests sent per endpoint and how many of them reused a pooled connection."""
+    stats = {}
+    with _lock:
+        sessions = list(_sessions.items())
+    for key, session in sessions:
+        requests_sent = 0
+        new_connections = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is None:
+                    continue
+                requests_sent += pool.num_requests
+                new_connections += pool.num_connections
+        stats[key] = {
+            'requests': requests_sent,
+            'new_connections': new_connections,
+            'reused_connections': max(0, requests_sent - new_connections),
+        }
+    return stats
@@ -1,24 +1,29 @@
-import yt_dlp
-import cv2
 import time
-import numpy as np
-from datetime import datetime
 import os
-import requests
-from requests.auth import HTTPDigestAuth
-
-ydl_opts = {
-            'format': 'bestvideo[ext=mp4]/bestvideo/best',
-            'quiet': True,
-}
+import hashlib
+from src import http_pool
+from src.stream_reader import LatestFrameReader
+from src.stream_resolver import stream_resolver
+from src.change_detector import ChangeDetector
+from src.frame_writer import frame_writer
+from src.preprocess import Preprocessor
+from src.batch_dispatcher import batch_dispatcher
+from src.detector_gate import detector_gate
+from src.metrics import metrics
+from src.log import instance_logger
 
 if not os.path.exists("./frames"):
     os.makedirs("./frames")
 
 num_camera_instances = 0
 
+# Seconds to wait before retrying a failed capture cycle
+RETRY_DELAY = 5
+# Consecutive failed reads before a YouTube stream is re-resolved and reopened
+REOPEN_AFTER_FAILURES = 3
+
 class Instance:
-    def __init__(self, id, name, frequency, lookout_endpoint, latitude, longitude):
+    def __init__(self, id, name, frequency, lookout_endpoint, latitude, longitude, change_threshold=0.0, max_skip_seconds=300, preprocess=None):
         self.id = id
         self.name = name
         self.frequency = frequency
@@ -26,180 +31,406 @@ class Instance:
         self.latitude = latitude
         self.longitude = longitude
         self.run = True
+        self.log = instance_logger(name)
         self.instance_type = ""
         self.latest_frame = None
         self.latest_detections = None
+        self.change_detector = ChangeDetector(change_threshold, max_skip_seconds)
+        # Resize/quality/ROI applied to the image uploaded to the detector
+        self.preprocessor = Preprocessor(**(preprocess or {}))
+        # Called as listener(instance, event, payload) for 'frame_updated' and 'detections_updated'
+        self.listeners = []
+        self.frame_version = 0
+        self.detections_version = 0
+        # FrameRing that keeps recent frames for incident review, if archiving is on
+        self.archive_ring = None
+        # Set in shard worker processes: called as frame_sink(instance, image_bytes) instead of
+        # writing the frame to ./frames, to hand it to the web process
+        self.frame_sink = None
+        # AdaptiveInterval that moves the capture interval with what the instance sees, if enabled
+        self.sampling = None
+
+    def setup(self):
+        """Prepare anything capture() needs. Returns False if the instance cannot run."""
+        return True
+
+    def capture(self):
+        """Run a single capture cycle. Returns False if it failed and should be retried after RETRY_DELAY."""
+        raise NotImplementedError("Subclasses must implement capture()")
+
+    def teardown(self):
+        """Release anything acquired in setup()."""
+        pass
+
+    def run_cycle(self):
+        """Run capture() and record how long the cycle took and whether it succeeded."""
+        started = time.monotonic()
+        ok = False
+        try:
+            ok = self.capture()
+            return ok
+        finally:
+            metrics.record_cycle(self.name, self.frequency, ok, started, time.monotonic() - started)
+
+    def interval(self):
+        """Seconds from one capture to the next: the adaptive interval if enabled, else frequency"""
+        if self.sampling is not None:
+            return self.sampling.current()[0]
+        return self.frequency
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def notify(self, event, payload):
+        for listener in self.listeners:
+            try:
+                listener(self, event, payload)
+            except Exception as e:
+                self.log.error("Error notifying listener of %s: %s", event, e)
+
+    def write_frame(self, path, image_bytes):
+        """Queue a frame for the dashboard; listeners hear about it once it is on disk."""
+        if self.frame_sink is not None:
+            self.frame_sink(self, image_bytes)
+            return
+        frame_writer.write(path, image_bytes, on_written=self._frame_written)
+        if self.archive_ring is not None:
+            self.archive_ring.append(image_bytes)
+
+    def _frame_written(self, path, image_bytes):
+        self.frame_version += 1
+        self.notify('frame_updated', {
+            'url': f"/frames/{os.path.basename(path)}",
+            'version': self.frame_version,
+            'modified_at': time.time(),
+            'size': len(image_bytes),
+            'hash': hashlib.md5(image_bytes).hexdigest(),
+        })
+
+    def should_post(self, frame):
+        """Run the frame through change detection. Returns False if the detector post should be skipped."""
+        send = self.change_detector.should_send(frame)
+        difference = self.change_detector.last_difference
+        if self.sampling is not None:
+            self.sampling.scene(difference)
+        if difference == 0:
+            self.log.warning("Same frame detected, stream might be static")
+        if not send:
+            self.log.info("Frame unchanged (difference %.2f), skipping detection", difference)
+        return send
+
+    def stats(self):
+        """Counters describing what this instance has done so far."""
+        stats = {
+            'instance_type': self.instance_type,
+            'frequency': self.frequency,
+            'effective_frequency': self.interval(),
+            'detector_circuit': detector_gate.state(self.lookout_endpoint),
+            **self.change_detector.stats(),
+        }
+        if self.sampling is not None:
+            stats['sampling'] = self.sampling.stats()
+        return stats
+
+    def post_image(self, image_bytes):
+        """Send a JPEG to the lookout endpoint, batched with other instances' frames when batching is on."""
+        if batch_dispatcher.enabled:
+            return batch_dispatcher.submit(self.lookout_endpoint, image_bytes).result()
+        return http_pool.post(self.lookout_endpoint, data=image_bytes, headers={'Content-Type': 'image/jpeg'})
+
+    def detect(self, image_bytes, transform=None):
+        """
+        Hand an encoded JPEG to the detector gate, which posts it to the lookout endpoint
+        off the capture thread. `transform` is what the preprocessor did to the frame, if
+        anything. Always returns True: a frame the gate drops is not a failed capture.
+        """
+        detector_gate.submit(self, image_bytes, transform)
+        return True
+
+    def send_detection(self, image_bytes, transform=None):
+        """Post a frame and record the detections it gets back. Returns the post result, as for record_post()"""
+        try:
+            with metrics.timer(self.name, 'detector_post'):
+                response = self.post_image(image_bytes)
+        except Exception as e:
+            self.record_post('error')
+            self.log.error("Error posting image: %s", e)
+            return 'error'
+        if response.status_code != 200:
+            result = f'http_{response.status_code}'
+            self.record_post(result)
+            self.log.warning("Failed to post image, status code %s", response.status_code)
+            return result
+        self.record_post('ok')
+        self.log.info("Image posted successfully")
+        # Parse detection results
+        try:
+            with metrics.timer(self.name, 'parse'):
+                detection_data = response.json()
+            self.record_detections(detection_data, transform)
+        except Exception as parse_error:
+            self.log.error("Error parsing detection results: %s", parse_error)
+        return 'ok'
+
+    def record_post(self, result):
+        """Count a detector post by result: 'ok', 'error' or 'http_<status>'"""
+        metrics.count(self.name, 'detector_posts', result)
+        if self.sampling is not None:
+            self.sampling.detector_result(result == 'ok')
+
+    def record_drop(self, reason):
+        """Count a frame that was not posted: 'replaced' by a newer one, 'stale' or 'circuit_open'"""
+        metrics.count(self.name, 'detector_drops', reason)
+        self.log.debug("Frame not sent to detector (%s)", reason)
+        if self.sampling is not None:
+            # The detector is behind or down, so capturing less often is no loss
+            self.sampling.detector_result(False)
+
+    def record_detections(self, detection_data, transform=None):
+        """Store the parsed response from the lookout endpoint, in original frame coordinates."""
+        detection_data = self.preprocessor.map_detections(detection_data, transform)
+        self.latest_detections = detection_data
+        self.detections_version += 1
+        if self.sampling is not None:
+            self.sampling.detections(detection_data)
+        results = detection_data.get('results', []) if isinstance(detection_data, dict) else []
+        self.log.info("Received %d detection results", len(results or []))
+        self.log.debug("Detection results: %s", detection_data)
+        self.notify('detections_updated', {
+            'detections': detection_data,
+            'version': self.detections_version,
+        })
 
-    
     def start(self):
-        raise NotImplementedError("Subclasses must implement start()")
+        """Run capture cycles on the calling thread until stop() is called."""
+        if not self.setup():
+            return
+        try:
+            while self.run:
+                start_time = time.time()
+                delay = self.interval() if self.run_cycle() else RETRY_DELAY
+                time.sleep(max(0, delay - (time.time() - start_time)))
+        except KeyboardInterrupt:
+            self.log.info("Stopping frame capture...")
+        finally:
+            self.teardown()
     
     def stop(self):
         self.run = False
-        print(f"[INSTANCE {self.id}] Stopping instance...")
+        self.log.info("Stopping instance...")
 
 class YoutubeInstance(Instance):
-    def __init__(self, id:int, name:str, youtube_url:str, lookout_endpoint:str, frequency:int=60, latitude:float=0.0, longitude:float=0.0):
-        super().__init__(id, name, frequency, lookout_endpoint, latitude, longitude)
+    def __init__(self, id:int, name:str, youtube_url:str, lookout_endpoint:str, frequency:int=60, latitude:float=0.0, longitude:float=0.0, reader_mode:str="drain", change_threshold:float=0.0, max_skip_seconds:int=300, preprocess:dict=None):
+        super().__init__(id, name, frequency, lookout_endpoint, latitude, longitude, change_threshold, max_skip_seconds, preprocess)
         self.youtube_url = youtube_url
-        self.ydl = yt_dlp.YoutubeDL(ydl_opts)
+        # "drain" keeps the stream drained on a background thread, "direct" reads from the capture on demand
+        self.reader_mode = reader_mode
+        self.cap = None
+        self.reader = None
+        self.stream = None
+        self.read_failures = 0
+        self.reopens = 0
         self.instance_type = "youtube"
         self.image_file = f"./frames/youtube_{self.name.lower().replace(' ', '')}.jpg"
-        print(f"[INSTANCE {self.id}] Initialized with YouTube URL: {self.youtube_url}, Lookout Endpoint URL: {self.lookout_endpoint}, Frequency: {self.frequency} seconds")
+        self.log.info("Initialized with YouTube URL: %s, Lookout Endpoint URL: %s, Frequency: %s seconds", self.youtube_url, self.lookout_endpoint, self.frequency)
 
-    def start(self):
-        t = 0
-        info = self.ydl.extract_info(self.youtube_url, download=False)
-        if info is None:
-            print(f"[INSTANCE {self.id}] Error: Could not extract video info")
-            return
-        stream_url = info['url']
+    def setup(self):
+        return self.open_stream()
+
+    def open_stream(self, force_resolve=False):
+        import cv2
+        with metrics.timer(self.name, 'resolve'):
+            self.stream = stream_resolver.resolve(self.youtube_url, force=force_resolve)
+        if self.stream is None:
+            self.log.error("Could not extract video info")
+            return False
         
-        cap = cv2.VideoCapture(stream_url)
+        with metrics.timer(self.name, 'open'):
+            self.cap = cv2.VideoCapture(self.stream.url)
         
-        if not cap.isOpened():
-            print(f"[INSTANCE {self.id}] Error: Could not open video stream.")
-            return
+        if not self.cap.isOpened():
+            self.log.error("Could not open video stream.")
+            self.close_stream()
+            return False
+
+        if self.reader_mode == "drain":
+            self.reader = LatestFrameReader(self.cap, self.name)
+            self.reader.start()
+        self.read_failures = 0
+        return True
+
+    def close_stream(self):
+        if self.reader is not None:
+            # The reader releases the capture once its drain thread is out of grab()
+            self.reader.close()
+            self.reader = None
+        elif self.cap is not None:
+            self.cap.release()
+        self.cap = None
+
+    def reopen_stream(self, force_resolve=False):
+        self.reopens += 1
+        self.close_stream()
+        return self.open_stream(force_resolve=force_resolve)
+
+    def stats(self):
+        stats = super().stats()
+        stats['reopens'] = self.reopens
+        if self.reader is not None:
+            stats['frames_grabbed'] = self.reader.frames_grabbed
+            stats['frames_read'] = self.reader.frames_read
+        return stats
+
+    def read_frame(self):
+        if self.reader is not None:
+            ret, frame, fresh = self.reader.read()
+            if ret and not fresh:
+                self.log.warning("No new frame since last sample, stream might be stalled")
+            return ret, frame
+        return self.cap.read()
+
+    def capture(self):
+        import cv2
+        if self.cap is None or stream_resolver.needs_refresh(self.stream):
+            # Swap to a freshly resolved URL before the current one expires; instances
+            # watching the same video pick up whichever of them refreshed it first
+            self.log.info("Refreshing stream URL")
+            if not self.reopen_stream():
+                return False
+
+        with metrics.timer(self.name, 'read'):
+            ret, frame = self.read_frame()
         
-        try:
-            while self.run:
-                try:
-                    time.sleep(self.frequency - (time.time() - t))
-                except ValueError:
-                    pass
-                t = time.time()
-                ret, frame = cap.read()
-                
-                if not ret:
-                    print(f"[INSTANCE {self.id}] Error: Could not read frame.")
-                    time.sleep(5)
-                    continue
-
-                self.latest_frame = frame.copy()
-                
-                # Save frame to single image file
-                cv2.imwrite(self.image_file, frame)
-                print(f"[INSTANCE {self.id}] Image captured and saved to {self.image_file} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                
-                # Add some debugging to check if frames are actually different
-                if hasattr(self, 'last_frame_hash'):
-                    import hashlib
-                    current_hash = hashlib.md5(frame.tobytes()).hexdigest()
-                    if current_hash == self.last_frame_hash:
-                        print(f"[INSTANCE {self.id}] WARNING: Same frame detected, stream might be static")
-                    else:
-                        print(f"[INSTANCE {self.id}] New frame detected")
-                    self.last_frame_hash = current_hash
-                else:
-                    import hashlib
-                    self.last_frame_hash = hashlib.md5(frame.tobytes()).hexdigest()
-                
-                _, buffer = cv2.imencode('.jpg', frame)
-                headers = {'Content-Type': 'image/jpeg'}
-                try:
-                    response = requests.post(self.lookout_endpoint, data=buffer.tobytes(), headers=headers)
-                    if response.status_code != 200:
-                        print(f"[INSTANCE {self.id}] Warning: Failed to post frame, status code {response.status_code}")
-                    else:
-                        print(f"[INSTANCE {self.id}] Frame posted successfully at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                        # Parse detection results
-                        try:
-                            detection_data = response.json()
-                            self.latest_detections = detection_data
-                            print(f"[INSTANCE {self.id}] Detection results: {detection_data}")
-                        except Exception as parse_error:
-                            print(f"[INSTANCE {self.id}] Error parsing detection results: {parse_error}")
-                except Exception as e:
-                    print(f"[INSTANCE {self.id}] Error posting frame: {e}")
-                
+        if not ret:
+            self.read_failures += 1
+            self.log.error("Could not read frame.")
+            if self.read_failures >= REOPEN_AFTER_FAILURES or (self.reader is not None and self.reader.failed):
+                self.log.warning("Reopening video stream after %d failed reads", self.read_failures)
+                self.reopen_stream(force_resolve=True)
+            return False
+        self.read_failures = 0
 
-        except KeyboardInterrupt:
-            print(f"[INSTANCE {self.id}] Stopping frame capture...")
-        finally:
-            cap.release()
+        # read() hands back a new array every time, so there is nothing to copy
+        self.latest_frame = frame
+        
+        # Encode once; the same bytes go to the dashboard file and the detector
+        with metrics.timer(self.name, 'encode'):
+            ok, buffer = cv2.imencode('.jpg', frame)
+        if not ok:
+            self.log.error("Could not encode frame.")
+            return False
+        image_bytes = buffer.tobytes()
+        self.write_frame(self.image_file, image_bytes)
+        self.log.info("Image captured and saved to %s", self.image_file)
+        
+        if not self.should_post(frame):
+            return True
+        
+        transform = None
+        if self.preprocessor.enabled:
+            with metrics.timer(self.name, 'preprocess'):
+                image_bytes, transform = self.preprocessor.prepare(frame)
+            if image_bytes is None:
+                self.log.error("Could not prepare frame for detection.")
+                return False
+        self.detect(image_bytes, transform)
+        return True
+
+    def teardown(self):
+        self.close_stream()
     
     def stop(self):
         self.run = False
-        print(f"[INSTANCE {self.id}] Stopping instance...")
+        self.log.info("Stopping instance...")
 
 class CameraInstance(Instance):
-    def __init__(self, id:int, name:str, camera_url:str, lookout_endpoint:str, camera_username:str, camera_password:str, folder_path:str, frequency:int=60, latitude:float=0.0, longitude:float=0.0):
-        super().__init__(id, name, frequency, lookout_endpoint, latitude, longitude)
+    def __init__(self, id:int, name:str, camera_url:str, lookout_endpoint:str, camera_username:str, camera_password:str, folder_path:str, frequency:int=60, latitude:float=0.0, longitude:float=0.0, change_threshold:float=0.0, max_skip_seconds:int=300, save_archive:bool=True, preprocess:dict=None):
+        super().__init__(id, name, frequency, lookout_endpoint, latitude, longitude, change_threshold, max_skip_seconds, preprocess)
         self.camera_url = camera_url
         self.camera_username = camera_username
         self.camera_password = camera_password
+        # Reused across captures so the digest nonce survives between requests
+        self.auth = http_pool.CachedDigestAuth(camera_username, camera_password)
         self.folder_path = folder_path
         self.instance_type = "camera"
         self.image_file = f"./frames/camera_{self.name.lower().replace(' ', '')}.jpg"
         global num_camera_instances
         num_camera_instances += 1
         self.num = num_camera_instances
-        print(f"[INSTANCE {self.id}] Initialized with Camera URL: {self.camera_url}, Folder Path: {self.folder_path}, Frequency: {self.frequency} seconds")
+        self.image_path = os.path.join(self.folder_path, f"capture{self.num}.jpg")
+        # Whether to keep a copy of each capture in folder_path as well as in ./frames
+        self.save_archive = save_archive
+        if self.save_archive:
+            os.makedirs(self.folder_path, exist_ok=True)
+        self.log.info("Initialized with Camera URL: %s, Folder Path: %s, Frequency: %s seconds", self.camera_url, self.folder_path, self.frequency)
 
-    def start(self):
-        t = 0
-        
-        try:
-            while self.run:
-                start_time = time.time()
-                image_path = os.path.join(self.folder_path, f"capture{self.num}.jpg")
-                
-                # step 1: capture image
-                try: 
-                    response = requests.get(self.camera_url, auth=HTTPDigestAuth(self.camera_username, self.camera_password), stream=True)
-                    if response.status_code != 200:
-                        print(f"[INSTANCE {self.id}] Error: Could not capture image, status code {response.status_code}")
-                        time.sleep(5)
-                        continue
-                    else:
-                        arr = np.frombuffer(response.content, dtype=np.uint8)
-                        frame = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-                        if frame is None:
-                            print(f"[INSTANCE {self.id}] Error: Could not decode image.")
-                            time.sleep(5)
-                            continue
-                        cv2.imwrite(image_path, frame)
-                        print(f"[INSTANCE {self.id}] Image captured and saved to {image_path}")
-
-                        # Save to image file for full view dashboard
-                        cv2.imwrite(self.image_file, frame)
-                        print(f"[INSTANCE {self.id}] Image captured and saved to {self.image_file}")
-                except Exception as e:
-                    print(f"[INSTANCE {self.id}] Error capturing image: {e}")
-                    time.sleep(5)
-                    continue
-                    
-                # step 2: post image to API
-                try:
-                    with open(image_path, 'rb') as f:
-                        response = requests.post(self.lookout_endpoint, data=f.read(), headers={'Content-Type': 'image/jpeg'})
-                        if response.status_code != 200:
-                            print(f"[INSTANCE {self.id}] Error: Failed to post image, status code {response.status_code}")
-                        else:
-                            print(f"[INSTANCE {self.id}] Image posted successfully at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                            # Parse detection results
-                            try:
-                                detection_data = response.json()
-                                self.latest_detections = detection_data
-                                print(f"[INSTANCE {self.id}] Detection results: {detection_data}")
-                            except Exception as parse_error:
-                                print(f"[INSTANCE {self.id}] Error parsing detection results: {parse_error}")
-                except Exception as e:
-                    print(f"[INSTANCE {self.id}] Error posting image: {e}")
-                    time.sleep(5)
-                    continue
-                
-                # step 3: sleep for the rest of the frequency
-                elapsed_time = time.time() - start_time
-                time.sleep(max(0, self.frequency - elapsed_time))
+    def save_image(self, content):
+        """
+        Check a snapshot from the camera and queue it to be written. The camera's JPEG
+        bytes are stored and posted as they are; the frame is only decoded at reduced
+        size, which is enough to validate it and to feed change detection.
+        Returns the reduced grayscale frame, or None if it can't be decoded.
+        """
+        import cv2
+        import numpy as np
+        with metrics.timer(self.name, 'decode'):
+            frame = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if frame is None:
+            self.log.error("Could not decode image.")
+            return None
+        if self.save_archive:
+            frame_writer.write(self.image_path, content)
+            self.log.debug("Image saved to %s", self.image_path)
 
-        except KeyboardInterrupt:
-            print(f"[INSTANCE {self.id}] Stopping folder monitoring...")
-                
+        # Save to image file for full view dashboard
+        self.write_frame(self.image_file, content)
+        self.log.info("Image captured and saved to %s", self.image_file)
+        return frame
+
+    def prepare_upload(self, content):
+        """Return (image_bytes, transform) to post for a snapshot. Without preprocessing this is the snapshot itself."""
+        if not self.preprocessor.enabled:
+            return content, None
+        import cv2
+        import numpy as np
+        with metrics.timer(self.name, 'preprocess'):
+            frame = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                self.log.error("Could not decode image.")
+                return None, None
+            image_bytes, transform = self.preprocessor.prepare(frame)
+        if image_bytes is None:
+            self.log.error("Could not prepare image for detection.")
+        return image_bytes, transform
+
+    def capture(self):
+        # step 1: capture image
+        try: 
+            with metrics.timer(self.name, 'read'):
+                response = http_pool.get(self.camera_url, auth=self.auth, stream=True)
+                if response.status_code != 200:
+                    self.log.error("Could not capture image, status code %s", response.status_code)
+                    return False
+                content = response.content
+            frame = self.save_image(content)
+            if frame is None:
+                return False
+        except Exception as e:
+            self.log.error("Error capturing image: %s", e)
+            return False
+
+        if not self.should_post(frame):
+            return True
+            
+        # step 2: post image to API
+        image_bytes, transform = self.prepare_upload(content)
+        if image_bytes is None:
+            return False
+        return self.detect(image_bytes, transform)
     
     def stop(self):
         self.run = False
-        print(f"[INSTANCE {self.id}] Stopping instance...")
+        self.log.info("Stopping instance...")
 
 if __name__ == "__main__":
     camera_url = "http://demo.customer.roboticscats.com:55758/axis-cgi/jpg/image.cgi?resolution=1920x1080"
@@ -0,0 +1,181 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# 'json' writes one JSON object per line, 'text' a plain line per record
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# Per-instance overrides of LOG_LEVEL, e.g. "sprayvalley=DEBUG,bigtree=WARNING". Names match
+# like frame filenames do, ignoring case and spaces ("sprayvalley" is "Spray Valley")
+LOG_INSTANCE_LEVELS = os.getenv('LOG_INSTANCE_LEVELS', '')
+# Each distinct message (per logger and instance) is logged at most LOG_SAMPLE_BURST
+# times per LOG_SAMPLE_WINDOW seconds; 0 turns sampling off
+LOG_SAMPLE_WINDOW = float(os.getenv('LOG_SAMPLE_WINDOW', '60'))
+LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', '5'))
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_setup_lock = threading.Lock()
+_listener = None
+
+
+def normalize_name(name):
+    return name.lower().replace(' ', '') if isinstance(name, str) else name
+
+
+def parse_level(value):
+    """Numeric level for a name like 'debug' or a number like '10', or None if it isn't one"""
+    value = str(value).strip().upper()
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value)
+    return level if isinstance(level, int) else None
+
+
+def parse_levels(spec):
+    """({normalized instance name: level}, [entries that could not be parsed])"""
+    levels = {}
+    invalid = []
+    for item in spec.split(','):
+        name, _, level = item.partition('=')
+        if not item.strip():
+            continue
+        parsed = parse_level(level)
+        if not name.strip() or parsed is None:
+            invalid.append(item.strip())
+            continue
+        levels[normalize_name(name.strip())] = parsed
+    return levels, invalid
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s [%(name)s] %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        extra = {k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS}
+        if extra:
+            line += ' ' + ' '.join(f'{k}={v}' for k, v in extra.items())
+        return line
+
+
+class LevelFilter(logging.Filter):
+    """Drops records below the level set for their instance, or below the default level"""
+
+    def __init__(self, default_level, instance_levels=None):
+        super().__init__()
+        self.default_level = default_level
+        self.instance_levels = instance_levels or {}
+
+    def filter(self, record):
+        level = self.instance_levels.get(normalize_name(getattr(record, 'instance', None)), self.default_level)
+        return record.levelno >= level
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through at most `burst` records per `window` seconds for each message template
+    (the format string before arguments are filled in), logger and instance. The next
+    record let through after a quiet period says how many were dropped. Warnings and
+    errors are sampled like everything else, since a failing camera repeats its error
+    every cycle.
+    """
+
+    def __init__(self, window=LOG_SAMPLE_WINDOW, burst=LOG_SAMPLE_BURST, max_keys=10000):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._seen = {}  # key -> [window start, records in window, records dropped]
+
+    def filter(self, record):
+        if not self.window or not self.burst:
+            return True
+        key = (record.name, record.msg, getattr(record, 'instance', None))
+        now = time.monotonic()
+        with self._lock:
+            state = self._seen.get(key)
+            if state is None or now - state[0] >= self.window:
+                dropped = state[2] if state is not None else 0
+                if len(self._seen) >= self.max_keys:
+                    self._seen.clear()
+                self._seen[key] = [now, 1, 0]
+                if dropped:
+                    record.suppressed = dropped
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, instance_levels=LOG_INSTANCE_LEVELS):
+    """
+    Route the app's loggers through a queue to a single writer thread, so logging never
+    blocks capture threads on stdout. Safe to call more than once.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        default_level = parse_level(level)
+        invalid = [] if default_level is not None else [f'LOG_LEVEL={level}']
+        if default_level is None:
+            default_level = logging.INFO
+        levels, invalid_instances = parse_levels(instance_levels)
+        invalid += invalid_instances
+        queue_handler.addFilter(LevelFilter(default_level, levels))
+        queue_handler.addFilter(SamplingFilter())
+
+        root = logging.getLogger('lookout')
+        # Records below every configured level are not even created
+        root.setLevel(min([default_level, *levels.values()]))
+        root.addHandler(queue_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, handler)
+        _listener.start()
+        atexit.register(_listener.stop)
+        for item in invalid:
+            logging.getLogger('lookout.system').warning("Ignoring invalid log level setting '%s'", item)
+
+
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(f'lookout.{name}')
+
+
+def instance_logger(instance_name):
+    """A logger whose records carry the instance name, for filtering and sampling by instance"""
+    return logging.LoggerAdapter(get_logger('instance'), {'instance': instance_name})
@@ -0,0 +1,246 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the stage timing histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Weight of the newest interval in the achieved capture interval average
+INTERVAL_SMOOTHING = 0.2
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    parts = [f'{key}="{_label_value(value)}"' for key, value in labels.items() if value is not None]
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def merge(self, counts, total, count, maximum):
+        for i, n in enumerate(counts):
+            self.counts[i] += n
+        self.sum += total
+        self.count += count
+        self.max = max(self.max, maximum)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (max if it is past the last bucket)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'avg': round(self.sum / self.count, 4) if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': round(self.max, 4),
+        }
+
+
+class CycleStats:
+    def __init__(self):
+        self.configured_interval = None
+        self.achieved_interval = None
+        self.last_started = None
+
+
+class MetricsRegistry:
+    """
+    Stage timings and event counters for the capture pipeline, per instance.
+
+    Stages (resolve, read, decode, encode, disk_write, detector_post, parse, alert_send,
+    cycle, ...) are timed into histograms; events (captures, detector posts, alerts) are
+    counted by result. Each capture cycle also updates the instance's achieved interval
+    between cycles, to compare with the configured frequency. Metrics not tied to an
+    instance are recorded with instance None. Metrics exported by other processes (shard
+    workers) can be absorbed and are reported together with the local ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (instance, stage) -> Histogram
+        self._counters = {}  # (instance, event, result) -> count
+        self._cycles = {}  # instance -> CycleStats
+        self._remote = {}  # source -> latest export() from another process
+
+    def observe(self, instance, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get((instance, stage))
+            if histogram is None:
+                histogram = self._histograms[(instance, stage)] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, instance, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(instance, stage, time.perf_counter() - started)
+
+    def count(self, instance, event, result='ok', n=1):
+        with self._lock:
+            key = (instance, event, result)
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def record_cycle(self, instance, configured_interval, ok, started, duration):
+        """A capture cycle that began at monotonic time `started` and took `duration` seconds"""
+        self.observe(instance, 'cycle', duration)
+        self.count(instance, 'captures', 'ok' if ok else 'failed')
+        with self._lock:
+            cycle = self._cycles.get(instance)
+            if cycle is None:
+                cycle = self._cycles[instance] = CycleStats()
+            cycle.configured_interval = configured_interval
+            if cycle.last_started is not None:
+                interval = started - cycle.last_started
+                if cycle.achieved_interval is None:
+                    cycle.achieved_interval = interval
+                else:
+                    cycle.achieved_interval += INTERVAL_SMOOTHING * (interval - cycle.achieved_interval)
+            cycle.last_started = started
+
+    def remove(self, instance):
+        """Forget an instance's metrics, e.g. when it is deleted"""
+        with self._lock:
+            self._histograms = {k: v for k, v in self._histograms.items() if k[0] != instance}
+            self._counters = {k: v for k, v in self._counters.items() if k[0] != instance}
+            self._cycles.pop(instance, None)
+            for exported in self._remote.values():
+                exported['histograms'] = [h for h in exported['histograms'] if h[0][0] != instance]
+                exported['counters'] = [c for c in exported['counters'] if c[0][0] != instance]
+                exported['cycles'] = [c for c in exported['cycles'] if c[0] != instance]
+
+    def export(self):
+        """Raw state of this registry, for another process to absorb()"""
+        with self._lock:
+            return {
+                'histograms': [(key, list(h.counts), h.sum, h.count, h.max) for key, h in self._histograms.items()],
+                'counters': list(self._counters.items()),
+                'cycles': [(instance, c.configured_interval, c.achieved_interval) for instance, c in self._cycles.items()],
+            }
+
+    def absorb(self, source, exported):
+        """Report metrics exported by another process, replacing what `source` sent before"""
+        with self._lock:
+            self._remote[source] = exported
+
+    def _merged(self):
+        """Local and absorbed histograms, counters and cycle stats. Call with the lock held."""
+        if not self._remote:
+            return self._histograms, self._counters, self._cycles
+        histograms = {}
+        for key, histogram in self._histograms.items():
+            histograms[key] = merged = Histogram(histogram.buckets)
+            merged.merge(histogram.counts, histogram.sum, histogram.count, histogram.max)
+        counters = dict(self._counters)
+        cycles = dict(self._cycles)
+        for exported in self._remote.values():
+            for key, counts, total, count, maximum in exported['histograms']:
+                key = tuple(key)
+                if key not in histograms:
+                    histograms[key] = Histogram()
+                histograms[key].merge(counts, total, count, maximum)
+            for key, value in exported['counters']:
+                key = tuple(key)
+                counters[key] = counters.get(key, 0) + value
+            for instance, configured, achieved in exported['cycles']:
+                cycle = cycles[instance] = CycleStats()
+                cycle.configured_interval = configured
+                cycle.achieved_interval = achieved
+        return histograms, counters, cycles
+
+    def snapshot(self):
+        """Per-instance summary for the dashboard; metrics without an instance are under ''"""
+        snapshot = {}
+        with self._lock:
+            histograms, counters, cycles = self._merged()
+            for (instance, stage), histogram in histograms.items():
+                entry = snapshot.setdefault(instance or '', {'stages': {}, 'counters': {}})
+                entry['stages'][stage] = histogram.summary()
+            for (instance, event, result), value in counters.items():
+                entry = snapshot.setdefault(instance or '', {'stages': {}, 'counters': {}})
+                entry['counters'][f'{event}_{result}'] = value
+            for instance, cycle in cycles.items():
+                entry = snapshot.setdefault(instance or '', {'stages': {}, 'counters': {}})
+                entry['configured_interval'] = cycle.configured_interval
+                entry['achieved_interval'] = round(cycle.achieved_interval, 3) if cycle.achieved_interval is not None else None
+        return snapshot
+
+    def prometheus(self, gauges=None):
+        """
+        Everything in the Prometheus text exposition format. `gauges` adds
+        {name: (help, value)} process-wide gauges.
+        """
+        lines = []
+        with self._lock:
+            histograms, counters, cycles = self._merged()
+            histograms = sorted(histograms.items(), key=lambda item: (item[0][0] or '', item[0][1]))
+            lines.append('# HELP lookout_stage_seconds Time spent in each stage of the capture pipeline')
+            lines.append('# TYPE lookout_stage_seconds histogram')
+            for (instance, stage), histogram in histograms:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'lookout_stage_seconds_bucket{_labels(instance=instance, stage=stage, le=bound)} {cumulative}')
+                lines.append(f'lookout_stage_seconds_bucket{_labels(instance=instance, stage=stage, le="+Inf")} {histogram.count}')
+                lines.append(f'lookout_stage_seconds_sum{_labels(instance=instance, stage=stage)} {histogram.sum}')
+                lines.append(f'lookout_stage_seconds_count{_labels(instance=instance, stage=stage)} {histogram.count}')
+
+            events = {}
+            for (instance, event, result), value in counters.items():
+                events.setdefault(event, []).append((instance, result, value))
+            for event in sorted(events):
+                lines.append(f'# HELP lookout_{event}_total Number of {event.replace("_", " ")} by result')
+                lines.append(f'# TYPE lookout_{event}_total counter')
+                for instance, result, value in sorted(events[event], key=lambda item: (item[0] or '', item[1])):
+                    lines.append(f'lookout_{event}_total{_labels(instance=instance, result=result)} {value}')
+
+            cycles = sorted(cycles.items(), key=lambda item: item[0] or '')
+            lines.append('# HELP lookout_configured_interval_seconds Configured seconds between captures')
+            lines.append('# TYPE lookout_configured_interval_seconds gauge')
+            for instance, cycle in cycles:
+                if cycle.configured_interval is not None:
+                    lines.append(f'lookout_configured_interval_seconds{_labels(instance=instance)} {cycle.configured_interval}')
+            lines.append('# HELP lookout_achieved_interval_seconds Average seconds actually seen between captures')
+            lines.append('# TYPE lookout_achieved_interval_seconds gauge')
+            for instance, cycle in cycles:
+                if cycle.achieved_interval is not None:
+                    lines.append(f'lookout_achieved_interval_seconds{_labels(instance=instance)} {cycle.achieved_interval}')
+
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            lines.append(f'# HELP lookout_{name} {help_text}')
+            lines.append(f'# TYPE lookout_{name} gauge')
+            lines.append(f'lookout_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src import http_pool
+from src.log import get_logger
+
+log = get_logger('notify')
+
+# 'twilio', 'meta' (WhatsApp Cloud API) or 'mock' (records messages, sends nothing)
+NOTIFIER = os.getenv('NOTIFIER', 'twilio')
+# Messages per second sent through the provider; 0 uses the provider's default
+NOTIFIER_RATE = float(os.getenv('NOTIFIER_RATE', '0'))
+NOTIFIER_WORKERS = int(os.getenv('NOTIFIER_WORKERS', '8'))
+
+ALERT_TEMPLATE = '🚨 WILDFIRE ALERT 🚨\nLocation: {latitude}, {longitude}\nSource: Camera {instance_name}\nEvacuate immediately. Stay safe.'
+
+
+def alert_message(instance_name, latitude, longitude):
+    return ALERT_TEMPLATE.format(instance_name=instance_name, latitude=latitude, longitude=longitude)
+
+
+def phone_digits(number, default_country='1'):
+    """Digits of a phone number in E.164 form without the '+', e.g. '(555) 123-4567' -> '15551234567'"""
+    number = str(number).strip()
+    if number.startswith('whatsapp:'):
+        number = number[len('whatsapp:'):]
+    international = number.startswith('+')
+    digits = ''.join(c for c in number if c.isdigit())
+    if not international and len(digits) == 10:
+        digits = default_country + digits
+    return digits
+
+
+def default_recipients():
+    """Recipients for instances without their own: ALERT_RECIPIENTS (comma separated) or PHONE_NUMBER"""
+    recipients = [r.strip() for r in os.getenv('ALERT_RECIPIENTS', '').split(',') if r.strip()]
+    if not recipients and os.getenv('PHONE_NUMBER'):
+        recipients = [os.getenv('PHONE_NUMBER')]
+    return recipients
+
+
+def alert_recipients(instance_config, groups=None):
+    """
+    Who to alert for an instance: its `alert_recipients` plus the members of each group
+    named in its `alert_groups` (groups are defined at the top level of settings.json,
+    e.g. one per region), or the default recipients if it names none.
+    """
+    groups = groups or {}
+    recipients = list((instance_config or {}).get('alert_recipients', []) or [])
+    for group in (instance_config or {}).get('alert_groups', []) or []:
+        recipients.extend(groups.get(group, []))
+    return list(dict.fromkeys(recipients or default_recipients()))
+
+
+class NotificationError(Exception):
+    def __init__(self, message, failed=(), delivered=()):
+        super().__init__(message)
+        self.failed = list(failed)
+        self.delivered = list(delivered)
+
+
+class RateLimiter:
+    """Token bucket shared by every thread sending through one provider"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
+
+
+class Notifier:
+    """
+    A message provider. Subclasses implement send(to, body), raising on failure, and
+    reuse one client across calls. deliver() applies the provider's rate limit.
+    """
+
+    name = 'base'
+    default_rate = 0
+
+    def __init__(self, rate=None):
+        self.limiter = RateLimiter(rate or self.default_rate)
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.errors = 0
+
+    def deliver(self, to, body):
+        self.limiter.acquire()
+        try:
+            self.send(to, body)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        with self._lock:
+            self.sent += 1
+
+    def send(self, to, body):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._lock:
+            return {'provider': self.name, 'sent': self.sent, 'errors': self.errors,
+                    'rate': self.limiter.rate, 'rate_limited_seconds': round(self.limiter.waited, 3)}
+
+
+class TwilioNotifier(Notifier):
+    """WhatsApp messages through Twilio, sharing one client and its keep-alive session"""
+
+    name = 'twilio'
+    default_rate = 1
+
+    def __init__(self, account_sid=None, auth_token=None, from_number=None, rate=None):
+        super().__init__(rate)
+        self.account_sid = account_sid or os.getenv('TWILIO_SID')
+        self.auth_token = auth_token or os.getenv('AUTH_TOKEN')
+        self.from_number = from_number or os.getenv('TWILIO_WHATSAPP_FROM', 'whatsapp:+14155238886')
+        self._client = None
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from twilio.http.http_client import TwilioHttpClient
+                from twilio.rest import Client
+                self._client = Client(self.account_sid, self.auth_token,
+                                      http_client=TwilioHttpClient(pool_connections=True))
+            return self._client
+
+    def send(self, to, body):
+        self.client.messages.create(from_=self.from_number, to=f'whatsapp:+{phone_digits(to)}', body=body)
+
+
+class MetaCloudNotifier(Notifier):
+    """WhatsApp messages through the Meta Cloud API over the shared HTTP pool"""
+
+    name = 'meta'
+    default_rate = 20
+
+    def __init__(self, access_token=None, phone_number_id=None, api_version='v22.0', rate=None):
+        super().__init__(rate)
+        self.access_token = access_token or os.getenv('META_WHATSAPP_TOKEN')
+        self.phone_number_id = phone_number_id or os.getenv('META_WHATSAPP_PHONE_ID')
+        self.url = f"https://graph.facebook.com/{api_version}/{self.phone_number_id}/messages"
+
+    def send(self, to, body):
+        if not self.access_token or not self.phone_number_id:
+            raise NotificationError('WhatsApp API credentials not configured')
+        response = http_pool.post(self.url, headers={'Authorization': f'Bearer {self.access_token}'}, json={
+            'messaging_product': 'whatsapp',
+            'to': phone_digits(to),
+            'type': 'text',
+            'text': {'body': body},
+        })
+        if response.status_code != 200:
+            raise NotificationError(f'Meta Cloud API returned {response.status_code}: {response.text}')
+
+
+class MockNotifier(Notifier):
+    """Records messages instead of sending them, for offline load tests"""
+
+    name = 'mock'
+
+    def __init__(self, latency=None, keep=1000, rate=None):
+        super().__init__(rate)
+        self.latency = float(os.getenv('MOCK_NOTIFIER_LATENCY', '0')) if latency is None else latency
+        self.messages = deque(maxlen=keep)
+
+    def send(self, to, body):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.messages.append({'to': phone_digits(to), 'body': body, 'at': time.time()})
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats['recorded'] = len(self.messages)
+        return stats
+
+
+NOTIFIERS = {cls.name: cls for cls in (TwilioNotifier, MetaCloudNotifier, MockNotifier)}
+
+
+def create_notifier(name=NOTIFIER, rate=NOTIFIER_RATE):
+    if name not in NOTIFIERS:
+        raise ValueError(f"Unknown notifier '{name}', expected one of {', '.join(NOTIFIERS)}")
+    return NOTIFIERS[name](rate=rate or None)
+
+
+class NotifierHub:
+    """
+    Sends one message to many recipients at once through a notifier.
+
+    Recipients are sent to concurrently from a shared pool (the provider's rate limit
+    still applies). notify() raises NotificationError naming the recipients that
+    failed, so a retry can be limited to them.
+    """
+
+    def __init__(self, notifier, workers=NOTIFIER_WORKERS):
+        self.notifier = notifier
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='notifier')
+
+    def notify(self, recipients, body):
+        """Send `body` to every recipient; returns the recipients that were sent to"""
+        futures = {to: self._executor.submit(self.notifier.deliver, to, body) for to in dict.fromkeys(recipients)}
+        delivered, failed = [], []
+        for to, future in futures.items():
+            try:
+                future.result()
+                delivered.append(to)
+            except Exception as e:
+                log.error("Error sending to %s via %s: %s", to, self.notifier.name, e)
+                failed.append(to)
+        if failed:
+            raise NotificationError(f"{len(failed)} of {len(futures)} recipients failed", failed, delivered)
+        return delivered
+
+    def stats(self):
+        return self.notifier.stats()
@@ -0,0 +1,67 @@
+BOX_X_KEYS = ('left', 'right')
+BOX_Y_KEYS = ('top', 'bottom')
+
+
+class Preprocessor:
+    """
+    Prepares the image that is uploaded to the detector.
+
+    The frame can be cropped to a region of interest (given as [left, top, right, bottom]
+    fractions of the frame, e.g. the sky/horizon band), scaled down so its longest side
+    is at most max_dimension, and encoded at a chosen JPEG quality. prepare() returns
+    the transform it applied so map_detections() can put the detector's boxes back into
+    the coordinates of the original frame.
+    """
+
+    def __init__(self, max_dimension=0, jpeg_quality=None, roi=None):
+        self.max_dimension = max_dimension or 0
+        self.jpeg_quality = jpeg_quality
+        self.roi = roi
+
+    @property
+    def enabled(self):
+        return bool(self.max_dimension or self.jpeg_quality or self.roi)
+
+    def prepare(self, frame):
+        """Return (jpeg_bytes, transform) for a decoded frame, or (None, None) if encoding fails."""
+        import cv2
+        height, width = frame.shape[:2]
+        offset_x = offset_y = 0
+        if self.roi:
+            left, top, right, bottom = self.roi
+            offset_x, offset_y = int(left * width), int(top * height)
+            frame = frame[offset_y:int(bottom * height), offset_x:int(right * width)]
+            height, width = frame.shape[:2]
+
+        scale = 1.0
+        if self.max_dimension and max(width, height) > self.max_dimension:
+            scale = self.max_dimension / max(width, height)
+            frame = cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(self.jpeg_quality)] if self.jpeg_quality else []
+        ok, buffer = cv2.imencode('.jpg', frame, params)
+        if not ok:
+            return None, None
+        return buffer.tobytes(), (offset_x, offset_y, scale)
+
+    @staticmethod
+    def map_detections(detection_data, transform):
+        """Map result boxes from the uploaded image back to the original frame."""
+        if transform is None or not isinstance(detection_data, dict):
+            return detection_data
+        offset_x, offset_y, scale = transform
+        if (offset_x, offset_y, scale) == (0, 0, 1.0):
+            return detection_data
+        mapped = dict(detection_data)
+        results = []
+        for result in detection_data.get('results', []) or []:
+            result = dict(result)
+            for key in BOX_X_KEYS:
+                if isinstance(result.get(key), (int, float)):
+                    result[key] = round(result[key] / scale + offset_x)
+            for key in BOX_Y_KEYS:
+                if isinstance(result.get(key), (int, float)):
+                    result[key] = round(result[key] / scale + offset_y)
+            results.append(result)
+        mapped['results'] = results
+        return mapped
@@ -0,0 +1,77 @@
+import threading
+import time
+
+from src.log import get_logger
+
+log = get_logger('push')
+
+# How often queued events are pushed out
+PUSH_INTERVAL = 0.5
+# Fastest a single client may ask to be updated, and the default for clients that don't ask
+MIN_CLIENT_INTERVAL = 0.5
+DEFAULT_CLIENT_INTERVAL = 1.0
+
+
+class EventPusher:
+    """
+    Pushes instance events to Socket.IO clients as they happen.
+
+    Events are coalesced per (event, instance): if an instance captures twice before a
+    client's next update, that client only receives the newest payload. Each client is
+    sent updates at most once per its own interval, which it can set with the
+    'subscribe' event (never faster than MIN_CLIENT_INTERVAL).
+    """
+
+    def __init__(self, socketio, interval=PUSH_INTERVAL):
+        self.socketio = socketio
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._clients = {}
+        self.published = 0
+        self.sent = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name='event-pusher')
+        self._thread.start()
+
+    def publish(self, event, instance_name, payload):
+        message = dict(payload, instance=instance_name)
+        with self._lock:
+            self.published += 1
+            for client in self._clients.values():
+                client['pending'][(event, instance_name)] = message
+
+    def connect(self, sid, interval=DEFAULT_CLIENT_INTERVAL):
+        with self._lock:
+            self._clients[sid] = {'interval': max(MIN_CLIENT_INTERVAL, interval), 'last_sent': 0.0, 'pending': {}}
+
+    def subscribe(self, sid, interval):
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is not None:
+                client['interval'] = max(MIN_CLIENT_INTERVAL, interval)
+
+    def disconnect(self, sid):
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self._clients), 'published': self.published, 'sent': self.sent}
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            outgoing = []
+            with self._lock:
+                for sid, client in self._clients.items():
+                    if client['pending'] and now - client['last_sent'] >= client['interval']:
+                        outgoing.append((sid, client['pending']))
+                        client['pending'] = {}
+                        client['last_sent'] = now
+                        self.sent += len(outgoing[-1][1])
+            for sid, pending in outgoing:
+                for (event, _), message in pending.items():
+                    try:
+                        self.socketio.emit(event, message, to=sid)
+                    except Exception as e:
+                        log.error("Error sending %s to %s: %s", event, sid, e)
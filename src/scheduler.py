@@ -0,0 +1,238 @@
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.instance import RETRY_DELAY
+from src.log import get_logger
+
+log = get_logger('scheduler')
+
+# A capture that starts more than this many seconds after its slot is counted as late
+LATE_TOLERANCE = 1.0
+
+
+class ScheduleEntry:
+    def __init__(self, instance, phase, due):
+        self.instance = instance
+        self.phase = phase
+        self.due = due
+        self.seq = 0
+        self.ready = False
+        self.in_flight = False
+        self.captures = 0
+        self.failures = 0
+        self.late_captures = 0
+        self.missed_slots = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+    def stats(self):
+        return {
+            'frequency': self.instance.frequency,
+            'interval': round(self.instance.interval(), 3),
+            'phase': round(self.phase, 3),
+            'next_due_in': round(max(0.0, self.due - time.monotonic()), 3),
+            'in_flight': self.in_flight,
+            'captures': self.captures,
+            'failures': self.failures,
+            'late_captures': self.late_captures,
+            'missed_slots': self.missed_slots,
+            'last_lag': round(self.last_lag, 3),
+            'max_lag': round(self.max_lag, 3),
+            'avg_lag': round(self.total_lag / self.captures, 3) if self.captures else 0.0,
+        }
+
+
+class CaptureScheduler:
+    """
+    Drives capture cycles for many instances from a single dispatcher thread.
+
+    Each instance gets a fixed phase inside its frequency window, chosen to sit in the
+    largest gap left by instances sharing that frequency, so captures are spread out
+    instead of firing together. Due captures are handed to a bounded worker pool; when
+    every worker is busy the dispatcher waits, and the delay shows up as lag. Instances
+    with adaptive sampling are scheduled on their current interval rather than their
+    frequency, keeping the same phase.
+    """
+
+    def __init__(self, max_workers=32, late_tolerance=LATE_TOLERANCE):
+        self.max_workers = max_workers
+        self.late_tolerance = late_tolerance
+        self._entries = {}
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='capture')
+        self._running = True
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+
+    def add(self, instance, immediate=True):
+        """
+        Start driving an instance. With immediate=True the first capture runs right away,
+        otherwise it waits for the instance's slot (used when restoring many instances at once).
+        """
+        with self._cond:
+            if instance.name in self._entries:
+                raise ValueError(f"Instance '{instance.name}' is already scheduled")
+            now = time.monotonic()
+            phase = self._pick_phase(instance.frequency, now)
+            entry = ScheduleEntry(instance, phase, now)
+            if not immediate:
+                entry.due = self._next_slot(entry, now)
+            self._entries[instance.name] = entry
+            self._push(entry)
+
+    def remove(self, name):
+        """Stop driving an instance; its teardown runs once any in-flight capture finishes."""
+        with self._cond:
+            entry = self._entries.pop(name, None)
+            if entry is None or entry.in_flight:
+                return
+        if entry.ready:
+            self._executor.submit(self._teardown, entry)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.max_workers,
+                'in_flight': sum(1 for e in self._entries.values() if e.in_flight),
+                'instances': {name: e.stats() for name, e in self._entries.items()},
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._running = False
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._cond.notify_all()
+        for entry in entries:
+            if entry.ready and not entry.in_flight:
+                self._teardown(entry)
+        self._executor.shutdown(wait=False)
+
+    def _pick_phase(self, frequency, now):
+        if frequency <= 0:
+            # Captures back to back have no phase to spread
+            return 0.0
+        phases = sorted(e.phase for e in self._entries.values() if e.instance.frequency == frequency)
+        if not phases:
+            # First instance at this frequency keeps its start time as its phase
+            return now % frequency
+        best_start, best_gap = phases[0], 0.0
+        for i, phase in enumerate(phases):
+            following = phases[(i + 1) % len(phases)]
+            gap = (following - phase) % frequency or frequency
+            if gap > best_gap:
+                best_start, best_gap = phase, gap
+        return (best_start + best_gap / 2) % frequency
+
+    def _next_slot(self, entry, after):
+        """First time strictly after `after` that lines up with the entry's phase."""
+        interval = entry.instance.interval()
+        if interval <= 0:
+            return after
+        return after - ((after - entry.phase) % interval) + interval
+
+    def _push(self, entry):
+        self._seq += 1
+        entry.seq = self._seq
+        heapq.heappush(self._heap, (entry.due, entry.seq, entry.instance.name))
+        self._cond.notify()
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                entry = None
+                while self._running and entry is None:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due, seq, name = self._heap[0]
+                    wait = due - time.monotonic()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                    heapq.heappop(self._heap)
+                    candidate = self._entries.get(name)
+                    # Entries that were removed or rescheduled leave stale heap items behind
+                    if candidate is not None and candidate.seq == seq:
+                        entry = candidate
+                if not self._running:
+                    return
+                entry.in_flight = True
+            # Admission control: block here until a worker is free
+            self._slots.acquire()
+            try:
+                self._executor.submit(self._run, entry)
+            except RuntimeError:
+                self._slots.release()
+                return
+
+    def _run(self, entry):
+        instance = entry.instance
+        started = time.monotonic()
+        ran = instance.run
+        ok = False
+        try:
+            if not ran:
+                pass
+            elif not entry.ready:
+                entry.ready = instance.setup()
+                ok = entry.ready
+                if ok:
+                    ok = instance.run_cycle()
+            else:
+                ok = instance.run_cycle()
+        except Exception as e:
+            log.error("Error running capture for '%s': %s", instance.name, e, extra={'instance': instance.name})
+        finally:
+            self._slots.release()
+
+        lag = max(0.0, started - entry.due)
+        with self._cond:
+            entry.in_flight = False
+            if ran:
+                entry.captures += 1
+                entry.last_lag = lag
+                entry.total_lag += lag
+                entry.max_lag = max(entry.max_lag, lag)
+                if lag > self.late_tolerance:
+                    entry.late_captures += 1
+                if not ok:
+                    entry.failures += 1
+
+            if self._entries.get(instance.name) is not entry or not instance.run:
+                if self._entries.get(instance.name) is entry:
+                    del self._entries[instance.name]
+                finished = True
+            else:
+                finished = False
+                now = time.monotonic()
+                if not entry.ready:
+                    # Setup failed; try again on the next slot rather than hammering the source
+                    entry.due = self._next_slot(entry, now)
+                elif ok:
+                    next_due = self._next_slot(entry, entry.due)
+                    if next_due <= now:
+                        interval = instance.interval()
+                        skipped = int((now - next_due) // interval) + 1 if interval > 0 else 0
+                        entry.missed_slots += skipped
+                        next_due = self._next_slot(entry, now)
+                    entry.due = next_due
+                else:
+                    entry.due = now + RETRY_DELAY
+                self._push(entry)
+
+        if finished and entry.ready:
+            self._teardown(entry)
+
+    def _teardown(self, entry):
+        try:
+            entry.instance.teardown()
+        except Exception as e:
+            log.error("Error tearing down '%s': %s", entry.instance.name, e, extra={'instance': entry.instance.name})
+        entry.ready = False
@@ -1,17 +1,28 @@
+import copy
 import json
+import os
+import threading
+from contextlib import contextmanager
 from src.instance import YoutubeInstance, CameraInstance
+from src.adaptive import AdaptiveInterval
+from src.log import get_logger
+
+log = get_logger('settings')
+
+# Seconds before trying again after settings.json could not be written
+SAVE_RETRY_DELAY = 5
 
 def load_settings(file_path='settings.json'):
     try:
         with open(file_path, 'r') as file:
             settings = json.load(file)
-        print("Settings loaded successfully.")
+        log.info("Settings loaded successfully.")
         return settings
     except FileNotFoundError:
-        print(f"Settings file '{file_path}' not found.")
+        log.warning("Settings file '%s' not found.", file_path)
         return {"instances": []}
     except json.JSONDecodeError:
-        print(f"Error decoding JSON from the settings file '{file_path}'.")
+        log.error("Error decoding JSON from the settings file '%s'.", file_path)
         return {"instances": []}
     
 def create_instances(settings):
@@ -47,17 +58,232 @@ def create_instances(settings):
             )
             instances.append(instance)
         else:
-            print(f"Unknown instance type: {instance_type}")
+            log.warning("Unknown instance type: %s", instance_type)
     
     return instances
     
     return instances
 
+def detector_options(instance_config):
+    """Settings shared by every instance type that control what is sent to the detector"""
+    return {
+        'change_threshold': instance_config.get('change_threshold', 0.0),
+        'max_skip_seconds': instance_config.get('max_skip_seconds', 300),
+        'preprocess': {
+            'max_dimension': instance_config.get('detector_max_dimension', 0),
+            'jpeg_quality': instance_config.get('detector_jpeg_quality'),
+            'roi': instance_config.get('detector_roi'),
+        },
+    }
+
+def build_instance(instance_config):
+    """Create the instance object described by a settings entry"""
+    instance_type = instance_config.get('instance_type', 'youtube')
+    
+    if instance_type == 'youtube':
+        instance_obj = YoutubeInstance(
+            id=instance_config['name'],
+            name=instance_config['name'],
+            youtube_url=instance_config['youtube_url'],
+            lookout_endpoint=instance_config['lookout_endpoint'],
+            frequency=instance_config['frequency'],
+            latitude=instance_config.get('latitude', 0.0),
+            longitude=instance_config.get('longitude', 0.0),
+            reader_mode=instance_config.get('reader_mode', 'drain'),
+            **detector_options(instance_config)
+        )
+    elif instance_type == 'camera':
+        instance_obj = CameraInstance(
+            id=instance_config['name'],
+            name=instance_config['name'],
+            camera_url=instance_config['camera_url'],
+            lookout_endpoint=instance_config['lookout_endpoint'],
+            camera_username=instance_config['camera_username'],
+            camera_password=instance_config['camera_password'],
+            folder_path=instance_config['folder_path'],
+            frequency=instance_config['frequency'],
+            latitude=instance_config.get('latitude', 0.0),
+            longitude=instance_config.get('longitude', 0.0),
+            save_archive=instance_config.get('save_archive', True),
+            **detector_options(instance_config)
+        )
+    else:
+        raise ValueError(f"Unknown instance type: {instance_type}")
+    if instance_config.get('adaptive'):
+        instance_obj.sampling = AdaptiveInterval.from_config(instance_config)
+    return instance_obj
+
 def save_settings(settings, file_path='settings.json'):
     try:
         with open(file_path, 'w') as file:
             json.dump(settings, file, indent=4)
-        print("Settings saved successfully.")
+        log.info("Settings saved successfully.")
     except Exception as e:
-        print(f"Error saving settings: {e}")
+        log.error("Error saving settings: %s", e)
+
+
+
+class SettingsStore:
+    """
+    Keeps settings.json parsed in memory.
+
+    Reads are served from memory with instances indexed by name and by normalized name
+    (lowercase, no spaces or underscores). The file is only parsed again when its mtime
+    changes, e.g. after a manual edit. Mutations are serialized under a lock and
+    written back shortly afterwards in one atomic write, so a burst of changes costs a
+    single rewrite of the file.
+    """
+
+    def __init__(self, file_path='settings.json', save_delay=0.5):
+        self.file_path = file_path
+        self.save_delay = save_delay
+        self._lock = threading.RLock()
+        self._settings = {"instances": []}
+        self._by_name = {}
+        self._by_normalized = {}
+        self._mtime = None
+        self._dirty = False
+        self._save_timer = None
+        with self._lock:
+            self._load()
+
+    @staticmethod
+    def normalize(name):
+        return name.lower().replace(' ', '').replace('_', '')
+
+    def snapshot(self):
+        """A copy of the whole settings document."""
+        with self._lock:
+            self._reload_if_changed()
+            return copy.deepcopy(self._settings)
+
+    def instances(self):
+        with self._lock:
+            self._reload_if_changed()
+            return copy.deepcopy(self._settings['instances'])
+
+    def get(self, name):
+        """A copy of the instance config with this exact name, or None."""
+        with self._lock:
+            self._reload_if_changed()
+            config = self._by_name.get(name)
+            return copy.deepcopy(config) if config is not None else None
+
+    def find(self, name):
+        """Like get(), but matches names ignoring case, spaces and underscores."""
+        with self._lock:
+            self._reload_if_changed()
+            config = self._by_normalized.get(self.normalize(name))
+            return copy.deepcopy(config) if config is not None else None
+
+    def names(self):
+        with self._lock:
+            self._reload_if_changed()
+            return list(self._by_name)
+
+    def add(self, config):
+        with self._lock:
+            self._reload_if_changed()
+            self._settings['instances'].append(copy.deepcopy(config))
+            self._changed()
+
+    def update(self, name, changes):
+        """Apply `changes` to an instance config. Returns False if there is no such instance."""
+        with self._lock:
+            self._reload_if_changed()
+            config = self._by_name.get(name)
+            if config is None:
+                return False
+            config.update(copy.deepcopy(changes))
+            self._changed()
+            return True
+
+    def remove(self, name):
+        with self._lock:
+            self._reload_if_changed()
+            self._settings['instances'] = [inst for inst in self._settings['instances'] if inst.get('name') != name]
+            self._changed()
+
+    @contextmanager
+    def mutate(self, name=None):
+        """
+        Edit the live settings in place; they are reindexed and saved afterwards if they
+        changed. With a name, yields that instance's config (or None if there isn't one)
+        instead of the whole document. If the block raises, its edits are rolled back.
+        """
+        with self._lock:
+            self._reload_if_changed()
+            target = self._settings if name is None else self._by_name.get(name)
+            before = copy.deepcopy(target)
+            try:
+                yield target
+            except BaseException:
+                if target is not None:
+                    target.clear()
+                    target.update(before)
+                    self._reindex()
+                raise
+            if target != before:
+                self._changed()
+
+    def flush(self):
+        """Write pending changes to disk now."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._dirty:
+                return
+            data = json.dumps(self._settings, indent=4)
+            tmp_path = f"{self.file_path}.tmp"
+            try:
+                with open(tmp_path, 'w') as file:
+                    file.write(data)
+                os.replace(tmp_path, self.file_path)
+                self._mtime = os.path.getmtime(self.file_path)
+                self._dirty = False
+            except OSError as e:
+                log.error("Error saving settings, retrying in %ss: %s", SAVE_RETRY_DELAY, e)
+                self._schedule_flush(SAVE_RETRY_DELAY)
+
+    def _changed(self):
+        self._reindex()
+        self._dirty = True
+        if self._save_timer is None:
+            self._schedule_flush(self.save_delay)
+
+    def _schedule_flush(self, delay):
+        self._save_timer = threading.Timer(delay, self.flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.file_path)
+            with open(self.file_path, 'r') as file:
+                settings = json.load(file)
+        except FileNotFoundError:
+            mtime, settings = None, {"instances": []}
+        except json.JSONDecodeError:
+            # Most likely caught mid-edit; keep what we have and look again next time
+            log.error("Error decoding JSON from the settings file '%s'.", self.file_path)
+            return
+        settings.setdefault('instances', [])
+        self._settings = settings
+        self._mtime = mtime
+        self._reindex()
+
+    def _reload_if_changed(self):
+        # Unsaved changes in memory are newer than whatever is on disk
+        if self._dirty:
+            return
+        try:
+            mtime = os.path.getmtime(self.file_path)
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self._load()
 
+    def _reindex(self):
+        self._by_name = {inst.get('name'): inst for inst in self._settings['instances']}
+        self._by_normalized = {self.normalize(inst.get('name', '')): inst for inst in self._settings['instances']}
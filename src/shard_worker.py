@@ -0,0 +1,133 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from multiprocessing.connection import Client
+
+from src.detector_gate import detector_gate
+from src.log import get_logger
+from src.metrics import metrics
+from src.scheduler import CaptureScheduler
+from src.settings import build_instance
+from src.sharding import FrameSlot, SHARD_STATS_INTERVAL
+
+log = get_logger('shard')
+
+
+class HostedInstance:
+    """An instance running in this worker and the slot its frames go to"""
+
+    def __init__(self, instance, slot, send):
+        self.instance = instance
+        self.slot = slot
+        self.send = send
+        self._lock = threading.Lock()
+        instance.frame_sink = self.frame
+        instance.add_listener(self.listener)
+
+    def frame(self, instance, image_bytes):
+        with self._lock:
+            if self.slot is None:
+                return
+            seq = self.slot.write(image_bytes)
+        if seq is None:
+            instance.log.warning("Frame of %d bytes does not fit its shared memory slot", len(image_bytes))
+            return
+        self.send(('frame', instance.name, seq, len(image_bytes), hashlib.md5(image_bytes).hexdigest(), time.time()))
+
+    def listener(self, instance, event, payload):
+        if event == 'detections_updated':
+            self.send(('detections', instance.name, payload['detections']))
+
+    def close(self):
+        with self._lock:
+            slot, self.slot = self.slot, None
+        if slot is not None:
+            slot.close()
+
+
+class ShardWorker:
+    """
+    Captures the instances the web process assigns to this process (see ShardPool).
+
+    Commands arrive on the connection: ('add', config, slot name, slot size, immediate),
+    ('remove', name), ('stats',) to report now and ('stop',). Frames go into shared memory with a notice sent back;
+    detections and periodic counters are sent back as they are.
+    """
+
+    def __init__(self, shard_id, conn, threads):
+        self.shard_id = shard_id
+        self.conn = conn
+        self.scheduler = CaptureScheduler(max_workers=threads)
+        self.hosted = {}
+        self._send_lock = threading.Lock()
+
+    def send(self, message):
+        with self._send_lock:
+            self.conn.send(message)
+
+    def serve(self):
+        last_stats = time.monotonic()
+        while True:
+            if self.conn.poll(SHARD_STATS_INTERVAL):
+                command = self.conn.recv()
+                if command[0] == 'add':
+                    self.add(*command[1:])
+                elif command[0] == 'remove':
+                    self.remove(command[1])
+                elif command[0] == 'stats':
+                    last_stats = time.monotonic()
+                    self.send_stats()
+                elif command[0] == 'stop':
+                    return
+            if time.monotonic() - last_stats >= SHARD_STATS_INTERVAL:
+                last_stats = time.monotonic()
+                self.send_stats()
+
+    def add(self, config, slot_name, slot_capacity, immediate):
+        self.remove(config['name'])
+        try:
+            instance = build_instance(config)
+        except Exception as e:
+            log.error("Could not create instance '%s': %s", config['name'], e, extra={'instance': config['name']})
+            return
+        self.hosted[instance.name] = HostedInstance(instance, FrameSlot.attach(slot_name, slot_capacity), self.send)
+        self.scheduler.add(instance, immediate=immediate)
+
+    def remove(self, name):
+        hosted = self.hosted.pop(name, None)
+        if hosted is None:
+            return
+        hosted.instance.stop()
+        self.scheduler.remove(name)
+        hosted.close()
+        metrics.remove(name)
+
+    def send_stats(self):
+        instance_stats = {name: hosted.instance.stats() for name, hosted in self.hosted.items()}
+        self.send(('stats', instance_stats, self.scheduler.stats(), detector_gate.stats(), metrics.export()))
+
+    def shutdown(self):
+        for name in list(self.hosted):
+            self.remove(name)
+        self.scheduler.shutdown()
+
+
+def main():
+    shard_id, host, port, threads = int(sys.argv[1]), sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+    conn = Client((host, port), authkey=bytes.fromhex(os.environ.pop('LOOKOUT_SHARD_AUTHKEY')))
+    conn.send(('hello', shard_id))
+    worker = ShardWorker(shard_id, conn, threads)
+    log.info("Shard %d running (pid %d)", shard_id, os.getpid())
+    try:
+        worker.serve()
+    except (EOFError, OSError):
+        # The web process went away
+        pass
+    finally:
+        worker.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,480 @@
+import bisect
+import hashlib
+import math
+import os
+import secrets
+import struct
+import subprocess
+import sys
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Listener
+
+from src.instance import Instance
+from src.log import get_logger
+from src.metrics import metrics
+
+log = get_logger('sharding')
+
+# Worker processes instances are spread over; defaults to one per core
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', '0')) or os.cpu_count() or 1
+# Capture threads in each worker process
+SHARD_THREADS = int(os.getenv('SHARD_THREADS', '8'))
+# A worker takes at most this factor times its fair share of the instances
+SHARD_LOAD_FACTOR = float(os.getenv('SHARD_LOAD_FACTOR', '1.25'))
+# Largest encoded frame an instance can hand to the web process
+FRAME_SLOT_MB = float(os.getenv('FRAME_SLOT_MB', '8'))
+# Seconds between the counters each worker reports
+SHARD_STATS_INTERVAL = 5
+# Seconds before a worker that exited is started again
+SHARD_RESTART_DELAY = 5
+# Points per worker on the hash ring
+RING_REPLICAS = 64
+
+# Frame header: sequence number and length, padded to 16 bytes
+_HEADER = struct.Struct('<QI')
+_HEADER_SIZE = 16
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hashing of instance names onto workers.
+
+    Each worker owns RING_REPLICAS points on the ring and an instance goes to the first
+    point after its name's hash. assign() caps every worker at `load_factor` times its
+    fair share, passing an instance on to the next worker along the ring when the first
+    is full, so adding or removing an instance only moves the few whose worker changed.
+    """
+
+    def __init__(self, nodes=(), replicas=RING_REPLICAS):
+        self.replicas = replicas
+        self._points = []  # sorted (hash, node)
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for i in range(self.replicas):
+            bisect.insort(self._points, (_hash(f'{node}#{i}'), node))
+
+    def remove(self, node):
+        self._points = [point for point in self._points if point[1] != node]
+
+    def node_for(self, key):
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, (_hash(key),)) % len(self._points)
+        return self._points[i][1]
+
+    def assign(self, keys, load_factor=SHARD_LOAD_FACTOR):
+        """{key: node} for all keys, with no node holding more than its bounded share"""
+        nodes = {node for _, node in self._points}
+        if not nodes:
+            return {}
+        capacity = math.ceil(load_factor * len(keys) / len(nodes))
+        load = dict.fromkeys(nodes, 0)
+        assignment = {}
+        for key in sorted(keys):
+            start = bisect.bisect(self._points, (_hash(key),))
+            for step in range(len(self._points)):
+                node = self._points[(start + step) % len(self._points)][1]
+                if load[node] < capacity:
+                    break
+            load[node] += 1
+            assignment[key] = node
+        return assignment
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the segment with this process's resource
+        # tracker, which would unlink it from under the web process when the worker exits
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class FrameSlot:
+    """
+    Shared memory holding the latest encoded frame of one instance, double-buffered.
+
+    The worker writes frame n into half n % 2, then tells the web process n. The reader
+    copies that half out and checks the header still says n afterwards, so a frame that
+    was overwritten while it was being copied is dropped instead of served torn.
+    """
+
+    def __init__(self, shm, capacity):
+        self.shm = shm
+        self.capacity = capacity
+        self.seq = 0
+
+    @classmethod
+    def create(cls, capacity):
+        return cls(shared_memory.SharedMemory(create=True, size=2 * (_HEADER_SIZE + capacity)), capacity)
+
+    @classmethod
+    def attach(cls, name, capacity):
+        return cls(_attach(name), capacity)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _offset(self, seq):
+        return (seq % 2) * (_HEADER_SIZE + self.capacity)
+
+    def write(self, data):
+        """Store a frame and return its sequence number, or None if it does not fit"""
+        if len(data) > self.capacity:
+            return None
+        self.seq += 1
+        offset = self._offset(self.seq)
+        buf = self.shm.buf
+        _HEADER.pack_into(buf, offset, 0, 0)
+        buf[offset + _HEADER_SIZE:offset + _HEADER_SIZE + len(data)] = data
+        _HEADER.pack_into(buf, offset, self.seq, len(data))
+        return self.seq
+
+    def read(self, seq):
+        """Frame number `seq`, or None if it has already been overwritten"""
+        offset = self._offset(seq)
+        buf = self.shm.buf
+        stored, length = _HEADER.unpack_from(buf, offset)
+        if stored != seq or not seq:
+            return None
+        data = bytes(buf[offset + _HEADER_SIZE:offset + _HEADER_SIZE + length])
+        if _HEADER.unpack_from(buf, offset)[0] != seq:
+            return None
+        return data
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class RemoteInstance(Instance):
+    """
+    Web-process stand-in for an instance that captures in a shard worker.
+
+    It has the attributes and listeners the app uses and replays the frames and
+    detections its worker reports, so the dashboard, alerts, detection history and the
+    archive work as they do for instances running in this process. Frames are read
+    from the instance's shared-memory slot rather than from ./frames.
+    """
+
+    def __init__(self, config):
+        instance_type = config.get('instance_type', 'youtube')
+        if instance_type not in ('youtube', 'camera'):
+            raise ValueError(f"Unknown instance type: {instance_type}")
+        super().__init__(config['name'], config['name'], config['frequency'], config['lookout_endpoint'],
+                         config.get('latitude', 0.0), config.get('longitude', 0.0))
+        self.config = config
+        self.instance_type = instance_type
+        self.image_file = f"./frames/{instance_type}_{self.name.lower().replace(' ', '')}.jpg"
+        self.shard = None
+        self.remote_stats = {}
+        self._slot = None
+        self._frame_seq = 0
+        self._lock = threading.Lock()
+
+    def attach_slot(self, slot):
+        """Switch to a new slot, e.g. when the instance moves to another worker"""
+        with self._lock:
+            previous, self._slot, self._frame_seq = self._slot, slot, 0
+        if previous is not None:
+            previous.close(unlink=True)
+
+    def frame_bytes(self):
+        """The latest frame, or None if there is none"""
+        with self._lock:
+            if self._slot is None:
+                return None
+            # A frame that was overwritten has a successor whose notice is on its way
+            return self._slot.read(self._frame_seq) or self._slot.read(self._frame_seq + 1)
+
+    def frame_received(self, seq, size, content_hash, timestamp):
+        with self._lock:
+            self._frame_seq = seq
+        if self.archive_ring is not None:
+            data = self.frame_bytes()
+            if data is not None:
+                self.archive_ring.append(data, timestamp)
+        self.frame_version += 1
+        self.notify('frame_updated', {
+            'url': f"/frames/{os.path.basename(self.image_file)}",
+            'version': self.frame_version,
+            'modified_at': timestamp,
+            'size': size,
+            'hash': content_hash,
+        })
+
+    def detections_received(self, detection_data):
+        self.latest_detections = detection_data
+        self.detections_version += 1
+        self.notify('detections_updated', {
+            'detections': detection_data,
+            'version': self.detections_version,
+        })
+
+    def interval(self):
+        return self.remote_stats.get('effective_frequency', self.frequency)
+
+    def stats(self):
+        return dict(self.remote_stats, instance_type=self.instance_type, frequency=self.frequency, shard=self.shard)
+
+    def close(self):
+        self.attach_slot(None)
+
+
+class Shard:
+    def __init__(self, shard_id):
+        self.id = shard_id
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+        self.restarts = 0
+        self.scheduler = {}
+        self.detectors = {}
+        # Stats messages received so far, to tell when a requested report has arrived
+        self.reports = 0
+
+    def send(self, message):
+        """Send a command if the worker is connected. Returns False if it is not."""
+        with self.lock:
+            if self.conn is None:
+                return False
+            try:
+                self.conn.send(message)
+            except OSError as e:
+                log.error("Error sending to shard %d: %s", self.id, e)
+                return False
+            return True
+
+
+class ShardPool:
+    """
+    Runs instances in a pool of worker processes, so capture, decoding, hashing and
+    response parsing for different instances use different cores.
+
+    Instances are assigned to workers by name on a HashRing and reassigned whenever an
+    instance is added or removed. Each worker (src/shard_worker.py) runs its instances
+    on its own CaptureScheduler, puts every frame in the instance's FrameSlot and sends
+    the web process a short notice over a local connection; detections and counters
+    come back the same way. A worker that exits is started again and given its
+    instances back.
+    """
+
+    def __init__(self, workers=SHARD_WORKERS, threads=SHARD_THREADS, slot_mb=FRAME_SLOT_MB):
+        self.threads = threads
+        self.slot_capacity = int(slot_mb * 1024 * 1024)
+        self._authkey = secrets.token_bytes(32)
+        self._listener = Listener(('127.0.0.1', 0), authkey=self._authkey)
+        self._lock = threading.Lock()
+        # Held while working out and sending commands, so they reach workers in the order they
+        # were decided. Sending happens with only this lock held: receive loops need _lock
+        # to handle messages, and a worker blocked on a full pipe to us must not block us.
+        self._send_lock = threading.Lock()
+        self._reports = threading.Condition()
+        self._shards = {i: Shard(i) for i in range(workers)}
+        self._ring = HashRing(self._shards)
+        self._instances = {}  # name -> RemoteInstance
+        self._assignment = {}  # name -> shard id
+        self._running = True
+        threading.Thread(target=self._accept_loop, daemon=True, name='shard-accept').start()
+        for shard in self._shards.values():
+            self._spawn(shard)
+
+    def proxy(self, instance_config):
+        return RemoteInstance(instance_config)
+
+    def add(self, instance, immediate=True):
+        with self._send_lock:
+            with self._lock:
+                if instance.name in self._instances:
+                    raise ValueError(f"Instance '{instance.name}' is already running")
+                self._instances[instance.name] = instance
+                commands = self._rebalance({instance.name: immediate})
+            self._send(commands)
+
+    def remove(self, name):
+        with self._send_lock:
+            with self._lock:
+                instance = self._instances.pop(name, None)
+                shard_id = self._assignment.pop(name, None)
+                commands = [] if shard_id is None else [(self._shards[shard_id], 'remove', name)]
+                commands += self._rebalance({})
+            self._send(commands)
+        if instance is not None:
+            instance.close()
+
+    def stats(self):
+        with self._lock:
+            assigned = {}
+            for name, shard_id in self._assignment.items():
+                assigned.setdefault(shard_id, []).append(name)
+            return {
+                'workers': len(self._shards),
+                'shards': {shard.id: {
+                    'pid': shard.process.pid if shard.process is not None else None,
+                    'connected': shard.conn is not None,
+                    'restarts': shard.restarts,
+                    'instances': sorted(assigned.get(shard.id, [])),
+                    'scheduler': shard.scheduler,
+                } for shard in self._shards.values()},
+            }
+
+    def refresh_stats(self, timeout=2):
+        """Have every connected worker report its counters now and wait (up to `timeout`) for them"""
+        with self._reports:
+            waiting = {shard: shard.reports for shard in self._shards.values()}
+        waiting = {shard: seen for shard, seen in waiting.items() if shard.send(('stats',))}
+        with self._reports:
+            self._reports.wait_for(lambda: all(shard.reports > seen for shard, seen in waiting.items()), timeout)
+
+    def detector_stats(self):
+        """Latest DetectorGate stats reported by each worker"""
+        return {shard.id: shard.detectors for shard in self._shards.values()}
+
+    def shutdown(self, timeout=5):
+        self._running = False
+        for shard in self._shards.values():
+            shard.send(('stop',))
+        self._listener.close()
+        for shard in self._shards.values():
+            if shard.process is None:
+                continue
+            try:
+                shard.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                shard.process.kill()
+        with self._lock:
+            instances = list(self._instances.values())
+        for instance in instances:
+            instance.close()
+
+    def _rebalance(self, immediate):
+        """
+        Reassign instances and return the commands that move them, for _send(). Call with
+        the lock held.
+        """
+        commands = []
+        assignment = self._ring.assign(list(self._instances))
+        for name, shard_id in assignment.items():
+            previous = self._assignment.get(name)
+            if previous == shard_id:
+                continue
+            if previous is not None:
+                log.info("Moving instance from shard %d to shard %d", previous, shard_id, extra={'instance': name})
+                commands.append((self._shards[previous], 'remove', name))
+            self._assignment[name] = shard_id
+            self._instances[name].shard = shard_id
+            commands.append((self._shards[shard_id], 'start', self._instances[name], immediate.get(name, False)))
+        return commands
+
+    def _send(self, commands):
+        """Send the commands worked out under the lock. Call with only _send_lock held."""
+        for shard, kind, *args in commands:
+            if kind == 'remove':
+                shard.send(('remove', *args))
+            else:
+                self._start(shard, *args)
+
+    def _start(self, shard, instance, immediate):
+        if shard.conn is None:
+            # Handed over once the worker connects
+            return
+        slot = FrameSlot.create(self.slot_capacity)
+        instance.attach_slot(slot)
+        shard.send(('add', instance.config, slot.name, self.slot_capacity, immediate))
+
+    def _spawn(self, shard):
+        if not self._running:
+            return
+        if shard.process is not None and shard.process.poll() is None:
+            shard.process.kill()
+            shard.process.wait()
+        host, port = self._listener.address
+        env = dict(os.environ, LOOKOUT_SHARD_AUTHKEY=self._authkey.hex())
+        shard.process = subprocess.Popen(
+            [sys.executable, '-m', 'src.shard_worker', str(shard.id), host, str(port), str(self.threads)], env=env)
+        log.info("Started shard %d (pid %d)", shard.id, shard.process.pid)
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn = self._listener.accept()
+                _, shard_id = conn.recv()
+                shard = self._shards[shard_id]
+            except Exception as e:
+                if self._running:
+                    log.error("Error accepting shard worker: %s", e)
+                continue
+            with shard.lock:
+                shard.conn = conn
+            threading.Thread(target=self._receive_loop, args=(shard, conn), daemon=True,
+                             name=f'shard-{shard_id}').start()
+            with self._send_lock:
+                with self._lock:
+                    commands = [(shard, 'start', self._instances[name], False)
+                                for name, assigned in self._assignment.items() if assigned == shard_id]
+                self._send(commands)
+
+    def _receive_loop(self, shard, conn):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            try:
+                self._dispatch(shard, message)
+            except Exception as e:
+                log.error("Error handling message from shard %d: %s", shard.id, e)
+        with shard.lock:
+            if shard.conn is conn:
+                shard.conn = None
+        conn.close()
+        if self._running:
+            shard.restarts += 1
+            log.warning("Shard %d exited, restarting in %ss", shard.id, SHARD_RESTART_DELAY)
+            timer = threading.Timer(SHARD_RESTART_DELAY, self._spawn, args=(shard,))
+            timer.daemon = True
+            timer.start()
+
+    def _dispatch(self, shard, message):
+        kind = message[0]
+        if kind == 'stats':
+            _, instance_stats, scheduler_stats, detector_stats, exported = message
+            shard.scheduler = scheduler_stats
+            shard.detectors = detector_stats
+            metrics.absorb(f'shard-{shard.id}', exported)
+            for name, stats in instance_stats.items():
+                instance = self._owned(shard, name)
+                if instance is not None:
+                    instance.remote_stats = stats
+            with self._reports:
+                shard.reports += 1
+                self._reports.notify_all()
+            return
+        instance = self._owned(shard, message[1])
+        # Notices from a worker the instance has moved away from are stale
+        if instance is None:
+            return
+        if kind == 'frame':
+            instance.frame_received(*message[2:])
+        elif kind == 'detections':
+            instance.detections_received(message[2])
+
+    def _owned(self, shard, name):
+        with self._lock:
+            if self._assignment.get(name) != shard.id:
+                return None
+            return self._instances.get(name)
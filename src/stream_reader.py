@@ -0,0 +1,100 @@
+import threading
+import time
+
+# Consecutive grab failures before the stream is reported as broken
+MAX_GRAB_FAILURES = 50
+
+
+class LatestFrameReader:
+    """
+    Drains a VideoCapture on a background thread so every sample is the newest frame.
+
+    The drain thread only calls grab(), which keeps the decoder in step with the live
+    stream but skips the colour conversion and copy that read() does for every frame.
+    read() then retrieve()s whatever was grabbed last, so the only frame that is ever
+    converted is the one that is actually sampled.
+    """
+
+    def __init__(self, cap, name):
+        self.cap = cap
+        self.name = name
+        self.frames_grabbed = 0
+        self.frames_read = 0
+        self._lock = threading.Lock()
+        self._has_frame = False
+        self._sequence = 0
+        self._last_read_sequence = 0
+        self._failures = 0
+        self._running = False
+        self._thread = None
+        self._release = False
+        import cv2
+        # Don't let the backend queue frames behind the one we are about to grab
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    @property
+    def failed(self):
+        return self._failures >= MAX_GRAB_FAILURES
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._drain, daemon=True, name=f"reader-{self.name}")
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def close(self):
+        """
+        Stop draining and release the capture. If the drain thread is still stuck in
+        grab() after the join timeout, it releases the capture itself once grab() returns,
+        so the capture is never freed while native code is using it.
+        """
+        thread = self._thread
+        # Not under the lock: the drain thread holds it for as long as grab() is stuck
+        self._release = True
+        self.stop()
+        if thread is None or not thread.is_alive():
+            self._release_capture()
+
+    def _release_capture(self):
+        with self._lock:
+            if self.cap is not None:
+                self.cap.release()
+                self.cap = None
+
+    def read(self):
+        """
+        Return (ok, frame, fresh) for the most recently grabbed frame. `fresh` is False
+        when nothing new has been grabbed since the previous read.
+        """
+        with self._lock:
+            if not self._has_frame or self.failed or self.cap is None:
+                return False, None, False
+            ret, frame = self.cap.retrieve()
+            fresh = self._sequence != self._last_read_sequence
+            self._last_read_sequence = self._sequence
+        if ret:
+            self.frames_read += 1
+        return ret, frame, fresh
+
+    def _drain(self):
+        while self._running:
+            with self._lock:
+                ok = self.cap.grab()
+                if ok:
+                    self._has_frame = True
+                    self._sequence += 1
+                    self._failures = 0
+                else:
+                    self._failures += 1
+            if ok:
+                self.frames_grabbed += 1
+            else:
+                # Give a stalled stream a moment before trying again
+                time.sleep(0.1)
+        if self._release:
+            self._release_capture()
@@ -0,0 +1,161 @@
+import os
+import re
+import threading
+import time
+
+from src.log import get_logger
+
+log = get_logger('resolver')
+
+ydl_opts = {
+    'format': 'bestvideo[ext=mp4]/bestvideo/best',
+    'quiet': True,
+}
+
+# Used when the resolved URL doesn't say when it expires
+STREAM_URL_TTL = int(os.getenv('STREAM_URL_TTL', '3600'))
+# Resolve again this many seconds before the URL expires
+STREAM_REFRESH_MARGIN = int(os.getenv('STREAM_REFRESH_MARGIN', '600'))
+
+_EXPIRE_PATTERN = re.compile(r'[/?&]expire[=/](\d+)')
+# Sources opened as they are rather than resolved with yt-dlp: stream protocols, local
+# files and direct links to video files or MJPEG streams
+_DIRECT_PATTERN = re.compile(r'^(?:rtsp|rtmp|udp|file)://|^[^:]*$|\.(?:mp4|mkv|avi|mjpg|mjpeg|m3u8)(?:[?#]|$)', re.IGNORECASE)
+
+
+def extract_youtube_id(url):
+    patterns = [
+        r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/)([^&\n?#]+)',
+        r'youtube\.com\/watch\?.*v=([^&\n?#]+)'
+    ]
+
+    for pattern in patterns:
+        match = re.search(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
+
+def is_direct_stream(url):
+    return extract_youtube_id(url) is None and _DIRECT_PATTERN.search(url) is not None
+
+
+class ResolvedStream:
+    def __init__(self, url, expires_at, refresh_margin):
+        self.url = url
+        self.expires_at = expires_at
+        self.resolved_at = time.time()
+        # Short-lived URLs are refreshed halfway through their lifetime instead
+        lifetime = max(0, expires_at - self.resolved_at)
+        self.refresh_at = expires_at - min(refresh_margin, lifetime / 2)
+
+
+class StreamResolver:
+    """
+    Resolves YouTube URLs to stream URLs with yt-dlp and caches them by video ID.
+
+    Cached URLs are handed out until they get within the refresh margin of their expiry.
+    Different videos resolve in parallel (each thread has its own YoutubeDL), while
+    instances asking for the same video at the same time share a single resolve.
+    """
+
+    def __init__(self, default_ttl=STREAM_URL_TTL, refresh_margin=STREAM_REFRESH_MARGIN):
+        self.default_ttl = default_ttl
+        self.refresh_margin = refresh_margin
+        self._cache = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.resolves = 0
+        self.cache_hits = 0
+        self.failures = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def key_for(self, youtube_url):
+        return extract_youtube_id(youtube_url) or youtube_url
+
+    def resolve(self, youtube_url, force=False):
+        """Return a ResolvedStream for the URL, or None if yt-dlp couldn't resolve it."""
+        key = self.key_for(youtube_url)
+        while True:
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached is not None and not force and not self.needs_refresh(cached):
+                    self.cache_hits += 1
+                    return cached
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = threading.Event()
+                    self._pending[key] = pending
+                    break
+            # Someone else is resolving this video; use their result
+            pending.wait()
+            force = False
+
+        try:
+            return self._resolve(key, youtube_url)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def needs_refresh(self, resolved):
+        return time.time() >= resolved.refresh_at
+
+    def invalidate(self, youtube_url):
+        with self._lock:
+            self._cache.pop(self.key_for(youtube_url), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached': len(self._cache),
+                'resolves': self.resolves,
+                'cache_hits': self.cache_hits,
+                'failures': self.failures,
+                'last_latency': round(self.last_latency, 3),
+                'max_latency': round(self.max_latency, 3),
+                'avg_latency': round(self.total_latency / self.resolves, 3) if self.resolves else 0.0,
+            }
+
+    def _ydl(self):
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            # yt-dlp takes a while to import and only YouTube sources need it
+            import yt_dlp
+            ydl = yt_dlp.YoutubeDL(ydl_opts)
+            self._local.ydl = ydl
+        return ydl
+
+    def _resolve(self, key, youtube_url):
+        started = time.time()
+        try:
+            if is_direct_stream(youtube_url):
+                info = {'url': youtube_url}
+            else:
+                info = self._ydl().extract_info(youtube_url, download=False)
+        except Exception as e:
+            log.error("Error resolving %s: %s", youtube_url, e)
+            info = None
+        latency = time.time() - started
+
+        with self._lock:
+            self.resolves += 1
+            self.last_latency = latency
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if info is None or not info.get('url'):
+                self.failures += 1
+                self._cache.pop(key, None)
+                return None
+            stream_url = info['url']
+            match = _EXPIRE_PATTERN.search(stream_url)
+            expires_at = int(match.group(1)) if match else started + self.default_ttl
+            resolved = ResolvedStream(stream_url, expires_at, self.refresh_margin)
+            self._cache[key] = resolved
+            return resolved
+
+
+stream_resolver = StreamResolver()